@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Import-time benchmark for the gmail-ai-bot entry points.
+
+Imports each entry point in a fresh interpreter with `python -X importtime`,
+reports the cumulative import time and fails when a heavy dependency gets
+imported eagerly or an entry point exceeds its time budget.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5] [--budget-scale 1.0]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Repository root, so the benchmark measures the working tree rather than an installed copy
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Entry points and their import time budgets in milliseconds
+ENTRY_POINTS = {
+    'gmail_ai_bot': 150,
+    'gmail_ai_bot.main': 150,
+    'gmail_ai_bot.app': 1000,
+}
+
+# Dependencies that must only be imported on first use
+HEAVY_MODULES = [
+    'torch',
+    'transformers',
+    'onnxruntime',
+    'googleapiclient',
+    'google_auth_oauthlib',
+    'openai',
+    'ollama',
+    'google.generativeai',
+    'huggingface_hub',
+]
+
+def measure_import(module):
+    """
+    Import a module in a fresh interpreter and collect its import profile.
+
+    Args:
+        module: Dotted name of the module to import.
+
+    Returns:
+        A tuple of (cumulative import time in ms, set of imported module names).
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=env, cwd=REPO_ROOT
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    cumulative_us, imported = None, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        imported.add(name)
+        if name == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, imported
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure gmail-ai-bot import times")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh-interpreter runs per entry point")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiplier applied to all time budgets")
+    args = parser.parse_args()
+
+    failures = []
+    for module, budget_ms in ENTRY_POINTS.items():
+        timings, imported = [], set()
+        for _ in range(args.runs):
+            elapsed_ms, imported = measure_import(module)
+            timings.append(elapsed_ms)
+        median_ms = statistics.median(timings)
+        budget_ms *= args.budget_scale
+
+        eager = [name for name in HEAVY_MODULES if name in imported]
+        status = 'ok' if median_ms <= budget_ms and not eager else 'FAIL'
+        print(f"{module:<24} median {median_ms:8.1f} ms  (budget {budget_ms:.0f} ms)  {status}")
+
+        if median_ms > budget_ms:
+            failures.append(f"{module} took {median_ms:.1f} ms, budget is {budget_ms:.0f} ms")
+        if eager:
+            failures.append(f"{module} eagerly imports {', '.join(eager)}")
+
+    for failure in failures:
+        print(f"  - {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import os
+import sys
+
+import pytest
+
+# Add the package directory to the path, like test_package.py does
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Point the package at an empty SQLite database of its own, created on first use."""
+    from gmail_ai_bot import connector, database
+
+    monkeypatch.setattr(database, 'DB_PATH', f"sqlite:///{tmp_path / 'database.db'}")
+    monkeypatch.setattr(database, '_engine', None)
+    monkeypatch.setattr(connector, '_known_message_ids', None)
+    yield database
+    database.Session.remove()
+    if database._engine is not None:
+        database._engine.dispose()
+
+class FakeRequest:
+    """A Gmail API request whose execute() calls a function."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def execute(self):
+        return self.function()
+
+class FakeBatch:
+    """A Gmail HTTP batch request that runs its requests one by one."""
+
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        self.gmail.batches.append([request_id for _, request_id in self.requests])
+        for request, request_id in self.requests:
+            try:
+                response, exception = request.execute(), None
+            except Exception as e:
+                response, exception = None, e
+            self.callback(request_id, response, exception)
+
+class FakeGmail:
+    """
+    In-memory Gmail mailbox with the parts of the Gmail API the bot uses.
+
+    Messages are added with add_message; every change bumps the history ID and is recorded as a
+    messageAdded history record. The calls made are recorded for the tests to inspect.
+    """
+
+    def __init__(self, list_page_size=None):
+        self.mailbox = {}
+        self.history_records = []
+        self.history_id = 100
+        self.list_page_size = list_page_size
+        self.gets = []
+        self.batches = []
+        self.list_calls = []
+        self.history_calls = []
+        self.modified = []
+        self.failing_gets = set()
+        self.failing_modifies = 0
+
+    def add_message(self, message_id, subject='Hello', body='Hi there', thread_id=None, label_ids=('INBOX', 'UNREAD'),
+                    headers=()):
+        import base64
+
+        self.history_id += 1
+        message = {
+            'id': message_id,
+            'threadId': thread_id or f"thread-{message_id}",
+            'labelIds': list(label_ids),
+            'snippet': body[:20],
+            'internalDate': str(self.history_id * 1000),
+            'historyId': str(self.history_id),
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': [{'name': 'Subject', 'value': subject}, {'name': 'From', 'value': 'sender@example.com'},
+                            {'name': 'Message-ID', 'value': f"<{message_id}@example.com>"}, *headers],
+                'body': {'data': base64.urlsafe_b64encode(body.encode()).decode()},
+            },
+        }
+        self.mailbox[message_id] = message
+        self.history_records.append({'id': str(self.history_id), 'messagesAdded': [{'message': {
+            'id': message_id, 'threadId': message['threadId'], 'labelIds': list(label_ids)
+        }}]})
+        return message
+
+    def _not_found(self, message_id):
+        from googleapiclient.errors import HttpError
+        from httplib2 import Response
+
+        return HttpError(Response({'status': 404}), f"Message {message_id} not found".encode())
+
+    def _get(self, message_id, kwargs):
+        self.gets.append((message_id, kwargs.get('format', 'full')))
+        if message_id in self.failing_gets:
+            raise OSError(f"Connection reset fetching {message_id}")
+        if message_id not in self.mailbox:
+            raise self._not_found(message_id)
+        return self.mailbox[message_id]
+
+    def _list(self, kwargs):
+        self.list_calls.append(kwargs)
+        ids = [message_id for message_id, message in self.mailbox.items()
+               if {'INBOX', 'UNREAD'} <= set(message['labelIds'])]
+        page_size = self.list_page_size or kwargs.get('maxResults', 100)
+        start = int(kwargs.get('pageToken', 0))
+        response = {'messages': [{'id': message_id, 'threadId': self.mailbox[message_id]['threadId']}
+                                 for message_id in ids[start:start + page_size]]}
+        if start + page_size < len(ids):
+            response['nextPageToken'] = str(start + page_size)
+        return response
+
+    def _history(self, kwargs):
+        self.history_calls.append(kwargs)
+        records = [record for record in self.history_records if int(record['id']) > int(kwargs['startHistoryId'])]
+        return {'history': records, 'historyId': str(self.history_id)}
+
+    def _batch_modify(self, body):
+        if self.failing_modifies:
+            self.failing_modifies -= 1
+            raise OSError("Rate limit exceeded")
+        self.modified.append(body)
+        for message_id in body['ids']:
+            labels = self.mailbox[message_id]['labelIds']
+            labels[:] = [label for label in labels if label not in body.get('removeLabelIds', [])]
+            labels.extend(body.get('addLabelIds', []))
+        return {}
+
+    # Gmail API surface
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return FakeHistory(self)
+
+    def getProfile(self, userId):
+        return FakeRequest(lambda: {'historyId': str(self.history_id)})
+
+    def get(self, userId, id, **kwargs):
+        return FakeRequest(lambda: self._get(id, kwargs))
+
+    def list(self, **kwargs):
+        return FakeRequest(lambda: self._list(kwargs))
+
+    def batchModify(self, userId, body):
+        return FakeRequest(lambda: self._batch_modify(body))
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+class FakeHistory:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, **kwargs):
+        return FakeRequest(lambda: self.gmail._history(kwargs))
+
+@pytest.fixture
+def gmail_service():
+    """An empty fake Gmail mailbox."""
+    return FakeGmail()
+
+@pytest.fixture(params=[False, True], ids=['sequential', 'pipeline'])
+def run(request, database, gmail_service, monkeypatch):
+    """
+    Run process_unread_emails on the fake mailbox with a fake classifier and responder.
+
+    Mail with 'urgent' in its subject needs a response; drafts fail for the message IDs in run.failing_drafts.
+    """
+    from gmail_ai_bot import bot
+    from gmail_ai_bot.config import RESPONSE_CATEGORIES
+
+    response_category = sorted(RESPONSE_CATEGORIES)[0]
+    drafted, responded = set(), []
+    failing_drafts = set()
+
+    def auto_respond_many(service, emails, label_batcher=None):
+        for email in emails:
+            if email['category'] not in RESPONSE_CATEGORIES:
+                label_batcher.mark_as_read(email['message_id'])
+            elif email['message_id'] not in drafted:
+                responded.append(email['message_id'])
+                if email['message_id'] not in failing_drafts:
+                    drafted.add(email['message_id'])
+
+    monkeypatch.setattr(bot, 'categorize_emails', lambda emails: [
+        response_category if 'urgent' in subject.lower() else 'not important' for subject, _ in emails
+    ])
+    monkeypatch.setattr(bot, 'auto_respond_many', auto_respond_many)
+    monkeypatch.setattr(bot, 'get_drafted_message_ids', lambda message_ids: drafted & set(message_ids))
+    monkeypatch.setattr(bot, 'initialize_training_data', lambda: None)
+    monkeypatch.setattr(bot, 'append_to_training_data', lambda *args: None)
+    monkeypatch.setattr(bot, 'flush_training_data', lambda: None)
+    monkeypatch.setattr(bot, 'INCREMENTAL_SYNC', True)
+    monkeypatch.setattr(bot, 'PIPELINE_ENABLED', request.param)
+    # The pipeline workers share the fake mailbox
+    monkeypatch.setattr(bot, 'build_gmail_service', lambda creds: gmail_service)
+    monkeypatch.setattr(bot, 'get_gmail_service_pool', lambda service: bot.GmailServicePool(creds=None))
+
+    def run_once():
+        bot.process_unread_emails(gmail_service)
+
+    run_once.gmail = gmail_service
+    run_once.responded = responded
+    run_once.failing_drafts = failing_drafts
+    return run_once
@@ -7,8 +7,29 @@ based on their importance using various LLM providers.
 
 __version__ = '0.1.0'
 
-# Import main components to make them available at the package level
-from .bot import authenticate_gmail, process_unread_emails
-from .llm_service import LLMService
-from .categorizer import categorize_email
-from .responser import auto_respond
\ No newline at end of file
+# Main components available at the package level. They are imported lazily on first
+# access so that importing the package (e.g. for the CLI) doesn't load heavy dependencies.
+_LAZY_ATTRIBUTES = {
+    'authenticate_gmail': '.bot',
+    'get_gmail_service': '.bot',
+    'process_unread_emails': '.bot',
+    'LLMService': '.llm_service',
+    'get_llm_service': '.llm_service',
+    'LLMRouter': '.llm_router',
+    'get_llm_router': '.llm_router',
+    'categorize_email': '.categorizer',
+    'categorize_emails': '.categorizer',
+    'auto_respond': '.responser',
+    'auto_respond_many': '.responser',
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
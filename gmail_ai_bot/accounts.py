@@ -0,0 +1,288 @@
+import argparse
+import logging
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from .config import ACCOUNTS_DIR, POLLING_INTERVAL_MINUTES, CLASSIFIER_SERVER_ADDRESS, LOG_LEVEL, LOG_FORMAT
+from .main import _raise_keyboard_interrupt
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+# Files of an account directory
+ACCOUNT_TOKEN_FILE = 'token.pickle'
+ACCOUNT_ENV_FILE = '.env'
+
+# Seconds between the start of two account workers
+WORKER_START_INTERVAL_SECONDS = 2
+
+# Seconds between two checks of the account workers, and before an exited worker is restarted
+WORKER_CHECK_SECONDS = 1
+WORKER_RESTART_SECONDS = 30
+
+def list_accounts(directory=ACCOUNTS_DIR):
+    """
+    List the accounts that have been authorized.
+
+    Args:
+        directory: The accounts directory.
+
+    Returns:
+        The sorted names of the account subdirectories holding a token file.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name for name in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, name, ACCOUNT_TOKEN_FILE))
+    )
+
+def account_environment(name, directory=ACCOUNTS_DIR, overrides=None):
+    """
+    Build the environment of a worker process serving one account.
+
+    The account gets its own token file, SQLite database and training data directory in its
+    subdirectory. Settings in the account's .env file take precedence over all others.
+
+    Args:
+        name: The account name.
+        directory: The accounts directory.
+        overrides: Optional dict of further settings, e.g. the classifier server address.
+
+    Returns:
+        The environment variables as a dict.
+    """
+    from dotenv import dotenv_values
+
+    account_dir = os.path.abspath(os.path.join(directory, name))
+    env = dict(os.environ)
+    env.update({
+        'GMAIL_ACCOUNT': name,
+        'TOKEN_FILE': os.path.join(account_dir, ACCOUNT_TOKEN_FILE),
+        'DB_PATH': f"sqlite:///{os.path.join(account_dir, 'database.db')}",
+        'TRAINING_DATA_DIR': os.path.join(account_dir, 'training_data'),
+        'TRAINING_DATA_PATH': os.path.join(account_dir, 'email_training_data.csv'),
+        'LOG_FORMAT': f"[{name.replace('%', '%%')}] {LOG_FORMAT}",
+    })
+    env.update(overrides or {})
+    env_file = os.path.join(account_dir, ACCOUNT_ENV_FILE)
+    if os.path.isfile(env_file):
+        env.update({key: value for key, value in dotenv_values(env_file).items() if value is not None})
+    return env
+
+class AccountSupervisor:
+    """
+    Serves several Gmail accounts, each with a long-lived worker process of its own.
+
+    Every worker runs the polling scheduler of one account (`gmail-ai-bot --process`), so its
+    Gmail service, LLM clients, known message IDs and caches are kept between polls. The workers
+    don't load the classification model: they send their emails to one classifier server process,
+    started here unless CLASSIFIER_SERVER_ADDRESS points to a running one. Workers that exit are
+    restarted after a delay; the classifier server is restarted on the same address as soon as it
+    exits, the emails the workers couldn't categorize meanwhile are retried in their next polls.
+    """
+
+    def __init__(self, accounts, directory=ACCOUNTS_DIR):
+        """
+        Initialize the supervisor.
+
+        Args:
+            accounts: Names of the accounts to serve.
+            directory: The accounts directory.
+        """
+        self.accounts = list(accounts)
+        self.directory = directory
+        self._environments = {}
+        self._processes = {}
+        self._restart_at = {}
+        self._classifier_server = None
+        self._classifier_authkey = None
+        self._classifier_restart_at = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _start_worker(self, name):
+        """Start the worker process of an account."""
+        # A session of its own keeps Ctrl+C in the terminal from reaching the worker directly,
+        # it is stopped with SIGTERM once by stop()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gmail_ai_bot.main', '--process'],
+            env=self._environments[name],
+            start_new_session=True
+        )
+        with self._lock:
+            self._processes[name] = process
+        logger.info(f"Started worker of account {name} (pid {process.pid})")
+
+    def _start_classifier_server(self, address=None):
+        """
+        Start the classifier server of the workers.
+
+        Args:
+            address: The (host, port) to listen on, to restart the server where the workers expect it.
+                If None, the server listens on a port picked by the system.
+
+        Returns:
+            The address the server listens on.
+        """
+        from .classifier_server import start_classifier_server
+
+        host, port = address or ('127.0.0.1', 0)
+        self._classifier_server = start_classifier_server(self._classifier_authkey.encode(), host, port)
+        return self._classifier_server.address
+
+    def _check_classifier_server(self, now):
+        """Restart the classifier server started by the supervisor if it exited."""
+        from .classifier_server import is_classifier_server_running
+
+        server = self._classifier_server
+        if server is None or is_classifier_server_running(server) or self._stopping.is_set():
+            return
+        if self._classifier_restart_at is not None and now < self._classifier_restart_at:
+            return
+        logger.error("Classifier server exited, restarting it")
+        try:
+            # Release the resources of the exited server, then listen where the workers connect to
+            server.shutdown()
+            self._start_classifier_server(server.address)
+            self._classifier_restart_at = None
+        except Exception as e:
+            logger.error(f"Could not restart the classifier server, retrying in {WORKER_RESTART_SECONDS}s: {e}")
+            self._classifier_restart_at = now + WORKER_RESTART_SECONDS
+
+    def _check_workers(self):
+        """Restart an exited classifier server, schedule the restart of exited workers and start the ones that are due."""
+        now = time.monotonic()
+        self._check_classifier_server(now)
+        with self._lock:
+            processes = list(self._processes.items())
+        for name, process in processes:
+            if process.poll() is not None and name not in self._restart_at:
+                logger.error(
+                    f"Worker of account {name} exited with code {process.returncode}, "
+                    f"restarting it in {WORKER_RESTART_SECONDS}s"
+                )
+                self._restart_at[name] = now + WORKER_RESTART_SECONDS
+        for name, restart_at in list(self._restart_at.items()):
+            if restart_at <= now and not self._stopping.is_set():
+                del self._restart_at[name]
+                self._start_worker(name)
+
+    def stop(self):
+        """Stop the workers; each finishes the messages in progress before it exits."""
+        self._stopping.set()
+        with self._lock:
+            processes = list(self._processes.items())
+        for name, process in processes:
+            if process.poll() is None:
+                logger.info(f"Stopping worker of account {name}")
+                process.send_signal(signal.SIGTERM)
+
+    def run(self):
+        """Start the classifier server if needed and the account workers, and supervise them until interrupted."""
+        from .classifier_server import format_address
+
+        if not self.accounts:
+            logger.error(f"No authorized accounts found in {self.directory}")
+            return
+
+        overrides = {}
+        if not CLASSIFIER_SERVER_ADDRESS:
+            self._classifier_authkey = secrets.token_hex(16)
+            overrides = {
+                'CLASSIFIER_SERVER_ADDRESS': format_address(self._start_classifier_server()),
+                'CLASSIFIER_SERVER_AUTHKEY': self._classifier_authkey,
+            }
+        self._environments = {
+            name: account_environment(name, self.directory, overrides) for name in self.accounts
+        }
+
+        logger.info(f"Serving {len(self.accounts)} accounts, each polled every {POLLING_INTERVAL_MINUTES} minutes")
+        try:
+            for index, name in enumerate(self.accounts):
+                # Spread the start-up work and the first polls of the accounts
+                if index and self._stopping.wait(WORKER_START_INTERVAL_SECONDS):
+                    break
+                self._start_worker(name)
+            while not self._stopping.wait(WORKER_CHECK_SECONDS):
+                self._check_workers()
+        except KeyboardInterrupt:
+            logger.info("Account supervisor stopped by user, waiting for the workers to finish")
+        finally:
+            self.stop()
+            with self._lock:
+                processes = list(self._processes.values())
+            for process in processes:
+                process.wait()
+            if self._classifier_server is not None:
+                self._classifier_server.shutdown()
+
+def run_accounts(directory=ACCOUNTS_DIR):
+    """
+    Poll every authorized account of the accounts directory until interrupted.
+
+    Args:
+        directory: The accounts directory.
+    """
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    AccountSupervisor(list_accounts(directory), directory).run()
+
+def add_account(name, directory=ACCOUNTS_DIR):
+    """
+    Create an account directory and run the OAuth flow to store the account's token.
+
+    Args:
+        name: The account name.
+        directory: The accounts directory.
+
+    Returns:
+        True if the account is authorized.
+    """
+    if not name or name != os.path.basename(name) or name.startswith('.'):
+        raise ValueError(f"Invalid account name: {name!r}")
+    os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    # The token location is read from the environment when the package is imported, so the flow
+    # runs in a process with the account's environment
+    subprocess.run(
+        [sys.executable, '-m', 'gmail_ai_bot.accounts', 'authorize'],
+        env=account_environment(name, directory),
+        check=False
+    )
+    return name in list_accounts(directory)
+
+def main():
+    """Command-line entry point to manage and poll several Gmail accounts."""
+    parser = argparse.ArgumentParser(description="Serve several Gmail accounts")
+    parser.add_argument("--dir", default=ACCOUNTS_DIR, help="Accounts directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser('add', help="Authorize an account")
+    add_parser.add_argument("name", help="Account name, used as the name of its directory")
+    subparsers.add_parser('list', help="List the authorized accounts")
+    subparsers.add_parser('run', help="Poll every authorized account")
+    subparsers.add_parser('authorize', help="Run the OAuth flow for the token file of the environment (used by add)")
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        if add_account(args.name, args.dir):
+            print(f"Authorized account {args.name}")
+        else:
+            print(f"Could not authorize account {args.name}")
+            sys.exit(1)
+    elif args.command == 'list':
+        for name in list_accounts(args.dir):
+            print(name)
+    elif args.command == 'run':
+        run_accounts(args.dir)
+    else:
+        from .bot import load_credentials
+        load_credentials()
+
+if __name__ == '__main__':
+    main()
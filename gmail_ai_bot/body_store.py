@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import logging
+import threading
+import zlib
+
+from .config import BODY_COMPRESSION, BODY_COMPRESSION_DICT, MAX_STORED_BODY_BYTES, LOG_LEVEL, LOG_FORMAT
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+# Compression levels, tuned for fast writes of short texts
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+# Number of rows moved per transaction by compact_bodies
+COMPACT_BATCH_SIZE = 1000
+
+def _import_zstd():
+    """Import the optional zstandard package, returning None if it isn't installed."""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+class BodyCodec:
+    """
+    Compresses email bodies with zstd (or zlib when zstandard isn't installed),
+    optionally primed with a shared dictionary of content common to many emails.
+
+    Each stored body records the codec it was written with, e.g. 'zstd' or
+    'zlib:1a2b3c4d' (the suffix identifies the dictionary), so bodies stay readable
+    after the compression settings change.
+    """
+
+    def __init__(self, method=BODY_COMPRESSION, dictionary_path=BODY_COMPRESSION_DICT):
+        """
+        Initialize the codec.
+
+        Args:
+            method: 'auto', 'zstd', 'zlib' or 'none'.
+            dictionary_path: Optional path of a shared compression dictionary file.
+        """
+        self.zstd = _import_zstd()
+        if method == 'auto':
+            method = 'zstd' if self.zstd else 'zlib'
+        if method == 'zstd' and not self.zstd:
+            logger.warning("BODY_COMPRESSION is 'zstd' but the zstandard package isn't installed, using zlib")
+            method = 'zlib'
+        self.method = method
+
+        self.dictionary = None
+        self.dictionary_id = None
+        self._zstd_dictionary = None
+        if dictionary_path and method != 'none':
+            with open(dictionary_path, 'rb') as file:
+                self.dictionary = file.read()
+            self.dictionary_id = format(zlib.crc32(self.dictionary), '08x')
+            if self.zstd:
+                self._zstd_dictionary = self.zstd.ZstdCompressionDict(self.dictionary)
+            logger.info(f"Loaded body compression dictionary {self.dictionary_id} from {dictionary_path}")
+
+        self.name = method if self.dictionary_id is None else f"{method}:{self.dictionary_id}"
+
+    def compress(self, text):
+        """
+        Compress a body.
+
+        Args:
+            text: The body text.
+
+        Returns:
+            A tuple of (codec name, compressed bytes).
+        """
+        data = text.encode('utf-8')
+        if self.method == 'zstd':
+            compressor = self.zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=self._zstd_dictionary)
+            return self.name, compressor.compress(data)
+        if self.method == 'zlib':
+            if self.dictionary is None:
+                return self.name, zlib.compress(data, ZLIB_LEVEL)
+            compressor = zlib.compressobj(ZLIB_LEVEL, zdict=self.dictionary)
+            return self.name, compressor.compress(data) + compressor.flush()
+        return 'none', data
+
+    def decompress(self, codec, data):
+        """
+        Decompress a body written with any codec.
+
+        Args:
+            codec: The codec name stored with the body.
+            data: The compressed bytes.
+
+        Returns:
+            The body text.
+        """
+        method, _, dictionary_id = codec.partition(':')
+        if dictionary_id and dictionary_id != self.dictionary_id:
+            raise ValueError(f"Body was compressed with dictionary {dictionary_id}, which isn't loaded")
+
+        if method == 'zstd':
+            if not self.zstd:
+                raise RuntimeError("The zstandard package is needed to read zstd-compressed bodies")
+            decompressor = self.zstd.ZstdDecompressor(dict_data=self._zstd_dictionary if dictionary_id else None)
+            return decompressor.decompressobj().decompress(data).decode('utf-8')
+        if method == 'zlib':
+            if not dictionary_id:
+                return zlib.decompress(data).decode('utf-8')
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+            return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+        return data.decode('utf-8')
+
+_codec = None
+_codec_lock = threading.Lock()
+
+def get_body_codec():
+    """
+    Get the process-wide body codec.
+
+    Returns:
+        The shared BodyCodec instance.
+    """
+    global _codec
+    with _codec_lock:
+        if _codec is None:
+            _codec = BodyCodec()
+    return _codec
+
+def cap_body(text, max_bytes=MAX_STORED_BODY_BYTES):
+    """
+    Cut a body to a maximum number of UTF-8 bytes, without splitting a character.
+
+    Args:
+        text: The body text.
+        max_bytes: Maximum size in bytes (0 keeps the body whole).
+
+    Returns:
+        The capped body text.
+    """
+    if not max_bytes or len(text) * 4 <= max_bytes:
+        return text
+    return text.encode('utf-8')[:max_bytes].decode('utf-8', errors='ignore')
+
+def prepare_body(text):
+    """
+    Prepare a body for storage: cap it, hash it and compress it.
+
+    Args:
+        text: The body text.
+
+    Returns:
+        A dict with the body_hash, codec and data columns of the email_bodies table.
+    """
+    text = cap_body(text or '')
+    codec, data = get_body_codec().compress(text)
+    return {
+        'body_hash': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        'codec': codec,
+        'data': data,
+    }
+
+def decode_body(codec, data):
+    """Return the text of a stored body."""
+    return get_body_codec().decompress(codec, data)
+
+def compact_bodies(batch_size=COMPACT_BATCH_SIZE):
+    """
+    Move the uncompressed bodies of emails stored by older versions into the compressed body store.
+
+    Args:
+        batch_size: Number of emails moved per transaction.
+
+    Returns:
+        The number of emails moved.
+    """
+    from .connector import save_bodies
+    from .database import Email, session_scope
+
+    moved = 0
+    while True:
+        with session_scope() as session:
+            emails = session.query(Email).filter(Email.body_hash.is_(None), Email.legacy_body.isnot(None)).limit(
+                batch_size
+            ).all()
+            if not emails:
+                break
+
+            bodies = {email.id: prepare_body(email.legacy_body) for email in emails}
+            save_bodies(session, bodies.values())
+            for email in emails:
+                email.body_hash = bodies[email.id]['body_hash']
+                email.legacy_body = None
+            moved += len(emails)
+        logger.info(f"Moved {moved} email bodies into the compressed body store")
+    return moved
+
+def train_dictionary(output_path, sample_limit=10000, dictionary_size=112640):
+    """
+    Train a zstd compression dictionary on the most recently stored email bodies.
+
+    Args:
+        output_path: Path the dictionary file is written to.
+        sample_limit: Maximum number of bodies to train on.
+        dictionary_size: Size of the dictionary in bytes.
+
+    Returns:
+        The size of the written dictionary in bytes.
+    """
+    from .database import Email, session_scope
+
+    zstandard = _import_zstd()
+    if zstandard is None:
+        raise RuntimeError("Training a dictionary requires the zstandard package (pip install gmail-ai-bot[zstd])")
+
+    with session_scope() as session:
+        emails = session.query(Email).order_by(Email.id.desc()).limit(sample_limit).all()
+        samples = [email.body.encode('utf-8') for email in emails if email.body]
+
+    dictionary = zstandard.train_dictionary(dictionary_size, samples).as_bytes()
+    with open(output_path, 'wb') as file:
+        file.write(dictionary)
+    logger.info(f"Trained a {len(dictionary)} byte dictionary on {len(samples)} bodies, saved to {output_path}")
+    return len(dictionary)
+
+def main():
+    """Command-line entry point to maintain the compressed body store."""
+    parser = argparse.ArgumentParser(description="Maintain the compressed email body store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('compact', help="Compress the bodies stored by older versions and reclaim the space")
+    train_parser = subparsers.add_parser('train-dict', help="Train a zstd dictionary on the stored bodies")
+    train_parser.add_argument("output", help="Path of the dictionary file to write")
+    train_parser.add_argument("--samples", type=int, default=10000, help="Maximum number of bodies to train on")
+    train_parser.add_argument("--size", type=int, default=112640, help="Dictionary size in bytes")
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        from sqlalchemy import text
+        from .database import get_engine
+
+        moved = compact_bodies()
+        engine = get_engine()
+        if moved and engine.dialect.name == 'sqlite':
+            with engine.connect() as connection:
+                connection.execute(text("VACUUM"))
+        print(f"Moved {moved} email bodies into the compressed body store")
+    else:
+        size = train_dictionary(args.output, args.samples, args.size)
+        print(f"Wrote a {size} byte dictionary to {args.output}, set BODY_COMPRESSION_DICT to use it")
+
+if __name__ == '__main__':
+    main()
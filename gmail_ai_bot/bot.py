@@ -1,33 +1,70 @@
-import base64
+import json
 import logging
 import os
 import pickle
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import threading
+from datetime import datetime, timezone
 
-from .categorizer import categorize_email
-from .responser import auto_respond
-from .connector import save_message_to_db
-from .utils import initialize_training_data, append_to_training_data
-from .config import GMAIL_SCOPES, TOKEN_FILE, CREDENTIALS_FILE, EMAIL_CATEGORIES, LOG_LEVEL, LOG_FORMAT
+from .categorizer import categorize_emails
+from .responser import auto_respond_many
+from .labels import LabelBatcher
+from .mime import extract_body
+from .connector import (
+    save_messages_to_db, get_known_message_ids, get_drafted_message_ids, get_sync_state, set_sync_state
+)
+from .utils import initialize_training_data, append_to_training_data, flush_training_data
+from .config import (
+    GMAIL_SCOPES, TOKEN_FILE, CREDENTIALS_FILE, GMAIL_TOKEN_REFRESH_MARGIN_SECONDS, GMAIL_BATCH_SIZE,
+    GMAIL_LIST_PAGE_SIZE, GMAIL_UNREAD_QUERY, INCREMENTAL_SYNC, RETRY_MAX_ATTEMPTS, METADATA_PREFILTER,
+    SKIP_KNOWN_MESSAGES, PIPELINE_ENABLED, GMAIL_ACCOUNT, EMAIL_CATEGORIES, RESPONSE_CATEGORIES, LOG_LEVEL,
+    LOG_FORMAT
+)
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+# Sync state key under which the last processed Gmail history ID is stored, one per account
+HISTORY_ID_KEY = f'gmail_history_id:{GMAIL_ACCOUNT}' if GMAIL_ACCOUNT else 'gmail_history_id'
 
-def authenticate_gmail(redirect=False, code=None):
+# Sync state key under which the IDs of messages that failed to process are kept for the next run
+RETRY_IDS_KEY = f'retry_message_ids:{GMAIL_ACCOUNT}' if GMAIL_ACCOUNT else 'retry_message_ids'
+
+# Headers requested by the metadata-only first fetch phase
+METADATA_HEADERS = ['Subject', 'From', 'Message-ID', 'List-Unsubscribe', 'List-Id', 'Precedence', 'Auto-Submitted']
+
+# Partial response mask for the metadata-only first fetch phase
+METADATA_FIELDS = 'id,threadId,labelIds,snippet,internalDate,payload/headers'
+
+# Gmail category labels of automatically sorted, non-personal mail
+BULK_MAIL_LABELS = {'CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL'}
+
+
+def save_credentials(creds):
+    """Save the credentials to the token file for future use."""
+    try:
+        with open(TOKEN_FILE, 'wb') as token:
+            pickle.dump(creds, token)
+        logger.info(f"Saved credentials to {TOKEN_FILE}")
+    except Exception as e:
+        logger.error(f"Error saving credentials to {TOKEN_FILE}: {e}")
+
+
+def load_credentials(redirect=False, code=None):
     """
-    Authenticate with Gmail API and return the service object.
+    Load the Gmail credentials, refreshing them or running the OAuth flow if needed.
 
     Args:
         redirect (bool): If True, return the authorization URL instead of running a local server
         code (str): Authorization code from OAuth callback
 
     Returns:
-        The authenticated Gmail API service object or authorization URL if redirect=True.
+        The valid credentials, or the authorization URL if redirect=True (None if the stored ones are still valid).
     """
+    # Google client libraries are slow to import, so load them on first use
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
 
     # Try to load credentials from token file
@@ -79,20 +116,38 @@ def authenticate_gmail(redirect=False, code=None):
 
         # Save the credentials for future use
         if creds and not redirect:
-            try:
-                with open(TOKEN_FILE, 'wb') as token:
-                    pickle.dump(creds, token)
-                logger.info(f"Saved credentials to {TOKEN_FILE}")
-            except Exception as e:
-                logger.error(f"Error saving credentials to {TOKEN_FILE}: {e}")
+            save_credentials(creds)
 
-    # If we're just getting the auth URL, we don't need to build the service
+    # If we're just getting the auth URL, we don't need the credentials
     if redirect:
         return None
+    return creds
+
+
+def build_gmail_service(creds):
+    """
+    Build the Gmail API service from the discovery document bundled with the client library.
+
+    The service sends all requests over one authorized HTTP transport, which keeps its
+    connections to the API open between requests.
+
+    Args:
+        creds: The Gmail credentials.
+
+    Returns:
+        The Gmail API service object.
+    """
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build, build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    from googleapiclient.http import build_http
 
-    # Build and return the Gmail service
     try:
-        service = build('gmail', 'v1', credentials=creds)
+        discovery_doc = get_static_doc('gmail', 'v1')
+        if discovery_doc is None:
+            service = build('gmail', 'v1', credentials=creds)
+        else:
+            service = build_from_document(discovery_doc, http=AuthorizedHttp(creds, http=build_http()))
         logger.info("Gmail API service created successfully")
         return service
     except Exception as e:
@@ -100,68 +155,783 @@ def authenticate_gmail(redirect=False, code=None):
         raise
 
 
+def authenticate_gmail(redirect=False, code=None):
+    """
+    Authenticate with Gmail API and return the service object.
+
+    Args:
+        redirect (bool): If True, return the authorization URL instead of running a local server
+        code (str): Authorization code from OAuth callback
+
+    Returns:
+        The authenticated Gmail API service object or authorization URL if redirect=True.
+    """
+    creds = load_credentials(redirect=redirect, code=code)
+
+    # If we're just getting the auth URL, we don't need to build the service
+    if redirect:
+        return creds
+
+    # Build and return the Gmail service
+    return build_gmail_service(creds)
+
+
+class CredentialRefresher(threading.Thread):
+    """
+    Daemon thread that refreshes the Gmail access token shortly before it expires,
+    so polling jobs never wait on a token refresh.
+    """
+
+    # Seconds to wait before retrying a failed refresh
+    RETRY_SECONDS = 60
+
+    def __init__(self, creds, margin=GMAIL_TOKEN_REFRESH_MARGIN_SECONDS):
+        """
+        Initialize the refresher.
+
+        Args:
+            creds: The Gmail credentials to keep fresh.
+            margin: Seconds before expiry at which the token is refreshed.
+        """
+        super().__init__(name='gmail-credential-refresher', daemon=True)
+        self.creds = creds
+        self.margin = margin
+        self._stopped = threading.Event()
+
+    def seconds_until_refresh(self):
+        """Return the number of seconds until the token should be refreshed."""
+        if self.creds.expiry is None:
+            return self.RETRY_SECONDS
+        # google-auth stores the expiry as a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return max((self.creds.expiry - now).total_seconds() - self.margin, 0)
+
+    def run(self):
+        from google.auth.transport.requests import Request
+
+        while not self._stopped.wait(self.seconds_until_refresh()):
+            try:
+                self.creds.refresh(Request())
+                save_credentials(self.creds)
+                logger.info(f"Refreshed Gmail credentials, valid until {self.creds.expiry}")
+            except Exception as e:
+                logger.error(f"Error refreshing Gmail credentials in the background: {e}")
+                if self._stopped.wait(self.RETRY_SECONDS):
+                    break
+
+    def stop(self):
+        """Stop refreshing the credentials."""
+        self._stopped.set()
+
+
+_gmail_service = None
+_credential_refresher = None
+_gmail_service_lock = threading.Lock()
+
+
+def get_gmail_service():
+    """
+    Get the long-lived Gmail service of this process, authenticating on first use.
+
+    The service and its HTTP connections are reused across polling jobs, while a
+    background thread keeps the credentials fresh.
+
+    Returns:
+        The authenticated Gmail API service object.
+    """
+    global _gmail_service, _credential_refresher
+    with _gmail_service_lock:
+        if _gmail_service is None:
+            creds = load_credentials()
+            _gmail_service = build_gmail_service(creds)
+            if creds.refresh_token:
+                _credential_refresher = CredentialRefresher(creds)
+                _credential_refresher.start()
+        return _gmail_service
+
+
+def reset_gmail_service():
+    """Drop the long-lived Gmail service, so the next get_gmail_service call authenticates again."""
+    global _gmail_service, _credential_refresher
+    with _gmail_service_lock:
+        if _credential_refresher is not None:
+            _credential_refresher.stop()
+        _gmail_service = None
+        _credential_refresher = None
+
+
 def get_message_subject_body_and_sender(message):
     """Extract the subject, body, and sender email of the email."""
-    subject, body, sender = '', '', ''
+    subject, sender = '', ''
     for header in message.get('payload', {}).get('headers', []):
         if header['name'].lower() == 'subject':
             subject = header['value']
         elif header['name'].lower() == 'from':
             sender = header['value']
 
-    body_data = message.get('payload', {}).get('body', {}).get('data', '')
-    if body_data:
-        body = base64.urlsafe_b64decode(body_data).decode('utf-8')
+    body = extract_body(message.get('payload', {}))
 
     return subject, body, sender
 
 
+def get_message_header(message, name):
+    """Return the value of a message header (case-insensitive), or an empty string if it is missing."""
+    for header in message.get('payload', {}).get('headers', []):
+        if header['name'].lower() == name.lower():
+            return header['value']
+    return ''
+
+
+def is_bulk_mail(message):
+    """
+    Check whether a message is bulk mail, whose body isn't downloaded unless it needs a response.
+
+    Args:
+        message: A message resource fetched with format=metadata or format=full.
+
+    Returns:
+        True for newsletters, mailing list traffic, auto-generated mail and mail that
+        Gmail sorted into the promotions or social categories.
+    """
+    if BULK_MAIL_LABELS.intersection(message.get('labelIds', [])):
+        return True
+
+    headers = {header['name'].lower(): header['value'] for header in message.get('payload', {}).get('headers', [])}
+    if 'list-unsubscribe' in headers or 'list-id' in headers:
+        return True
+    if headers.get('precedence', '').strip().lower() in ('bulk', 'list', 'junk'):
+        return True
+    return headers.get('auto-submitted', 'no').strip().lower() != 'no'
+
+
+def fetch_messages(service, message_ids, batch_size=GMAIL_BATCH_SIZE, missing_ids=None, **get_kwargs):
+    """
+    Fetch several messages using Gmail HTTP batch requests.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        message_ids: IDs of the messages to fetch.
+        batch_size: Number of requests sent per batch call (at most 100).
+        missing_ids: Optional set that receives the IDs of the messages Gmail answered with
+            404 Not Found, i.e. that were deleted since they were listed.
+        **get_kwargs: Extra arguments passed to users.messages.get (e.g. format).
+
+    Returns:
+        A dict mapping message ID to the message resource. Messages that could not
+        be fetched are logged and left out, so one failure doesn't sink the batch.
+    """
+    messages = {}
+
+    def handle_response(request_id, response, exception):
+        if exception is not None:
+            if missing_ids is not None and getattr(getattr(exception, 'resp', None), 'status', None) == 404:
+                logger.info(f"Message {request_id} no longer exists")
+                missing_ids.add(request_id)
+            else:
+                logger.error(f"Error fetching message {request_id}: {exception}")
+        else:
+            messages[request_id] = response
+
+    message_ids = list(message_ids)
+    for start in range(0, len(message_ids), batch_size):
+        chunk = message_ids[start:start + batch_size]
+        batch = service.new_batch_http_request(callback=handle_response)
+        for message_id in chunk:
+            batch.add(
+                service.users().messages().get(userId='me', id=message_id, **get_kwargs),
+                request_id=message_id
+            )
+        try:
+            batch.execute()
+        except Exception as e:
+            logger.error(f"Error executing batch fetch of {len(chunk)} messages: {e}")
+
+    logger.info(f"Fetched {len(messages)} of {len(message_ids)} messages")
+    return messages
+
+
+def iter_unread_message_pages(service, query=GMAIL_UNREAD_QUERY, max_results=GMAIL_LIST_PAGE_SIZE):
+    """
+    Iterate over all unread inbox messages, one page at a time.
+
+    Pages are requested lazily, so callers can start processing the first page
+    before the next one is listed and memory stays flat regardless of backlog size.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        query: Optional Gmail search query evaluated server-side.
+        max_results: Number of message IDs requested per page.
+
+    Yields:
+        Lists of message stubs (dicts with 'id' and 'threadId').
+    """
+    list_kwargs = {'userId': 'me', 'labelIds': ['INBOX', 'UNREAD'], 'maxResults': max_results}
+    if query:
+        list_kwargs['q'] = query
+
+    # list_next() can't rebuild URLs with repeated labelIds, so follow pageToken explicitly
+    page_token = None
+    while True:
+        if page_token:
+            list_kwargs['pageToken'] = page_token
+        response = service.users().messages().list(**list_kwargs).execute()
+        messages = response.get('messages', [])
+        if messages:
+            yield messages
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+
+def iter_new_message_pages(service, start_history_id, max_results=GMAIL_LIST_PAGE_SIZE):
+    """
+    Iterate over unread inbox messages added since the given history ID.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        start_history_id: The history ID checkpoint of the previous run.
+        max_results: Number of history records requested per page.
+
+    Yields:
+        Lists of message stubs (dicts with 'id' and 'threadId').
+
+    Raises:
+        HttpError: With status 404 if the checkpoint is too old for Gmail to serve.
+    """
+    list_kwargs = {
+        'userId': 'me',
+        'startHistoryId': start_history_id,
+        'historyTypes': ['messageAdded'],
+        'labelId': 'INBOX',
+        'maxResults': max_results,
+    }
+    seen_ids = set()
+    page_token = None
+    while True:
+        if page_token:
+            list_kwargs['pageToken'] = page_token
+        response = service.users().history().list(**list_kwargs).execute()
+
+        messages = []
+        for record in response.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message = added['message']
+                labels = message.get('labelIds', [])
+                if message['id'] in seen_ids or 'INBOX' not in labels or 'UNREAD' not in labels:
+                    continue
+                seen_ids.add(message['id'])
+                messages.append({'id': message['id'], 'threadId': message.get('threadId')})
+        if messages:
+            yield messages
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+
+def iter_message_pages_to_process(service, incremental=INCREMENTAL_SYNC, query=GMAIL_UNREAD_QUERY,
+                                  checkpoint=None):
+    """
+    Iterate over the pages of messages that need processing in this run.
+
+    In incremental mode only mail added since the stored history checkpoint is
+    listed, falling back to a full unread listing when there is no checkpoint yet
+    or it has expired. The new checkpoint isn't stored here: listing a page doesn't
+    mean it was processed, so the caller stores it with commit_history_checkpoint
+    once every page went through without errors.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        incremental: Whether to use incremental history sync.
+        query: Optional Gmail search query. History sync can't evaluate queries
+            server-side, so a configured query forces a full listing.
+        checkpoint: Optional dict that receives the new history ID under 'history_id'
+            once all pages were listed.
+
+    Yields:
+        Lists of message stubs (dicts with 'id' and 'threadId').
+    """
+    from googleapiclient.errors import HttpError
+
+    if not incremental or query:
+        yield from iter_unread_message_pages(service, query=query)
+        return
+
+    # Take the checkpoint before listing so mail arriving mid-run is seen next time
+    history_id = service.users().getProfile(userId='me').execute().get('historyId')
+    start_history_id = get_sync_state(HISTORY_ID_KEY)
+
+    if start_history_id:
+        try:
+            logger.info(f"Listing messages added since history ID {start_history_id}")
+            yield from iter_new_message_pages(service, start_history_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logger.warning(f"History ID {start_history_id} has expired, falling back to a full sync")
+            yield from iter_unread_message_pages(service)
+    else:
+        logger.info("No history checkpoint found, performing a full sync")
+        yield from iter_unread_message_pages(service)
+
+    if history_id and checkpoint is not None:
+        checkpoint['history_id'] = history_id
+
+
+def commit_history_checkpoint(checkpoint):
+    """Store the history ID recorded by iter_message_pages_to_process, if the listing completed."""
+    if checkpoint.get('history_id'):
+        set_sync_state(HISTORY_ID_KEY, checkpoint['history_id'])
+
+
+def load_retry_message_ids():
+    """Return the IDs of the messages that failed to process in earlier runs, mapped to their number of failed runs."""
+    value = get_sync_state(RETRY_IDS_KEY)
+    try:
+        stored = json.loads(value) if value else {}
+        if isinstance(stored, list):
+            # Stored before failed runs were counted
+            return dict.fromkeys(stored, 1)
+        return {message_id: int(attempts) for message_id, attempts in stored.items()}
+    except (ValueError, AttributeError):
+        logger.error(f"Ignoring malformed sync state '{RETRY_IDS_KEY}'")
+        return {}
+
+
+def save_retry_message_ids(retry_attempts):
+    """Store the retry list, as returned by update_retry_attempts, returning True if it was stored."""
+    return set_sync_state(RETRY_IDS_KEY, json.dumps(dict(sorted(retry_attempts.items()))))
+
+
+def update_retry_attempts(retry_attempts, failed_ids, deferred_ids=(), max_attempts=RETRY_MAX_ATTEMPTS):
+    """
+    Build the retry list for the next run.
+
+    Args:
+        retry_attempts: The retry list of this run, mapping message IDs to their number of failed runs.
+        failed_ids: IDs of the messages that failed to process in this run.
+        deferred_ids: IDs from the retry list that weren't tried in this run and keep their count.
+        max_attempts: Number of failed runs after which a message is dropped from the list.
+
+    Returns:
+        The new retry list; messages of the old list that didn't fail again are left out.
+    """
+    updated = {message_id: retry_attempts[message_id] for message_id in deferred_ids if message_id in retry_attempts}
+    for message_id in failed_ids:
+        attempts = retry_attempts.get(message_id, 0) + 1
+        if attempts >= max_attempts:
+            logger.error(f"Giving up on message {message_id} after {attempts} failed runs")
+        else:
+            updated[message_id] = attempts
+    return updated
+
+
+def select_retry_message_ids(service, message_ids):
+    """
+    Pick the messages of the retry list that still need processing.
+
+    Messages that were read, archived or deleted since they failed are dropped: the user has dealt with them.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        message_ids: IDs of the retry list.
+
+    Returns:
+        A tuple of (IDs to retry now, IDs whose labels couldn't be read, kept for a later run).
+    """
+    missing_ids = set()
+    messages = fetch_messages(service, message_ids, missing_ids=missing_ids, format='minimal', fields='id,labelIds')
+    retry_ids, deferred_ids = [], []
+    for message_id in message_ids:
+        if message_id in messages:
+            labels = messages[message_id].get('labelIds', [])
+            if 'UNREAD' in labels and 'INBOX' in labels:
+                retry_ids.append(message_id)
+        elif message_id not in missing_ids:
+            deferred_ids.append(message_id)
+
+    dropped = len(message_ids) - len(retry_ids) - len(deferred_ids)
+    if dropped:
+        logger.info(f"Dropped {dropped} messages from the retry list, they were read, archived or deleted")
+    return retry_ids, deferred_ids
+
+
+def fetch_page(service, message_ids):
+    """
+    Fetch and parse a page of messages, skipping the body download of bulk mail.
+
+    Bulk mail, recognized from its headers, is parsed with its snippet standing in for the body.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        message_ids: IDs of the messages to fetch.
+
+    Returns:
+        A page dict with the message_ids, the bulk_messages (metadata only) and fetched_messages
+        by ID, the parsed_messages as (subject, body, sender) tuples by ID and the failed_ids of
+        the messages that could not be fetched or parsed.
+    """
+    message_ids = list(message_ids)
+    bulk_messages = {}
+    full_message_ids = message_ids
+    # Messages deleted since they were listed need no processing
+    missing_ids = set()
+
+    if METADATA_PREFILTER:
+        # Fetch headers only and skip downloading the body of bulk mail
+        metadata_messages = fetch_messages(
+            service, message_ids, missing_ids=missing_ids, format='metadata', metadataHeaders=METADATA_HEADERS,
+            fields=METADATA_FIELDS
+        )
+        bulk_messages = {
+            message_id: message for message_id, message in metadata_messages.items() if is_bulk_mail(message)
+        }
+        full_message_ids = [
+            message_id for message_id in message_ids
+            if message_id in metadata_messages and message_id not in bulk_messages
+        ]
+        logger.info(f"Pre-filtered {len(bulk_messages)} bulk messages from their headers")
+
+    # Download the full messages that survived pre-filtering using batched requests
+    fetched_messages = fetch_messages(service, full_message_ids, missing_ids=missing_ids) if full_message_ids else {}
+
+    # Parse the downloaded messages
+    parsed_messages = {}
+    failed_ids = [
+        message_id for message_id in message_ids
+        if message_id not in bulk_messages and message_id not in fetched_messages and message_id not in missing_ids
+    ]
+    for message_id in message_ids:
+        message = bulk_messages.get(message_id) or fetched_messages.get(message_id)
+        if message is None:
+            continue
+        try:
+            subject, body, sender = get_message_subject_body_and_sender(message)
+            if message_id in bulk_messages:
+                body = message.get('snippet', '')
+            parsed_messages[message_id] = (subject, body, sender)
+        except Exception as e:
+            logger.error(f"Error parsing message {message_id}: {e}")
+            failed_ids.append(message_id)
+
+    return {
+        'message_ids': message_ids,
+        'bulk_messages': bulk_messages,
+        'fetched_messages': fetched_messages,
+        'parsed_messages': parsed_messages,
+        'failed_ids': failed_ids,
+    }
+
+
+def fetch_bodies(service, message_ids):
+    """
+    Download the bodies of messages whose metadata was fetched without them.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        message_ids: IDs of the messages.
+
+    Returns:
+        A dict mapping message ID to body text; messages that could not be fetched or parsed are left out.
+    """
+    bodies = {}
+    for message_id, message in fetch_messages(service, message_ids).items():
+        try:
+            bodies[message_id] = get_message_subject_body_and_sender(message)[1]
+        except Exception as e:
+            logger.error(f"Error parsing message {message_id}: {e}")
+    return bodies
+
+
+def categorize_page(page):
+    """
+    Categorize the parsed messages of a page with one batched model call.
+
+    Args:
+        page: A page dict from fetch_page.
+
+    Returns:
+        The page dict, with the categories by message ID added.
+    """
+    parsed_messages = page['parsed_messages']
+    categorized_ids = list(parsed_messages)
+    page['categories'] = dict(zip(
+        categorized_ids,
+        categorize_emails([parsed_messages[message_id][:2] for message_id in categorized_ids])
+    ))
+    return page
+
+
+def respond_page(service, page, label_batcher=None):
+    """
+    Store a categorized page and respond to its messages.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        page: A page dict from categorize_page.
+        label_batcher: Optional LabelBatcher collecting label changes, flushed by the caller.
+
+    Returns:
+        The IDs of the messages of the page that failed to process and should be retried.
+    """
+    bulk_messages, categories = page['bulk_messages'], page['categories']
+    failed_ids = set(page.get('failed_ids', []))
+
+    # Bulk mail was categorized on its snippet, download the body of the messages that need a response
+    needs_body = [message_id for message_id in bulk_messages if categories.get(message_id) in RESPONSE_CATEGORIES]
+    bodies = fetch_bodies(service, needs_body) if needs_body else {}
+
+    # Process each message, collecting the auto-responses to coalesce by thread and generate concurrently
+    to_respond = []
+    for message_id in page['message_ids']:
+        try:
+            if message_id not in categories:
+                continue
+            if message_id in needs_body and message_id not in bodies:
+                failed_ids.add(message_id)
+                continue
+
+            message = bulk_messages.get(message_id) or page['fetched_messages'][message_id]
+            subject, body, sender = page['parsed_messages'][message_id]
+            body = bodies.get(message_id, body)
+            category = categories[message_id]
+            logger.info(f"Processing {'bulk ' if message_id in bulk_messages else ''}email: {subject[:30]}... "
+                        f"from {sender}")
+
+            # Save to training data unless only the snippet is known, the page is saved to the database below
+            if message_id not in bulk_messages or message_id in bodies:
+                append_to_training_data(subject, body, category)
+
+            to_respond.append({
+                'subject': subject,
+                'body': body,
+                'category': category,
+                'message_id': message_id,
+                'sender_email': sender,
+                'thread_id': message['threadId'],
+                'internal_date': int(message.get('internalDate', 0)),
+                'rfc_message_id': get_message_header(message, 'Message-ID'),
+            })
+
+            logger.info(f"Successfully processed email with ID: {message_id}")
+
+        except Exception as e:
+            logger.error(f"Error processing message {message_id}: {e}")
+            failed_ids.add(message_id)
+            continue
+
+    # Save the whole page to the database in one transaction
+    if not save_messages_to_db(to_respond):
+        return failed_ids | {email['message_id'] for email in to_respond}
+
+    # Generate and save responses where needed
+    try:
+        auto_respond_many(service, to_respond, label_batcher=label_batcher)
+    except Exception as e:
+        logger.error(f"Error responding to messages: {e}")
+
+    # Messages that needed a response but have no draft are retried
+    needs_response = [email['message_id'] for email in to_respond if email['category'] in RESPONSE_CATEGORIES]
+    if needs_response:
+        failed_ids.update(set(needs_response) - get_drafted_message_ids(needs_response))
+    return failed_ids
+
+
+def process_messages(service, message_ids, label_batcher=None):
+    """
+    Fetch, categorize, store and respond to the given messages.
+
+    Args:
+        service: The authenticated Gmail API service object.
+        message_ids: IDs of the messages to process.
+        label_batcher: Optional LabelBatcher collecting label changes, flushed by the caller.
+
+    Returns:
+        The IDs of the messages that failed to process and should be retried.
+    """
+    return respond_page(service, categorize_page(fetch_page(service, message_ids)), label_batcher)
+
+
+class GmailServicePool:
+    """
+    Gmail services for the pipeline workers, kept between runs.
+
+    The HTTP transport of a service isn't thread-safe, so concurrent workers each need their own.
+    A worker takes a service for as long as it runs and gives it back when it's done, so the
+    workers of the next run reuse the services and their connections instead of building new ones.
+    """
+
+    def __init__(self, creds):
+        """
+        Initialize the pool.
+
+        Args:
+            creds: The credentials the services are built with.
+        """
+        self.creds = creds
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take an idle service, or build one if there is none."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return build_gmail_service(self.creds)
+
+    def release(self, service):
+        """Give back a service taken with acquire."""
+        with self._lock:
+            self._idle.append(service)
+
+
+_gmail_service_pool = None
+_gmail_service_pool_lock = threading.Lock()
+
+
+def get_gmail_service_pool(service):
+    """
+    Get the pool of worker services sharing the credentials of a service.
+
+    The pool lives as long as the credentials: after reset_gmail_service, the first run with
+    the new service starts a new pool.
+
+    Args:
+        service: The authenticated Gmail API service object.
+
+    Returns:
+        The GmailServicePool, or None if the credentials of the service can't be reused.
+    """
+    global _gmail_service_pool
+    creds = getattr(getattr(service, '_http', None), 'credentials', None)
+    if creds is None:
+        return None
+    with _gmail_service_pool_lock:
+        if _gmail_service_pool is None or _gmail_service_pool.creds is not creds:
+            _gmail_service_pool = GmailServicePool(creds)
+        return _gmail_service_pool
+
+
 def process_unread_emails(service):
     """
     Process unread emails from the inbox.
 
+    With PIPELINE_ENABLED, listed pages are fetched, categorized and answered by
+    concurrent pipeline stages; otherwise one page at a time. The history checkpoint
+    only advances when every listed message was processed; messages that failed are
+    also kept and retried at the start of the next run.
+
     Args:
         service: The authenticated Gmail API service object.
     """
     # Initialize training data file if it doesn't exist
     initialize_training_data()
 
-    try:
-        # Get unread messages from inbox
-        results = service.users().messages().list(userId='me', labelIds=['INBOX', 'UNREAD']).execute()
-        messages = results.get('messages', [])
-
-        if not messages:
-            logger.info("No unread messages found.")
-            return
+    # Label changes of the whole run are applied together with batchModify at the end
+    label_batcher = LabelBatcher(service)
 
-        logger.info(f"Found {len(messages)} unread messages to process")
+    failed_ids = set()
+    failed_ids_lock = threading.Lock()
 
-        # Process each unread message
-        for msg in messages:
-            try:
-                # Get message details
-                message = service.users().messages().get(userId='me', id=msg['id']).execute()
-                message_id, thread_id = msg['id'], message['threadId']
-                subject, body, sender = get_message_subject_body_and_sender(message)
+    def record_failures(message_ids):
+        with failed_ids_lock:
+            failed_ids.update(message_ids)
 
-                logger.info(f"Processing email: {subject[:30]}... from {sender}")
+    def record_stage_error(stage, item):
+        # Stages get lists of message IDs from the listing and page dicts from the previous stage
+        record_failures(item if isinstance(item, list) else item['message_ids'])
 
-                # Categorize the email
-                category = categorize_email(subject, body)
+    pipeline = None
+    service_pool = get_gmail_service_pool(service) if PIPELINE_ENABLED else None
+    if service_pool is not None:
+        from .pipeline import Pipeline
+        pipeline = Pipeline(
+            fetch=fetch_page,
+            categorize=categorize_page,
+            respond=lambda worker_service, page: record_failures(respond_page(worker_service, page, label_batcher)),
+            service_factory=service_pool.acquire,
+            service_release=service_pool.release,
+            on_error=record_stage_error
+        )
 
-                # Save to database and training data
-                save_message_to_db(message_id, thread_id, subject, body, category)
-                append_to_training_data(subject, body, category)
+    def submit(message_ids):
+        """Process a page of message IDs, returning False if the pipeline refused it."""
+        if pipeline is not None:
+            return pipeline.submit(message_ids)
+        try:
+            record_failures(process_messages(service, message_ids, label_batcher))
+        except Exception as e:
+            logger.error(f"Error processing page of {len(message_ids)} messages: {e}")
+            record_failures(message_ids)
+        return True
 
-                # Generate and save response if needed
-                auto_respond(service, subject, body, category, message_id, sender)
+    def filter_known(message_ids):
+        # Drop messages processed in earlier runs before fetching anything
+        if not SKIP_KNOWN_MESSAGES:
+            return message_ids
+        unknown_ids = get_known_message_ids().filter_unknown(message_ids)
+        if len(unknown_ids) < len(message_ids):
+            logger.info(f"Skipped {len(message_ids) - len(unknown_ids)} already processed messages")
+        return unknown_ids
 
-                logger.info(f"Successfully processed email with ID: {message_id}")
+    checkpoint = {}
+    completed = False
+    retry_attempts = load_retry_message_ids()
+    # Messages of the retry list that aren't tried in this run keep their place in it
+    deferred_retry_ids = list(retry_attempts)
+    pending_retry_ids = set()
+    try:
+        # Retry the messages that failed in earlier runs first, unless the user has dealt with them since.
+        # They aren't filtered as known: a stored message may still be unread because marking it failed
+        if retry_attempts:
+            retry_ids, deferred_retry_ids = select_retry_message_ids(service, list(retry_attempts))
+            pending_retry_ids = set(retry_ids)
+            if retry_ids:
+                logger.info(f"Retrying {len(retry_ids)} messages that failed in earlier runs")
+                if not submit(retry_ids):
+                    record_failures(retry_ids)
 
-            except Exception as e:
-                logger.error(f"Error processing message {msg['id']}: {e}")
+        # Process unread messages page by page as they are listed
+        total_messages = 0
+        for page in iter_message_pages_to_process(service, checkpoint=checkpoint):
+            total_messages += len(page)
+            # The retried messages are already on their way
+            message_ids = filter_known([msg['id'] for msg in page if msg['id'] not in pending_retry_ids])
+            if not message_ids:
                 continue
+            logger.info(f"Processing page of {len(message_ids)} unread messages")
+            if not submit(message_ids):
+                logger.info("Pipeline is shutting down, leaving the remaining messages for the next run")
+                break
+        else:
+            completed = True
+
+        if not total_messages:
+            logger.info("No unread messages found.")
+        else:
+            logger.info(f"Listed {total_messages} unread messages")
 
     except Exception as e:
-        logger.error(f"Error listing unread messages: {e}")
\ No newline at end of file
+        logger.error(f"Error listing unread messages: {e}")
+
+    finally:
+        if pipeline is not None:
+            # Let the stages finish the submitted pages
+            pipeline.close()
+        failed = label_batcher.flush()
+        if failed:
+            # They are stored and known already, the retry list is what brings them back
+            logger.error(f"Could not mark {len(failed)} messages as read, they will be retried next run")
+            record_failures(failed)
+        flush_training_data()
+
+    next_retry_attempts = update_retry_attempts(retry_attempts, failed_ids, deferred_retry_ids)
+    retry_saved = save_retry_message_ids(next_retry_attempts) if retry_attempts or next_retry_attempts else True
+    # Retried messages that fail again stay in the retry list, they don't hold back the checkpoint
+    if completed and retry_saved and not failed_ids - set(retry_attempts):
+        commit_history_checkpoint(checkpoint)
+    elif checkpoint:
+        logger.warning(
+            f"Keeping the history checkpoint, {len(failed_ids)} messages failed and will be retried next run"
+        )
@@ -0,0 +1,127 @@
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+
+def normalize_whitespace(text):
+    """
+    Collapse runs of whitespace into single spaces and strip the ends.
+
+    Args:
+        text: The text to normalize.
+
+    Returns:
+        The normalized text.
+    """
+    return ' '.join(text.split())
+
+def normalize_text(text):
+    """
+    Normalize text so that near-identical automated mails produce the same cache key.
+
+    Lowercases the text, replaces digit runs (dates, counters, build numbers) with a
+    single 0 and collapses whitespace.
+
+    Args:
+        text: The text to normalize.
+
+    Returns:
+        The normalized text.
+    """
+    return normalize_whitespace(re.sub(r'\d+', '0', text.lower()))
+
+def content_hash(*parts, normalize=normalize_text):
+    """
+    Compute a stable hash of the normalized text parts.
+
+    Args:
+        *parts: Text parts to hash together.
+        normalize: Function applied to each part before hashing.
+
+    Returns:
+        The hex SHA-256 digest of the normalized parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(normalize(part).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded in-memory cache with least-recently-used eviction.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries kept in memory.
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, marking it as recently used."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries beyond maxsize."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class BloomFilter:
+    """
+    A thread-safe, fixed-size set of strings with no false negatives and a bounded
+    false positive rate; uses a fraction of the memory of a set of the same strings.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        Initialize the filter.
+
+        Args:
+            capacity: Number of items the filter is sized for.
+            error_rate: False positive rate at capacity.
+        """
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        """Bit positions of an item, from two halves of one digest (Kirsch-Mitzenmacher double hashing)."""
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        """Add an item to the filter."""
+        positions = self._positions(item)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
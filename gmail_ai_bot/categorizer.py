@@ -1,6 +1,12 @@
 import logging
-from transformers import pipeline
-from .config import CATEGORIZATION_MODEL, EMAIL_CATEGORIES, MAX_TEXT_LENGTH, LOG_LEVEL, LOG_FORMAT
+import threading
+from .cache import LRUCache, content_hash
+from .connector import get_cached_categories, save_cached_categories
+from .config import (
+    CATEGORIZATION_MODEL, CATEGORIZATION_BACKEND, EMAIL_CATEGORIES, MAX_TEXT_LENGTH, CATEGORIZATION_BATCH_SIZE,
+    CATEGORIZATION_TAIL_TOKENS, CATEGORY_CACHE_SIZE, CATEGORY_CACHE_PERSISTENT, CLASSIFIER_SERVER_ADDRESS,
+    LOG_LEVEL, LOG_FORMAT
+)
 
 # Set up logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
@@ -9,6 +15,38 @@ logger = logging.getLogger(__name__)
 # Initialize the classifier with the configured model
 # Use lazy loading to avoid initializing the model until it's needed
 classifier = None
+tokenizer = None
+
+# Longest text (in characters per token of budget) handed to the tokenizer, bounding its cost on huge emails
+TOKENIZE_CHARS_PER_TOKEN = 32
+
+# Memoized categories keyed by normalized content hash, with hit/miss counters; repeats of a text
+# within one call are counted as batch_duplicates, whatever the lookup of its first occurrence gave
+category_cache = LRUCache(CATEGORY_CACHE_SIZE)
+cache_stats = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'batch_duplicates': 0}
+
+# Model name of the persistent category cache; the backends may disagree on borderline emails
+CACHE_MODEL_NAME = f"{CATEGORIZATION_MODEL}:{CATEGORIZATION_BACKEND}"
+_cache_stats_lock = threading.Lock()
+
+def build_classifier(backend=CATEGORIZATION_BACKEND):
+    """
+    Build a text classifier for the configured model using the given backend.
+
+    Args:
+        backend: 'pytorch' for the transformers pipeline or 'onnx' for the quantized ONNX Runtime model.
+
+    Returns:
+        A callable text classifier with the transformers pipeline interface.
+    """
+    if backend == 'onnx':
+        from .onnx_classifier import OnnxTextClassifier
+        return OnnxTextClassifier(CATEGORIZATION_MODEL)
+    elif backend == 'pytorch':
+        from transformers import pipeline
+        return pipeline("text-classification", model=CATEGORIZATION_MODEL, top_k=None, truncation=True)
+    else:
+        raise ValueError(f"Unsupported categorization backend: {backend}")
 
 def get_classifier():
     """
@@ -20,8 +58,8 @@ def get_classifier():
     global classifier
     if classifier is None:
         try:
-            classifier = pipeline("text-classification", model=CATEGORIZATION_MODEL, top_k=None)
-            logger.info(f"Initialized categorization model: {CATEGORIZATION_MODEL}")
+            classifier = build_classifier()
+            logger.info(f"Initialized categorization model: {CATEGORIZATION_MODEL} ({CATEGORIZATION_BACKEND} backend)")
         except Exception as e:
             logger.error(f"Error initializing categorization model: {e}")
             raise
@@ -40,43 +78,247 @@ def truncate_text(text, max_length=MAX_TEXT_LENGTH):
     """
     return text[:max_length]
 
-def categorize_email(subject, body, labels=None, max_length=MAX_TEXT_LENGTH):
+def get_tokenizer():
     """
-    Categorize an email based on its subject and body.
+    Get the tokenizer of the categorization model, reusing the classifier's one when it is loaded.
+
+    Returns:
+        The tokenizer.
+    """
+    global tokenizer
+    if tokenizer is None:
+        if getattr(classifier, 'tokenizer', None) is not None:
+            tokenizer = classifier.tokenizer
+        else:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(CATEGORIZATION_MODEL)
+    return tokenizer
+
+def truncate_to_tokens(text, max_tokens=MAX_TEXT_LENGTH, tail_tokens=CATEGORIZATION_TAIL_TOKENS):
+    """
+    Truncate text so that it fills exactly the model's token budget.
 
     Args:
-        subject: The email subject.
-        body: The email body.
+        text: The text to truncate.
+        max_tokens: Token budget including special tokens, capped at the model's maximum input length.
+        tail_tokens: Number of tokens kept from the end of long texts; the rest of the budget is
+            taken from the beginning.
+
+    Returns:
+        The truncated text.
+    """
+    model_tokenizer = get_tokenizer()
+    max_tokens = min(max_tokens or model_tokenizer.model_max_length, model_tokenizer.model_max_length)
+    budget = max_tokens - model_tokenizer.num_special_tokens_to_add(pair=False)
+    tail_tokens = min(max(tail_tokens, 0), budget)
+
+    # Only tokenize the windows that can possibly end up in the budget
+    window = budget * TOKENIZE_CHARS_PER_TOKEN
+    if len(text) > 2 * window:
+        text = text[:window] + ' ' + text[-window:] if tail_tokens else text[:window]
+
+    if not model_tokenizer.is_fast:
+        token_ids = model_tokenizer.encode(text, add_special_tokens=False)
+        if len(token_ids) <= budget:
+            return text
+        head_ids = token_ids[:budget - tail_tokens]
+        tail_ids = token_ids[len(token_ids) - tail_tokens:] if tail_tokens else []
+        return model_tokenizer.decode(head_ids + tail_ids)
+
+    offsets = model_tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+    if len(offsets) <= budget:
+        return text
+
+    head_count = budget - tail_tokens
+    head = text[:offsets[head_count - 1][1]] if head_count else ''
+    tail = text[offsets[len(offsets) - tail_tokens][0]:] if tail_tokens else ''
+    return f"{head} {tail}".strip() if tail else head
+
+def _best_category(prediction, categories):
+    """
+    Pick the best category from the model scores of a single text.
+
+    Args:
+        prediction: List of label/score dicts returned by the model for one text.
+        categories: List of category names.
+
+    Returns:
+        The category with the highest score.
+    """
+    category_scores = {categories[i]: prediction[i]['score'] for i in range(len(categories))}
+    return max(category_scores, key=category_scores.get)
+
+def _categorize_remotely(emails, labels, max_length):
+    """
+    Categorize emails with the shared classifier server (see classifier_server).
+
+    Raises:
+        Exception: If the server can't be reached. The first category is "urgent response", so
+            there is no default to fall back to; the caller retries the emails in a later run.
+    """
+    from .classifier_server import get_remote_classifier, reset_remote_classifier
+    try:
+        return get_remote_classifier().categorize_emails(emails, labels, max_length)
+    except Exception as e:
+        logger.error(f"Error categorizing emails with the classifier server: {e}")
+        # Reconnect on the next call, the server may have been restarted
+        reset_remote_classifier()
+        raise
+
+def categorize_emails(emails, labels=None, max_length=MAX_TEXT_LENGTH, batch_size=CATEGORIZATION_BATCH_SIZE,
+                      use_server=True):
+    """
+    Categorize several emails with batched model inference.
+
+    Args:
+        emails: List of (subject, body) tuples.
         labels: Dictionary of category labels. If None, uses EMAIL_CATEGORIES from config.
-        max_length: Maximum length of text to process.
+        max_length: Token budget of the model input.
+        batch_size: Number of texts per forward pass.
+        use_server: Whether to send the emails to the classifier server when CLASSIFIER_SERVER_ADDRESS is set.
 
     Returns:
-        The predicted category of the email.
+        List of predicted categories, in the same order as emails.
+
+    Raises:
+        Exception: If the classifier server is used and can't be reached.
     """
     # Use configured categories if none provided
     if labels is None:
         labels = EMAIL_CATEGORIES
+    categories = list(labels.keys())
+
+    if not emails:
+        return []
+
+    if use_server and CLASSIFIER_SERVER_ADDRESS:
+        # The model is loaded once by the classifier server shared by all worker processes
+        return _categorize_remotely(emails, labels, max_length)
 
     try:
         # Combine subject and body
-        text = f"Subject: {subject}\n\nBody: {body}"
-        truncated_text = truncate_text(text, max_length)
+        texts = [truncate_to_tokens(f"Subject: {subject}\n\nBody: {body}", max_length) for subject, body in emails]
+
+        # Look up memoized categories, first in memory and then in the database
+        keys = [content_hash(text, *categories) for text in texts]
+        known = {}
+        for key in keys:
+            category = category_cache.get(key)
+            if category is not None:
+                known[key] = category
+        missing = set(keys) - set(known)
+        stored = get_cached_categories(missing, CACHE_MODEL_NAME) if missing and CATEGORY_CACHE_PERSISTENT else {}
+        known.update(stored)
+
+        # Only run the model once for each distinct text that isn't cached yet
+        pending = {}
+        for index, key in enumerate(keys):
+            if key not in known:
+                pending.setdefault(key, index)
+
+        computed = {}
+        if pending:
+            # Sort by length so each batch holds similarly sized texts and needs little padding
+            order = sorted(pending.items(), key=lambda item: len(texts[item[1]]))
+
+            # Get predictions from the model
+            model = get_classifier()
+            predictions = model([texts[index] for _, index in order], batch_size=batch_size)
+            computed = {key: _best_category(prediction, categories) for (key, _), prediction in zip(order, predictions)}
 
-        # Get predictions from the model
-        model = get_classifier()
-        predictions = model(truncated_text)
+            if CATEGORY_CACHE_PERSISTENT:
+                save_cached_categories(computed, CACHE_MODEL_NAME)
 
-        # Map predictions to categories
-        categories = list(labels.keys())
-        category_scores = {categories[i]: predictions[0][i]['score'] for i in range(len(categories))}
+        for key, category in {**stored, **computed}.items():
+            category_cache.put(key, category)
+        known.update(computed)
 
-        # Get the category with the highest score
-        best_category = max(category_scores, key=category_scores.get)
+        counts = dict.fromkeys(cache_stats, 0)
+        seen = set()
+        for key in keys:
+            if key in seen:
+                counts['batch_duplicates'] += 1
+            elif key in computed:
+                counts['misses'] += 1
+            elif key in stored:
+                counts['persistent_hits'] += 1
+            else:
+                counts['memory_hits'] += 1
+            seen.add(key)
+        with _cache_stats_lock:
+            for name, count in counts.items():
+                cache_stats[name] += count
 
-        logger.info(f"Categorized email with subject '{subject[:30]}...' as '{best_category}'")
-        return best_category
+        # Map categories back to the input order
+        results = [known[key] for key in keys]
+        for (subject, _), category in zip(emails, results):
+            logger.info(f"Categorized email with subject '{subject[:30]}...' as '{category}'")
+
+        return results
 
     except Exception as e:
-        logger.error(f"Error categorizing email: {e}")
+        logger.error(f"Error categorizing emails: {e}")
         # Return a default category in case of error
-        return list(labels.keys())[0]
\ No newline at end of file
+        return [categories[0]] * len(emails)
+
+def categorize_email(subject, body, labels=None, max_length=MAX_TEXT_LENGTH):
+    """
+    Categorize an email based on its subject and body.
+
+    Args:
+        subject: The email subject.
+        body: The email body.
+        labels: Dictionary of category labels. If None, uses EMAIL_CATEGORIES from config.
+        max_length: Token budget of the model input.
+
+    Returns:
+        The predicted category of the email.
+    """
+    return categorize_emails([(subject, body)], labels=labels, max_length=max_length)[0]
+
+def get_cache_stats():
+    """
+    Get the categorization cache counters.
+
+    Returns:
+        A dict with memory hits, persistent hits, misses (model invocations) and the in-memory cache size.
+    """
+    with _cache_stats_lock:
+        return {**cache_stats, 'size': len(category_cache)}
+
+def check_backend_parity(emails, labels=None, max_length=MAX_TEXT_LENGTH, batch_size=CATEGORIZATION_BATCH_SIZE):
+    """
+    Compare the categories assigned by the PyTorch and ONNX backends.
+
+    Args:
+        emails: List of (subject, body) tuples.
+        labels: Dictionary of category labels. If None, uses EMAIL_CATEGORIES from config.
+        max_length: Token budget of the model input.
+        batch_size: Number of texts per forward pass.
+
+    Returns:
+        A dict with the agreement ratio, the number of compared emails and the mismatches,
+        where each result is a (category, top model label) tuple.
+    """
+    if labels is None:
+        labels = EMAIL_CATEGORIES
+    categories = list(labels.keys())
+    texts = [truncate_to_tokens(f"Subject: {subject}\n\nBody: {body}", max_length) for subject, body in emails]
+
+    # Compare the top model label as well, since it is what the categories are derived from
+    results = {}
+    for backend in ('pytorch', 'onnx'):
+        model = build_classifier(backend)
+        results[backend] = [
+            (_best_category(prediction, categories), max(prediction, key=lambda item: item['score'])['label'])
+            for prediction in model(texts, batch_size=batch_size)
+        ]
+
+    mismatches = [
+        {'subject': subject, 'pytorch': pytorch_result, 'onnx': onnx_result}
+        for (subject, _), pytorch_result, onnx_result in zip(emails, results['pytorch'], results['onnx'])
+        if pytorch_result != onnx_result
+    ]
+    agreement = 1 - len(mismatches) / len(emails) if emails else 1.0
+    logger.info(f"ONNX backend agrees with PyTorch on {agreement:.2%} of {len(emails)} emails")
+    return {'agreement': agreement, 'total': len(emails), 'mismatches': mismatches}
@@ -0,0 +1,136 @@
+import logging
+import multiprocessing
+import threading
+from multiprocessing.managers import BaseManager
+
+from .config import CLASSIFIER_SERVER_ADDRESS, CLASSIFIER_SERVER_AUTHKEY, MAX_TEXT_LENGTH, LOG_LEVEL, LOG_FORMAT
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+class ClassifierService:
+    """
+    Categorizes emails on behalf of other processes, so the model is loaded once for all of them.
+
+    Each client connection is served by its own thread; model calls are serialized.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def categorize_emails(self, emails, labels=None, max_length=MAX_TEXT_LENGTH):
+        """
+        Categorize several emails with the model of this process.
+
+        Args:
+            emails: List of (subject, body) tuples.
+            labels: Dictionary of category labels. If None, uses EMAIL_CATEGORIES from config.
+            max_length: Token budget of the model input.
+
+        Returns:
+            List of predicted categories, in the same order as emails.
+        """
+        from .categorizer import categorize_emails
+        with self._lock:
+            return categorize_emails(emails, labels=labels, max_length=max_length, use_server=False)
+
+_service = None
+_service_lock = threading.Lock()
+
+def _get_service():
+    """Return the classifier service of the server process."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ClassifierService()
+    return _service
+
+def _load_model():
+    """Load the model when the server starts, so the first request doesn't wait for it."""
+    from .categorizer import get_classifier
+    try:
+        get_classifier()
+    except Exception as e:
+        logger.error(f"Classifier server could not load the model, it will retry on the first request: {e}")
+
+class ClassifierManager(BaseManager):
+    """Manager serving the ClassifierService of a dedicated process to the worker processes."""
+
+ClassifierManager.register('get_classifier_service', callable=_get_service)
+
+def start_classifier_server(authkey, host='127.0.0.1', port=0):
+    """
+    Start the classifier server in a new process and load the model there.
+
+    The process is spawned rather than forked, so it doesn't inherit the state of the caller.
+
+    Args:
+        authkey: Key the clients must present, as bytes.
+        host: Interface the server listens on.
+        port: Port the server listens on; 0 lets the system pick one.
+
+    Returns:
+        The started ClassifierManager; its address is the (host, port) the server listens on.
+    """
+    manager = ClassifierManager(address=(host, port), authkey=authkey, ctx=multiprocessing.get_context('spawn'))
+    manager.start(initializer=_load_model)
+    logger.info(f"Started classifier server process on {manager.address[0]}:{manager.address[1]}")
+    return manager
+
+def is_classifier_server_running(manager):
+    """Check whether the process of a classifier server started with start_classifier_server is still running."""
+    return manager._process is not None and manager._process.is_alive()
+
+def format_address(address):
+    """Format a (host, port) server address as CLASSIFIER_SERVER_ADDRESS expects it."""
+    return f"{address[0]}:{address[1]}"
+
+_remote_service = None
+_remote_service_lock = threading.Lock()
+
+def get_remote_classifier(address=CLASSIFIER_SERVER_ADDRESS, authkey=CLASSIFIER_SERVER_AUTHKEY):
+    """
+    Get a proxy of the shared classifier service, connecting on first use.
+
+    Args:
+        address: The host:port of the classifier server.
+        authkey: The key of the classifier server.
+
+    Returns:
+        A proxy with the categorize_emails method of ClassifierService.
+    """
+    global _remote_service
+    with _remote_service_lock:
+        if _remote_service is None:
+            host, _, port = address.rpartition(':')
+            manager = ClassifierManager(address=(host, int(port)), authkey=authkey.encode())
+            manager.connect()
+            _remote_service = manager.get_classifier_service()
+            logger.info(f"Connected to classifier server at {address}")
+        return _remote_service
+
+def reset_remote_classifier():
+    """Drop the connection to the classifier server, so the next call reconnects."""
+    global _remote_service
+    with _remote_service_lock:
+        _remote_service = None
+
+def main():
+    """Command-line entry point to run a classifier server in this process."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the email classifier to gmail-ai-bot worker processes")
+    parser.add_argument("--host", default='127.0.0.1', help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=50000, help="Port to listen on")
+    args = parser.parse_args()
+
+    if not CLASSIFIER_SERVER_AUTHKEY:
+        parser.error("Set CLASSIFIER_SERVER_AUTHKEY to the key the workers will present")
+    _load_model()
+    manager = ClassifierManager(address=(args.host, args.port), authkey=CLASSIFIER_SERVER_AUTHKEY.encode())
+    logger.info(f"Serving the classifier on {args.host}:{args.port}")
+    manager.get_server().serve_forever()
+
+if __name__ == '__main__':
+    main()
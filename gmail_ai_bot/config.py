@@ -57,34 +57,142 @@ LLM_CONFIG = {
     }
 }
 
+# Providers to route draft generation over, in order of preference (comma-separated).
+# With more than one, requests go to the fastest healthy provider and spill over to the others.
+LLM_PROVIDERS = [provider.strip() for provider in os.getenv('LLM_PROVIDERS', LLM_PROVIDER).split(',') if provider.strip()]
+# Seconds to wait for a provider before hedging the request to the next one
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv('LLM_HEDGE_AFTER_SECONDS', 20))
+# Circuit breaker: a provider is skipped for the cooldown once its error rate over the last
+# LLM_HEALTH_WINDOW requests reaches LLM_CIRCUIT_FAILURE_RATE (after at least LLM_CIRCUIT_MIN_REQUESTS requests)
+LLM_HEALTH_WINDOW = int(os.getenv('LLM_HEALTH_WINDOW', 20))
+LLM_CIRCUIT_FAILURE_RATE = float(os.getenv('LLM_CIRCUIT_FAILURE_RATE', 0.5))
+LLM_CIRCUIT_MIN_REQUESTS = int(os.getenv('LLM_CIRCUIT_MIN_REQUESTS', 3))
+LLM_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv('LLM_CIRCUIT_COOLDOWN_SECONDS', 60))
+
+# Maximum number of draft generations sent to the LLM provider at once
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+
+# Maximum number of earlier unread messages of a thread included as context in its draft prompt
+THREAD_CONTEXT_MESSAGES = int(os.getenv('THREAD_CONTEXT_MESSAGES', 5))
+
+# Early termination of draft generation: the response is streamed and cut right after the first of the
+# '|'-separated stop sequences (e.g. a signature marker) or once it reaches the character budget (0 disables it)
+LLM_STOP_SEQUENCES = [sequence for sequence in os.getenv('LLM_STOP_SEQUENCES', '').split('|') if sequence]
+LLM_MAX_RESPONSE_CHARS = int(os.getenv('LLM_MAX_RESPONSE_CHARS', 4000))
+
+# Cache of generated drafts keyed by provider, model and normalized prompt, stored in the database
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'True').lower() in ('true', 'yes', '1')
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv('RESPONSE_CACHE_TTL_HOURS', 24 * 7))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+
 # Email categorization model
 CATEGORIZATION_MODEL = os.getenv('CATEGORIZATION_MODEL', 'bhadresh-savani/distilbert-base-uncased-emotion')
 
+# Categorization inference backend
+# Options: 'pytorch' (transformers pipeline), 'onnx' (int8-quantized model served by ONNX Runtime on CPU)
+CATEGORIZATION_BACKEND = os.getenv('CATEGORIZATION_BACKEND', 'pytorch')
+ONNX_CACHE_DIR = os.getenv('ONNX_CACHE_DIR', str(Path.home() / '.cache' / 'gmail_ai_bot' / 'onnx'))
+
 # Email categories and their descriptions
 EMAIL_CATEGORIES = {
     'urgent response': 'Emails requiring immediate attention and response',
     'not important': 'Emails that can be safely ignored or processed later'
 }
 
+# Categories of emails that get an auto-response draft
+RESPONSE_CATEGORIES = ["urgent response", "very important", "important"]
+
 # Email processing settings
+# Maximum number of bytes of text decoded from a message body
+MAX_BODY_BYTES = int(os.getenv('MAX_BODY_BYTES', 131072))
+# Token budget of the classifier input, capped at the model's maximum input length
 MAX_TEXT_LENGTH = int(os.getenv('MAX_TEXT_LENGTH', 512))
+# Number of tokens taken from the end of long emails (0 keeps only the beginning)
+CATEGORIZATION_TAIL_TOKENS = int(os.getenv('CATEGORIZATION_TAIL_TOKENS', 0))
+CATEGORIZATION_BATCH_SIZE = int(os.getenv('CATEGORIZATION_BATCH_SIZE', 16))
+# Number of categorization results memoized in memory, keyed by normalized content hash
+CATEGORY_CACHE_SIZE = int(os.getenv('CATEGORY_CACHE_SIZE', 10000))
+# Also keep categorization results in the database so cache hits survive restarts
+CATEGORY_CACHE_PERSISTENT = os.getenv('CATEGORY_CACHE_PERSISTENT', 'True').lower() in ('true', 'yes', '1')
 POLLING_INTERVAL_MINUTES = int(os.getenv('POLLING_INTERVAL_MINUTES', 15))
 
 # Database settings
 DB_PATH = os.getenv('DB_PATH', 'sqlite:///database.db')
-DB_ECHO = os.getenv('DB_ECHO', 'True').lower() in ('true', 'yes', '1')
+DB_ECHO = os.getenv('DB_ECHO', 'False').lower() in ('true', 'yes', '1')
+# Number of pooled connections kept open for worker threads
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+# SQLite tuning: the journal is always WAL; synchronous level (OFF, NORMAL or FULL), page cache size and
+# how long a writer waits for a lock held by another connection
+DB_SQLITE_SYNCHRONOUS = os.getenv('DB_SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+DB_SQLITE_CACHE_SIZE_MB = int(os.getenv('DB_SQLITE_CACHE_SIZE_MB', 64))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+# Email bodies are stored compressed and deduplicated by content hash. Compression: 'auto' (zstd if the
+# zstandard package is installed, else zlib), 'zstd', 'zlib' or 'none'; optionally with a shared dictionary
+# file (see `python -m gmail_ai_bot.body_store train-dict`)
+BODY_COMPRESSION = os.getenv('BODY_COMPRESSION', 'auto').lower()
+BODY_COMPRESSION_DICT = os.getenv('BODY_COMPRESSION_DICT', '')
+# Bodies are cut to this many UTF-8 bytes before they are stored (0 keeps them whole)
+MAX_STORED_BODY_BYTES = int(os.getenv('MAX_STORED_BODY_BYTES', 65536))
 
 # Gmail API settings
 GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 TOKEN_FILE = get_file_path(os.getenv('TOKEN_FILE', 'token.pickle'))
 CREDENTIALS_FILE = get_file_path(os.getenv('CREDENTIALS_FILE', 'credentials.json'))
+# Seconds before the access token expires at which the long-lived Gmail service refreshes it in the background
+GMAIL_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv('GMAIL_TOKEN_REFRESH_MARGIN_SECONDS', 300))
+# Number of requests sent per Gmail HTTP batch call (the API allows at most 100)
+GMAIL_BATCH_SIZE = min(int(os.getenv('GMAIL_BATCH_SIZE', 50)), 100)
+# Number of message IDs per messages.batchModify call used to mark mail as read (the API allows at most 1000)
+GMAIL_MODIFY_BATCH_SIZE = min(int(os.getenv('GMAIL_MODIFY_BATCH_SIZE', 1000)), 1000)
+# Number of retries of a failed batchModify call
+GMAIL_MODIFY_RETRIES = int(os.getenv('GMAIL_MODIFY_RETRIES', 3))
+# Number of message IDs requested per messages.list page (the API allows at most 500)
+GMAIL_LIST_PAGE_SIZE = min(int(os.getenv('GMAIL_LIST_PAGE_SIZE', 100)), 500)
+# Optional Gmail search query applied server-side when listing unread mail (e.g. '-category:promotions')
+GMAIL_UNREAD_QUERY = os.getenv('GMAIL_UNREAD_QUERY', '')
+# Only pick up mail added since the last run (via users.history.list) instead of re-listing all unread mail
+INCREMENTAL_SYNC = os.getenv('INCREMENTAL_SYNC', 'True').lower() in ('true', 'yes', '1')
+# Number of runs a message that failed to process is retried in before it is given up on
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 5))
+# Fetch headers first and skip downloading the body of bulk mail (newsletters, mailing lists, notifications);
+# bulk mail is still categorized, on its subject and snippet, and its body is fetched if it needs a response
+METADATA_PREFILTER = os.getenv('METADATA_PREFILTER', 'True').lower() in ('true', 'yes', '1')
+# Fetch, categorize and respond to listed pages in concurrent pipeline stages connected by bounded queues:
+# PIPELINE_IO_WORKERS threads fetch pages from Gmail, one worker runs the classifier and one saves drafts
+PIPELINE_ENABLED = os.getenv('PIPELINE_ENABLED', 'True').lower() in ('true', 'yes', '1')
+PIPELINE_IO_WORKERS = int(os.getenv('PIPELINE_IO_WORKERS', 4))
+# Number of pages waiting between two stages before the previous stage blocks
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 2))
+# Drop listed messages that were already fully processed before fetching them. Their IDs are loaded in
+# one query and kept in memory, in a Bloom filter (confirmed against the database) above the threshold
+SKIP_KNOWN_MESSAGES = os.getenv('SKIP_KNOWN_MESSAGES', 'True').lower() in ('true', 'yes', '1')
+KNOWN_IDS_BLOOM_THRESHOLD = int(os.getenv('KNOWN_IDS_BLOOM_THRESHOLD', 1000000))
+KNOWN_IDS_BLOOM_ERROR_RATE = float(os.getenv('KNOWN_IDS_BLOOM_ERROR_RATE', 0.001))
 
 # Flask settings
 FLASK_SECRET_KEY = os.getenv('FLASK_SECRET_KEY', 'your-secret-key')
 FLASK_PORT = int(os.getenv('FLASK_PORT', 8080))
 
 # Training data settings
+# Legacy CSV file, see `python -m gmail_ai_bot.training_data convert` to move it into the shards
 TRAINING_DATA_PATH = get_file_path(os.getenv('TRAINING_DATA_PATH', 'email_training_data.csv'))
+# Directory of the gzip-compressed JSON Lines shards the training data is written to
+TRAINING_DATA_DIR = get_file_path(os.getenv('TRAINING_DATA_DIR', 'training_data'))
+# Number of entries buffered in memory before they are written out
+TRAINING_DATA_BUFFER_SIZE = int(os.getenv('TRAINING_DATA_BUFFER_SIZE', 500))
+# Compressed size at which a new shard is started
+TRAINING_DATA_SHARD_MB = int(os.getenv('TRAINING_DATA_SHARD_MB', 64))
+
+# Multi-account settings (`gmail-ai-bot --accounts`)
+# Directory with one subdirectory per account, holding its token file, database, training data and an
+# optional .env file with account-specific settings (e.g. USER_NAME)
+ACCOUNTS_DIR = get_file_path(os.getenv('ACCOUNTS_DIR', 'accounts'))
+# Name of the account served by this process, set for the worker processes
+GMAIL_ACCOUNT = os.getenv('GMAIL_ACCOUNT', '')
+# Address (host:port) and key of the classifier server shared by the worker processes. When set, emails
+# are categorized by the server instead of loading the model in this process
+CLASSIFIER_SERVER_ADDRESS = os.getenv('CLASSIFIER_SERVER_ADDRESS', '')
+CLASSIFIER_SERVER_AUTHKEY = os.getenv('CLASSIFIER_SERVER_AUTHKEY', '')
 
 # User information for email responses
 USER_INFO = {
@@ -1,50 +1,342 @@
 import logging
-from .database import session, Email, get_session
-from .config import LOG_LEVEL, LOG_FORMAT
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from .body_store import prepare_body
+from .cache import BloomFilter
+from .database import Email, EmailBody, SyncState, CategoryCache, ResponseCache, ThreadDraft, session_scope
+from .config import (
+    RESPONSE_CATEGORIES, KNOWN_IDS_BLOOM_THRESHOLD, KNOWN_IDS_BLOOM_ERROR_RATE, LOG_LEVEL, LOG_FORMAT
+)
 
 # Set up logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+# Columns of the emails table written by save_messages_to_db
+EMAIL_COLUMNS = ('message_id', 'thread_id', 'subject', 'category', 'draft_created')
+
+# Rows fetched per round trip while loading the known message IDs
+KNOWN_IDS_FETCH_SIZE = 10000
+
+def _is_done(category, draft_created):
+    """Whether a stored message needs no further work: it needs no response or already has a draft."""
+    return bool(draft_created) or category not in RESPONSE_CATEGORIES
+
+class KnownMessageIds:
+    """
+    IDs of the messages that were fully processed, so they can be dropped before they are fetched again.
+
+    Messages that still wait for a draft are not included, so failed drafts are retried.
+    Large stores are kept in a Bloom filter whose hits are confirmed against the database.
+    """
+
+    def __init__(self, bloom_threshold=KNOWN_IDS_BLOOM_THRESHOLD, error_rate=KNOWN_IDS_BLOOM_ERROR_RATE):
+        """
+        Load the IDs of the processed messages with one query.
+
+        Args:
+            bloom_threshold: Number of stored messages above which a Bloom filter is used instead of a set.
+            error_rate: False positive rate of the Bloom filter.
+        """
+        self._lock = threading.Lock()
+        with session_scope() as session:
+            done = or_(Email.draft_created.is_(True), Email.category.is_(None),
+                       Email.category.notin_(RESPONSE_CATEGORIES))
+            count = session.query(Email.id).filter(done).count()
+            self.use_bloom_filter = count > bloom_threshold
+            # Leave room for the store to grow to twice its size at the configured error rate
+            self._ids = BloomFilter(2 * count, error_rate) if self.use_bloom_filter else set()
+            rows = session.query(Email.message_id).filter(done).execution_options(yield_per=KNOWN_IDS_FETCH_SIZE)
+            for row in rows:
+                self._ids.add(row.message_id)
+        logger.info(f"Loaded {count} known message IDs into a {'Bloom filter' if self.use_bloom_filter else 'set'}")
+
+    def add_many(self, message_ids):
+        """Record messages as fully processed."""
+        with self._lock:
+            for message_id in message_ids:
+                self._ids.add(message_id)
+
+    def filter_unknown(self, message_ids):
+        """
+        Drop the IDs of fully processed messages.
+
+        Args:
+            message_ids: IDs of listed messages.
+
+        Returns:
+            The IDs that still need processing, in their original order.
+        """
+        with self._lock:
+            candidates = [message_id for message_id in message_ids if message_id in self._ids]
+        if candidates and self.use_bloom_filter:
+            # Bloom filter hits may be false positives, confirm them with one query
+            candidates = get_done_message_ids(candidates)
+        known = set(candidates)
+        return [message_id for message_id in message_ids if message_id not in known]
+
+_known_message_ids = None
+_known_message_ids_lock = threading.Lock()
+
+def get_known_message_ids():
+    """
+    Get the process-wide registry of fully processed message IDs, loading it on first use.
+
+    Returns:
+        The shared KnownMessageIds instance.
+    """
+    global _known_message_ids
+    with _known_message_ids_lock:
+        if _known_message_ids is None:
+            _known_message_ids = KnownMessageIds()
+    return _known_message_ids
+
+def _mark_known(message_ids):
+    """Add message IDs to the registry of fully processed messages, if it has been loaded."""
+    if _known_message_ids is not None:
+        _known_message_ids.add_many(message_ids)
+
+def get_done_message_ids(message_ids):
+    """Return the subset of the given message IDs that are stored and fully processed."""
+    try:
+        with session_scope() as session:
+            rows = session.query(Email.message_id, Email.category, Email.draft_created).filter(
+                Email.message_id.in_(list(message_ids))
+            )
+            return {row.message_id for row in rows if _is_done(row.category, row.draft_created)}
+    except Exception as e:
+        logger.error(f"Error looking up processed messages: {e}")
+        return set()
+
+def _insert_ignoring_conflicts(session, model, rows, index_elements):
+    """Insert rows in one statement, skipping rows that collide with existing ones on index_elements."""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        session.execute(insert(model).on_conflict_do_nothing(index_elements=index_elements), rows)
+        return
+
+    # Other databases: look up the existing keys first, still within the one transaction
+    key = getattr(model, index_elements[0])
+    existing = {row[0] for row in session.query(key).filter(key.in_([row[index_elements[0]] for row in rows]))}
+    session.add_all(model(**row) for row in rows if row[index_elements[0]] not in existing)
+
+def save_bodies(session, bodies):
+    """Store prepared bodies (see body_store.prepare_body), skipping the ones already stored."""
+    unique_bodies = list({body['body_hash']: body for body in bodies}.values())
+    if unique_bodies:
+        _insert_ignoring_conflicts(session, EmailBody, unique_bodies, ['body_hash'])
+
+def save_messages_to_db(emails):
+    """
+    Save several messages to the database in one transaction, skipping the ones already stored.
+
+    Bodies are capped, compressed and stored once per distinct text.
+
+    Args:
+        emails: List of dicts with message_id, thread_id, subject, body, category and
+            optionally draft_created.
+
+    Returns:
+        True if the messages were saved (or already stored), False on a database error.
+    """
+    if not emails:
+        return True
+
+    try:
+        with session_scope() as session:
+            # Skip the messages already stored before storing any body, so no body is left unreferenced
+            stored = {row.message_id for row in session.query(Email.message_id).filter(
+                Email.message_id.in_([email['message_id'] for email in emails])
+            )}
+            rows, bodies = [], []
+            for email in emails:
+                if email['message_id'] in stored:
+                    continue
+                stored.add(email['message_id'])
+                row = {column: email.get(column, False if column == 'draft_created' else None)
+                       for column in EMAIL_COLUMNS}
+                body = prepare_body(email.get('body'))
+                row['body_hash'] = body['body_hash']
+                rows.append(row)
+                bodies.append(body)
+            if rows:
+                save_bodies(session, bodies)
+                _insert_ignoring_conflicts(session, Email, rows, ['message_id'])
+        logger.info(f"Saved {len(rows)} new messages to database, {len(emails) - len(rows)} already stored")
+        _mark_known(row['message_id'] for row in rows if _is_done(row['category'], row['draft_created']))
+        return True
+    except Exception as e:
+        logger.error(f"Error saving messages to database: {e}")
+        return False
+
 def save_message_to_db(message_id, thread_id, subject, body, category, draft_created=False):
     """Save the message to the database if it hasn't been categorized yet."""
+    save_messages_to_db([{
+        'message_id': message_id,
+        'thread_id': thread_id,
+        'subject': subject,
+        'body': body,
+        'category': category,
+        'draft_created': draft_created,
+    }])
+
+def get_drafted_message_ids(message_ids):
+    """Return the subset of the given message IDs that already have a draft."""
     try:
-        if not session.query(Email).filter_by(message_id=message_id).first():
-            new_email = Email(
-                message_id=message_id,
-                thread_id=thread_id,
-                subject=subject,
-                body=body,
-                category=category,
-                draft_created=draft_created
+        with session_scope() as session:
+            rows = session.query(Email.message_id).filter(
+                Email.message_id.in_(list(message_ids)),
+                Email.draft_created.is_(True)
             )
-            session.add(new_email)
-            session.commit()
-            logger.info(f"Saved message {message_id} to database")
-        else:
-            logger.info(f"Message {message_id} already exists in database")
+            return {row.message_id for row in rows}
     except Exception as e:
-        logger.error(f"Error saving message to database: {e}")
-        session.rollback()
+        logger.error(f"Error checking draft status: {e}")
+        return set()
 
 def check_draft_created(message_id):
     """Check if a draft has already been created for this message."""
+    return message_id in get_drafted_message_ids([message_id])
+
+def update_draft_status_many(message_ids):
+    """Update the database in one transaction to indicate that drafts have been created for the messages."""
+    message_ids = list(message_ids)
     try:
-        return session.query(Email).filter_by(message_id=message_id, draft_created=True).first() is not None
+        with session_scope() as session:
+            updated = session.query(Email).filter(Email.message_id.in_(message_ids)).update(
+                {Email.draft_created: True}, synchronize_session=False
+            )
+        if updated < len(message_ids):
+            logger.warning(f"Attempted to update draft status for {len(message_ids) - updated} non-existent messages")
+        logger.info(f"Updated draft status for {updated} messages")
+        _mark_known(message_ids)
     except Exception as e:
-        logger.error(f"Error checking draft status: {e}")
-        return False
+        logger.error(f"Error updating draft status: {e}")
 
 def update_draft_status(message_id):
     """Update the database to indicate that a draft has been created for this message."""
+    update_draft_status_many([message_id])
+
+def get_thread_draft(thread_id):
+    """
+    Return the (draft ID, answered message ID, draft message ID) of the thread's draft, or None if it has none.
+
+    The draft message ID is None for drafts recorded before it was stored.
+    """
     try:
-        email = session.query(Email).filter_by(message_id=message_id).first()
-        if email:
-            email.draft_created = True
-            session.commit()
-            logger.info(f"Updated draft status for message {message_id}")
-        else:
-            logger.warning(f"Attempted to update draft status for non-existent message {message_id}")
+        with session_scope() as session:
+            thread_draft = session.get(ThreadDraft, thread_id)
+            if thread_draft is None:
+                return None
+            return thread_draft.draft_id, thread_draft.message_id, thread_draft.draft_message_id
     except Exception as e:
-        logger.error(f"Error updating draft status: {e}")
-        session.rollback()
\ No newline at end of file
+        logger.error(f"Error reading draft of thread {thread_id}: {e}")
+        return None
+
+def save_thread_draft(thread_id, draft_id, message_id, draft_message_id=None):
+    """Record the draft answering a thread, the latest message it answers and the message of the draft itself."""
+    try:
+        with session_scope() as session:
+            session.merge(ThreadDraft(
+                thread_id=thread_id,
+                draft_id=draft_id,
+                message_id=message_id,
+                draft_message_id=draft_message_id,
+                updated_at=datetime.now()
+            ))
+        logger.info(f"Updated draft of thread {thread_id} to {draft_id}")
+    except Exception as e:
+        logger.error(f"Error saving draft of thread {thread_id}: {e}")
+
+def get_sync_state(key):
+    """Return the stored value of a sync checkpoint, or None if it hasn't been set."""
+    try:
+        with session_scope() as session:
+            state = session.get(SyncState, key)
+            return state.value if state else None
+    except Exception as e:
+        logger.error(f"Error reading sync state '{key}': {e}")
+        return None
+
+def set_sync_state(key, value):
+    """Store the value of a sync checkpoint, returning True if it was stored."""
+    try:
+        with session_scope() as session:
+            session.merge(SyncState(key=key, value=str(value)))
+        logger.info(f"Updated sync state '{key}'")
+        return True
+    except Exception as e:
+        logger.error(f"Error updating sync state '{key}': {e}")
+        return False
+
+def get_cached_categories(content_hashes, model):
+    """Return a dict mapping the given content hashes to their cached category for the model."""
+    try:
+        with session_scope() as session:
+            rows = session.query(CategoryCache).filter(
+                CategoryCache.model == model,
+                CategoryCache.content_hash.in_(list(content_hashes))
+            ).all()
+            return {row.content_hash: row.category for row in rows}
+    except Exception as e:
+        logger.error(f"Error reading cached categories: {e}")
+        return {}
+
+def save_cached_categories(categories, model):
+    """Store a dict mapping content hashes to categories for the model."""
+    try:
+        with session_scope() as session:
+            for content_hash, category in categories.items():
+                session.merge(CategoryCache(content_hash=content_hash, model=model, category=category))
+    except Exception as e:
+        logger.error(f"Error saving cached categories: {e}")
+
+def get_cached_response(prompt_hash, provider, model, ttl_hours):
+    """Return the cached response for the prompt hash, provider and model, or None if missing or expired."""
+    try:
+        with session_scope() as session:
+            entry = session.get(ResponseCache, (prompt_hash, provider, model))
+            if entry is None:
+                return None
+
+            now = datetime.now()
+            if entry.created_at < now - timedelta(hours=ttl_hours):
+                session.delete(entry)
+                return None
+
+            entry.last_used_at = now
+            return entry.response
+    except Exception as e:
+        logger.error(f"Error reading cached response: {e}")
+        return None
+
+def save_cached_response(prompt_hash, provider, model, response, max_entries):
+    """Store a response in the cache, evicting the least recently used entries beyond max_entries."""
+    try:
+        with session_scope() as session:
+            now = datetime.now()
+            session.merge(ResponseCache(
+                prompt_hash=prompt_hash,
+                provider=provider,
+                model=model,
+                response=response,
+                created_at=now,
+                last_used_at=now
+            ))
+            session.flush()
+
+            # Find the last-use time of the oldest entry that still fits and drop everything older
+            cutoff = session.query(ResponseCache.last_used_at).order_by(
+                ResponseCache.last_used_at.desc()
+            ).offset(max_entries).limit(1).scalar()
+            if cutoff is not None:
+                session.query(ResponseCache).filter(ResponseCache.last_used_at <= cutoff).delete()
+    except Exception as e:
+        logger.error(f"Error saving cached response: {e}")
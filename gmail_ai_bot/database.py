@@ -1,41 +1,276 @@
 import logging
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean
+import threading
+from contextlib import contextmanager
+from sqlalchemy import (
+    create_engine, event, inspect, select, text, Column, Index, Integer, String, Text, Boolean, DateTime, LargeBinary
+)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import relationship, scoped_session, sessionmaker
 
-from .config import DB_PATH, DB_ECHO, LOG_LEVEL, LOG_FORMAT
+from .body_store import decode_body, prepare_body
+from .config import (
+    DB_PATH, DB_ECHO, DB_POOL_SIZE, DB_SQLITE_SYNCHRONOUS, DB_SQLITE_CACHE_SIZE_MB, DB_BUSY_TIMEOUT_MS, LOG_LEVEL,
+    LOG_FORMAT
+)
 
 # Set up logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
-# Define database engine
-logger.info(f"Initializing database with path: {DB_PATH}, echo: {DB_ECHO}")
-engine = create_engine(DB_PATH, echo=DB_ECHO)
-
 # Define Base for ORM models
 Base = declarative_base()
 
+# Define the email body model (compressed bodies, deduplicated by the hash of their text)
+class EmailBody(Base):
+    __tablename__ = 'email_bodies'
+
+    body_hash = Column(String(64), primary_key=True)
+    codec = Column(String(32), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+    @property
+    def text(self):
+        return decode_body(self.codec, self.data)
+
 # Define the Emails model
 class Email(Base):
     __tablename__ = 'emails'
+    __table_args__ = (
+        # Covers the draft status lookups by message ID without touching the table
+        Index('ix_emails_message_id_draft_created', 'message_id', 'draft_created'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     message_id = Column(String(255), unique=True, nullable=False)
-    thread_id = Column(String(255), nullable=False)
+    thread_id = Column(String(255), nullable=False, index=True)
     subject = Column(Text, nullable=True)
-    body = Column(Text, nullable=True)
+    # Uncompressed body of emails stored by older versions, see body_store.compact_bodies
+    legacy_body = Column('body', Text, nullable=True)
+    body_hash = Column(String(64), nullable=True)
     category = Column(String(50), nullable=True)
     draft_created = Column(Boolean, default=False)
 
-# Create the table
-Base.metadata.create_all(engine)
+    stored_body = relationship(EmailBody, primaryjoin='foreign(Email.body_hash) == EmailBody.body_hash', viewonly=True)
+
+    @property
+    def body(self):
+        """The email body, read from the compressed body store."""
+        pending = self.__dict__.get('_pending_body')
+        if pending is not None:
+            return decode_body(pending['codec'], pending['data'])
+        if self.stored_body is not None:
+            return self.stored_body.text
+        return self.legacy_body
+
+    @body.setter
+    def body(self, text):
+        """Compress the body; its row in the body store is added when the email is flushed."""
+        prepared = prepare_body(text)
+        self.body_hash = prepared['body_hash']
+        self.legacy_body = None
+        self._pending_body = prepared
+
+# Define the sync state model (checkpoints such as the last Gmail history ID)
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+
+    key = Column(String(255), primary_key=True)
+    value = Column(Text, nullable=True)
+
+# Define the categorization cache model (category per normalized content hash and model)
+class CategoryCache(Base):
+    __tablename__ = 'category_cache'
+
+    content_hash = Column(String(64), primary_key=True)
+    model = Column(String(255), primary_key=True)
+    category = Column(String(50), nullable=False)
+
+# Define the LLM response cache model (generated text per normalized prompt hash, provider and model)
+class ResponseCache(Base):
+    __tablename__ = 'response_cache'
+
+    prompt_hash = Column(String(64), primary_key=True)
+    provider = Column(String(50), primary_key=True)
+    model = Column(String(255), primary_key=True)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    last_used_at = Column(DateTime, nullable=False, index=True)
+
+# Define the thread draft model (the Gmail draft answering a thread and the latest message it answers)
+class ThreadDraft(Base):
+    __tablename__ = 'thread_drafts'
+
+    thread_id = Column(String(255), primary_key=True)
+    draft_id = Column(String(255), nullable=False)
+    message_id = Column(String(255), nullable=False)
+    # Gmail gives a draft a new message ID each time it is saved, so a different one means the user edited it
+    draft_message_id = Column(String(255))
+    updated_at = Column(DateTime, nullable=False)
+
+# Thread-local session registry, bound to the engine when the engine is created on first use
+_session_factory = sessionmaker()
+Session = scoped_session(_session_factory)
+_engine = None
+_engine_lock = threading.Lock()
+
+@event.listens_for(_session_factory, 'before_flush')
+def _store_pending_bodies(session, flush_context, instances):
+    """Add the bodies assigned to emails to the body store, once per distinct text."""
+    from .connector import save_bodies
+
+    bodies = [
+        obj.__dict__.pop('_pending_body') for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, Email) and obj.__dict__.get('_pending_body') is not None
+    ]
+    if bodies:
+        save_bodies(session, bodies)
+
+# Sync state key under which the schema version of the database is stored
+SCHEMA_VERSION_KEY = 'schema_version'
 
-# Create a Session
-Session = sessionmaker(bind=engine)
-session = Session()
+def _add_indexes(connection):
+    """Add the indexes of the emails table."""
+    for index in Email.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+def _add_body_hash(connection):
+    """Reference the compressed body store from the emails table."""
+    if 'body_hash' not in {column['name'] for column in inspect(connection).get_columns('emails')}:
+        connection.execute(text("ALTER TABLE emails ADD COLUMN body_hash VARCHAR(64)"))
+
+def _widen_sync_state_value(connection):
+    """Let sync state values hold lists such as the message IDs to retry."""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute(text("ALTER TABLE sync_state ALTER COLUMN value TYPE TEXT"))
+    elif dialect in ('mysql', 'mariadb'):
+        connection.execute(text("ALTER TABLE sync_state MODIFY value TEXT"))
+    # SQLite doesn't enforce the length of VARCHAR columns
+
+def _add_draft_message_id(connection):
+    """Record the message of each thread draft, to tell whether the user has edited it."""
+    if 'draft_message_id' not in {column['name'] for column in inspect(connection).get_columns('thread_drafts')}:
+        connection.execute(text("ALTER TABLE thread_drafts ADD COLUMN draft_message_id VARCHAR(255)"))
+
+# Schema migrations for databases created by older versions, in order; a database
+# at schema version N has had the first N migrations applied
+MIGRATIONS = [
+    _add_indexes,
+    _add_body_hash,
+    _widen_sync_state_value,
+    _add_draft_message_id,
+]
+
+def migrate(engine):
+    """
+    Bring the schema of an existing database up to date.
+
+    Args:
+        engine: The SQLAlchemy engine.
+    """
+    sync_state = SyncState.__table__
+    with engine.begin() as connection:
+        stored = connection.execute(
+            select(sync_state.c.value).where(sync_state.c.key == SCHEMA_VERSION_KEY)
+        ).scalar()
+        version = int(stored) if stored is not None else 0
+        if version >= len(MIGRATIONS):
+            return
+
+        for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Migrating database schema to version {target}: {migration.__doc__}")
+            migration(connection)
+
+        if stored is None:
+            connection.execute(sync_state.insert().values(key=SCHEMA_VERSION_KEY, value=str(len(MIGRATIONS))))
+        else:
+            connection.execute(
+                sync_state.update().where(sync_state.c.key == SCHEMA_VERSION_KEY).values(value=str(len(MIGRATIONS)))
+            )
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the SQLite tuning profile to each new connection."""
+    synchronous = DB_SQLITE_SYNCHRONOUS if DB_SQLITE_SYNCHRONOUS in ('OFF', 'NORMAL', 'FULL') else 'NORMAL'
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers work alongside the writer; with it, synchronous=NORMAL only syncs at checkpoints
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={synchronous}")
+    # A negative cache size is in KiB
+    cursor.execute(f"PRAGMA cache_size=-{DB_SQLITE_CACHE_SIZE_MB * 1024}")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def _create_engine(db_path):
+    """Create the engine, with a connection pool and tuning profile for file-based SQLite databases."""
+    if not db_path.startswith('sqlite') or ':memory:' in db_path or db_path.rstrip('/') in ('sqlite:', 'sqlite:/'):
+        return create_engine(db_path, echo=DB_ECHO)
+
+    engine = create_engine(
+        db_path,
+        echo=DB_ECHO,
+        # Pooled connections are shared by the worker threads
+        connect_args={'check_same_thread': False, 'timeout': DB_BUSY_TIMEOUT_MS / 1000},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_POOL_SIZE
+    )
+    event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
+
+def get_engine():
+    """
+    Get the database engine, creating it and the tables on first use.
+
+    Returns:
+        The SQLAlchemy engine.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                # Define database engine
+                logger.info(f"Initializing database with path: {DB_PATH}, echo: {DB_ECHO}")
+                engine = _create_engine(DB_PATH)
+
+                # Create the tables and migrate existing ones
+                Base.metadata.create_all(engine)
+                migrate(engine)
+                Session.configure(bind=engine)
+                _engine = engine
+    return _engine
 
 # Export the session and Base for use in other modules
 def get_session():
-    """Get a new database session."""
-    return Session()
\ No newline at end of file
+    """Get the database session of the current thread."""
+    get_engine()
+    return Session()
+
+@contextmanager
+def session_scope():
+    """
+    Provide a transactional scope around a series of operations.
+
+    Commits when the block succeeds and rolls back when it raises; the thread's
+    session is released afterwards either way.
+
+    Yields:
+        The database session of the current thread.
+    """
+    session = get_session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        Session.remove()
+
+def __getattr__(name):
+    """Create the module-level engine lazily and expose the thread-local session registry as `session`."""
+    if name == 'engine':
+        return get_engine()
+    if name == 'session':
+        get_engine()
+        return Session
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+from .config import GMAIL_MODIFY_BATCH_SIZE, GMAIL_MODIFY_RETRIES, LOG_LEVEL, LOG_FORMAT
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+class LabelBatcher:
+    """
+    Collects label changes during a run and applies them with users.messages.batchModify.
+    Messages with the same label change are sent together, up to batch_size IDs per call.
+    """
+
+    def __init__(self, service, batch_size=GMAIL_MODIFY_BATCH_SIZE, retries=GMAIL_MODIFY_RETRIES):
+        """
+        Initialize the batcher.
+
+        Args:
+            service: The Gmail API service object.
+            batch_size: Maximum number of message IDs per batchModify call (the API allows at most 1000).
+            retries: Number of times a failed chunk is retried.
+        """
+        self.service = service
+        self.batch_size = min(batch_size, 1000)
+        self.retries = retries
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def modify(self, message_id, add_label_ids=(), remove_label_ids=()):
+        """
+        Queue a label change for a message.
+
+        Args:
+            message_id: The Gmail message ID.
+            add_label_ids: Labels to add to the message.
+            remove_label_ids: Labels to remove from the message.
+        """
+        key = (tuple(sorted(add_label_ids)), tuple(sorted(remove_label_ids)))
+        with self._lock:
+            message_ids = self._pending.setdefault(key, [])
+            if message_id not in message_ids:
+                message_ids.append(message_id)
+
+    def mark_as_read(self, message_id):
+        """Queue the removal of the UNREAD label from a message."""
+        self.modify(message_id, remove_label_ids=['UNREAD'])
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(message_ids) for message_ids in self._pending.values())
+
+    def _execute(self, body):
+        """Send one batchModify call, retrying with exponential backoff. Returns True on success."""
+        for attempt in range(self.retries + 1):
+            try:
+                self.service.users().messages().batchModify(userId='me', body=body).execute()
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"Error modifying labels of {len(body['ids'])} messages: {e}")
+                    return False
+                delay = 2 ** attempt
+                logger.warning(f"Error modifying labels of {len(body['ids'])} messages, retrying in {delay}s: {e}")
+                time.sleep(delay)
+
+    def flush(self):
+        """
+        Apply all queued label changes.
+
+        Returns:
+            The IDs of the messages whose labels could not be changed.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        failed = []
+        for (add_label_ids, remove_label_ids), message_ids in pending.items():
+            for start in range(0, len(message_ids), self.batch_size):
+                chunk = message_ids[start:start + self.batch_size]
+                body = {'ids': chunk}
+                if add_label_ids:
+                    body['addLabelIds'] = list(add_label_ids)
+                if remove_label_ids:
+                    body['removeLabelIds'] = list(remove_label_ids)
+
+                if self._execute(body):
+                    logger.info(f"Modified labels of {len(chunk)} messages (add {list(add_label_ids)}, "
+                                f"remove {list(remove_label_ids)})")
+                else:
+                    failed.extend(chunk)
+        return failed
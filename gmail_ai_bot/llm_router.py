@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Sequence
+
+from .llm_service import get_llm_service
+from .config import (
+    LLM_PROVIDERS, LLM_HEDGE_AFTER_SECONDS, LLM_HEALTH_WINDOW, LLM_CIRCUIT_FAILURE_RATE, LLM_CIRCUIT_MIN_REQUESTS,
+    LLM_CIRCUIT_COOLDOWN_SECONDS, LOG_LEVEL, LOG_FORMAT
+)
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+class LLMUnavailableError(RuntimeError):
+    """Raised when no configured LLM provider could generate a response."""
+
+class ProviderHealth:
+    """
+    Rolling latency and error statistics of one provider, with a circuit breaker.
+
+    The circuit opens when the error rate over the window reaches the threshold. After the
+    cooldown a single trial request is let through (half-open); its outcome closes the
+    circuit again or re-opens it.
+    """
+
+    def __init__(self, name: str, window: int = LLM_HEALTH_WINDOW, failure_rate: float = LLM_CIRCUIT_FAILURE_RATE,
+                 min_requests: int = LLM_CIRCUIT_MIN_REQUESTS, cooldown: float = LLM_CIRCUIT_COOLDOWN_SECONDS):
+        self.name = name
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.opened_at = None
+        self.trial_in_progress = False
+        self._lock = threading.Lock()
+
+    def record_success(self, latency: float):
+        """Record a successful request and close the circuit."""
+        with self._lock:
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+            if self.opened_at is not None:
+                logger.info(f"Closing circuit of provider {self.name} after a successful trial request")
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_failure(self):
+        """Record a failed request, opening the circuit if the error rate is too high."""
+        with self._lock:
+            self.outcomes.append(False)
+            failures = self.outcomes.count(False)
+            if self.opened_at is not None or (
+                len(self.outcomes) >= self.min_requests and failures / len(self.outcomes) >= self.failure_rate
+            ):
+                if self.opened_at is None:
+                    logger.warning(f"Opening circuit of provider {self.name} after {failures} failures")
+                self.opened_at = time.monotonic()
+            self.trial_in_progress = False
+
+    def release(self):
+        """Give back a trial request that ended without an outcome (e.g. it was cancelled)."""
+        with self._lock:
+            self.trial_in_progress = False
+
+    def acquire(self) -> bool:
+        """
+        Check whether a request may be sent to the provider now.
+
+        Returns:
+            True if the circuit is closed, or if it is half-open and this caller gets the trial request.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_in_progress or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.trial_in_progress = True
+            return True
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    @property
+    def expected_latency(self) -> float:
+        """Median latency over the window, or infinity for providers without successful requests yet."""
+        with self._lock:
+            return statistics.median(self.latencies) if self.latencies else float('inf')
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+class LLMRouter:
+    """
+    Routes generation requests over several LLM providers.
+    Each request goes to the fastest healthy provider; if it hasn't answered within the hedge
+    delay, or fails, the request is also sent to the next provider and the first answer wins.
+    """
+
+    def __init__(self, providers: Optional[Sequence[str]] = None, hedge_after: float = LLM_HEDGE_AFTER_SECONDS):
+        """
+        Initialize the router.
+
+        Args:
+            providers: The LLM providers to route over, in order of preference. If None, uses LLM_PROVIDERS.
+            hedge_after: Seconds to wait for a provider before hedging the request to the next one.
+        """
+        self.providers = list(providers or LLM_PROVIDERS)
+        self.hedge_after = hedge_after
+        self.health: Dict[str, ProviderHealth] = {provider: ProviderHealth(provider) for provider in self.providers}
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.providers), thread_name_prefix='llm-router')
+
+        # Identify the router like a service so callers can key caches on it
+        self.provider = 'router'
+        self.model = ','.join(self.providers)
+
+    def _service(self, provider: str):
+        return get_llm_service(provider=provider)
+
+    def _ranked_providers(self) -> List[str]:
+        """Providers with a closed circuit, fastest first; providers without latency data keep their configured order."""
+        closed = [provider for provider in self.providers if not self.health[provider].is_open]
+        return sorted(closed, key=lambda provider: self.health[provider].expected_latency) + [
+            provider for provider in self.providers if self.health[provider].is_open
+        ]
+
+    def _next_provider(self, candidates: List[str]) -> Optional[str]:
+        """Pop the first candidate whose circuit lets a request through."""
+        while candidates:
+            provider = candidates.pop(0)
+            if self.health[provider].acquire():
+                return provider
+        return None
+
+    def _generate_with(self, provider: str, prompt: str, max_tokens: int, **kwargs) -> str:
+        start = time.monotonic()
+        try:
+            response = self._service(provider).generate_text(prompt, max_tokens, fallback=False, **kwargs)
+        except Exception:
+            self.health[provider].record_failure()
+            raise
+        self.health[provider].record_success(time.monotonic() - start)
+        return response
+
+    async def _agenerate_with(self, provider: str, prompt: str, max_tokens: int, **kwargs) -> str:
+        start = time.monotonic()
+        try:
+            response = await self._service(provider).agenerate_text(prompt, max_tokens, fallback=False, **kwargs)
+        except asyncio.CancelledError:
+            # A hedged request that lost the race says nothing about the provider's health
+            self.health[provider].release()
+            raise
+        except Exception:
+            self.health[provider].record_failure()
+            raise
+        self.health[provider].record_success(time.monotonic() - start)
+        return response
+
+    def generate_text(self, prompt: str, max_tokens: int = 1000, stop_sequences: Optional[Sequence[str]] = None,
+                      max_chars: Optional[int] = None, fallback: bool = False) -> str:
+        """
+        Generate text with the fastest healthy provider, hedging to the next one when it is slow or fails.
+
+        Args:
+            prompt: The prompt to send to the LLM.
+            max_tokens: Maximum number of tokens to generate.
+            stop_sequences: Strings that complete the response, see LLMService.generate_text.
+            max_chars: Maximum number of characters of the response.
+            fallback: Accepted for interface compatibility with LLMService; the router always raises.
+
+        Returns:
+            The generated text response.
+
+        Raises:
+            LLMUnavailableError: If no provider produced a response.
+        """
+        candidates = self._ranked_providers()
+        kwargs = {'stop_sequences': stop_sequences, 'max_chars': max_chars}
+        pending, errors = {}, []
+
+        def launch():
+            provider = self._next_provider(candidates)
+            if provider is not None:
+                logger.info(f"Routing generation request to {provider}")
+                pending[self._executor.submit(self._generate_with, provider, prompt, max_tokens, **kwargs)] = provider
+            return provider is not None
+
+        launch()
+        while pending:
+            done, _ = wait(list(pending), timeout=self.hedge_after if candidates else None, return_when=FIRST_COMPLETED)
+            if not done:
+                if launch():
+                    logger.warning(f"No response after {self.hedge_after}s, hedged the request")
+                continue
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    logger.error(f"Provider {provider} failed: {e}")
+                    errors.append(f"{provider}: {e}")
+                    if not pending:
+                        launch()
+
+        raise LLMUnavailableError(f"No LLM provider could generate a response ({'; '.join(errors) or 'all circuits open'})")
+
+    async def agenerate_text(self, prompt: str, max_tokens: int = 1000, stop_sequences: Optional[Sequence[str]] = None,
+                             max_chars: Optional[int] = None, fallback: bool = False) -> str:
+        """
+        Asynchronously generate text with the fastest healthy provider, hedging to the next one when it is slow or fails.
+
+        Args:
+            prompt: The prompt to send to the LLM.
+            max_tokens: Maximum number of tokens to generate.
+            stop_sequences: Strings that complete the response, see LLMService.generate_text.
+            max_chars: Maximum number of characters of the response.
+            fallback: Accepted for interface compatibility with LLMService; the router always raises.
+
+        Returns:
+            The generated text response.
+
+        Raises:
+            LLMUnavailableError: If no provider produced a response.
+        """
+        candidates = self._ranked_providers()
+        kwargs = {'stop_sequences': stop_sequences, 'max_chars': max_chars}
+        pending, errors = {}, []
+
+        def launch():
+            provider = self._next_provider(candidates)
+            if provider is not None:
+                logger.info(f"Routing generation request to {provider}")
+                task = asyncio.ensure_future(self._agenerate_with(provider, prompt, max_tokens, **kwargs))
+                pending[task] = provider
+            return provider is not None
+
+        launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    list(pending), timeout=self.hedge_after if candidates else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if launch():
+                        logger.warning(f"No response after {self.hedge_after}s, hedged the request")
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        logger.error(f"Provider {provider} failed: {e}")
+                        errors.append(f"{provider}: {e}")
+                        if not pending:
+                            launch()
+        finally:
+            # Cancel the requests that lost the race
+            for task in pending:
+                task.cancel()
+
+        raise LLMUnavailableError(f"No LLM provider could generate a response ({'; '.join(errors) or 'all circuits open'})")
+
+    def get_stats(self) -> Dict[str, dict]:
+        """
+        Get the health statistics of each provider.
+
+        Returns:
+            A dict mapping each provider to its expected latency, error rate and circuit state.
+        """
+        return {
+            provider: {
+                'expected_latency': health.expected_latency,
+                'error_rate': health.error_rate,
+                'circuit_open': health.is_open,
+            }
+            for provider, health in self.health.items()
+        }
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_llm_router() -> LLMRouter:
+    """
+    Get the process-wide router over the configured LLM providers.
+
+    Returns:
+        The shared LLMRouter instance.
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter()
+    return _router
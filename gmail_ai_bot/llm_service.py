@@ -1,5 +1,8 @@
+import asyncio
 import logging
-from typing import Dict, List, Optional, Union, Any
+import threading
+import weakref
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple, Union, Any
 
 # Import config
 from .config import LLM_PROVIDER, LLM_CONFIG, LOG_LEVEL, LOG_FORMAT
@@ -8,6 +11,50 @@ from .config import LLM_PROVIDER, LLM_CONFIG, LOG_LEVEL, LOG_FORMAT
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+# Process-wide registry of initialized services keyed by (provider, model)
+_service_pool: Dict[Tuple[str, str], 'LLMService'] = {}
+_service_pool_lock = threading.Lock()
+
+class _StreamCutter:
+    """
+    Applies stop conditions to a stream of text chunks.
+    """
+
+    def __init__(self, stop_sequences: Optional[Sequence[str]] = None, max_chars: Optional[int] = None):
+        self.stop_sequences = [sequence for sequence in (stop_sequences or []) if sequence]
+        self.max_chars = max_chars
+        self.text = ''
+
+    @property
+    def length(self) -> int:
+        return len(self.text)
+
+    def feed(self, chunk: str) -> Tuple[str, bool]:
+        """
+        Add a chunk to the response.
+
+        Args:
+            chunk: The next chunk of generated text.
+
+        Returns:
+            A tuple of (part of the chunk to emit, whether the response is complete).
+        """
+        start = len(self.text)
+        combined = self.text + chunk
+        end, done = len(combined), False
+
+        for sequence in self.stop_sequences:
+            # A stop sequence may straddle the previous chunk and this one
+            index = combined.find(sequence, max(0, start - len(sequence) + 1))
+            if index != -1 and index + len(sequence) <= end:
+                end, done = index + len(sequence), True
+
+        if self.max_chars is not None and end >= self.max_chars:
+            end, done = self.max_chars, True
+
+        self.text = combined[:max(end, start)]
+        return combined[start:end], done
+
 class LLMService:
     """
     A service for interacting with various LLM providers.
@@ -26,6 +73,10 @@ class LLMService:
         self.config = LLM_CONFIG.get(self.provider, {})
         self.model = model or self.config.get('model')
         self.client = None
+        self.generative_model = None
+        # Async clients are bound to the event loop they were created in
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_clients_lock = threading.Lock()
         
         logger.info(f"Initializing LLM service with provider: {self.provider}, model: {self.model}")
         self._initialize_client()
@@ -35,7 +86,8 @@ class LLMService:
         try:
             if self.provider == 'ollama':
                 import ollama
-                self.client = ollama
+                # A dedicated client keeps its HTTP connections alive between requests
+                self.client = ollama.Client(host=self.config.get('api_base'))
                 logger.info("Initialized Ollama client")
                 
             elif self.provider == 'openai':
@@ -53,6 +105,7 @@ class LLMService:
                     raise ValueError("Google API key is required")
                 genai.configure(api_key=api_key)
                 self.client = genai
+                self.generative_model = genai.GenerativeModel(self.model)
                 logger.info("Initialized Google Gemini client")
                 
             elif self.provider == 'huggingface':
@@ -72,18 +125,25 @@ class LLMService:
             logger.error(f"Error initializing client for provider {self.provider}: {e}")
             raise
 
-    def generate_text(self, prompt: str, max_tokens: int = 1000) -> str:
+    def generate_text(self, prompt: str, max_tokens: int = 1000, stop_sequences: Optional[Sequence[str]] = None,
+                      max_chars: Optional[int] = None, fallback: bool = True) -> str:
         """
         Generate text using the configured LLM provider.
 
         Args:
             prompt: The prompt to send to the LLM.
             max_tokens: Maximum number of tokens to generate.
+            stop_sequences: If given, the response is streamed and ends right after the first of these strings.
+            max_chars: If given, the response is streamed and ends once it reaches this many characters.
+            fallback: If True, errors are logged and an apology text is returned instead of raising.
 
         Returns:
             The generated text response.
         """
         try:
+            if stop_sequences or max_chars:
+                return ''.join(self.stream_text(prompt, max_tokens, stop_sequences, max_chars))
+
             logger.info(f"Generating text with provider: {self.provider}, model: {self.model}")
             
             if self.provider == 'ollama':
@@ -103,8 +163,7 @@ class LLMService:
                 return response.choices[0].message.content
                 
             elif self.provider == 'google':
-                model = self.client.GenerativeModel(self.model)
-                response = model.generate_content(prompt)
+                response = self.generative_model.generate_content(prompt)
                 return response.text
                 
             elif self.provider == 'huggingface':
@@ -128,6 +187,8 @@ class LLMService:
                             "'nebius', 'novita', 'openai', 'replicate', 'sambanova', 'together'."
                         )
                         logger.error(error_msg)
+                        if not fallback:
+                            raise RuntimeError(error_msg) from e
                         return error_msg
                     else:
                         raise
@@ -147,9 +208,233 @@ class LLMService:
 
         except Exception as e:
             logger.error(f"Error generating text with {self.provider}: {str(e)}")
+            if not fallback:
+                raise
             # Fallback to a simpler response if the LLM fails
             return f"I apologize, but I'm unable to generate a response at this time due to a technical issue: {str(e)}"
 
+    def _get_async_client(self):
+        """
+        Get the async client of the provider for the running event loop, creating it if necessary.
+
+        Returns:
+            The async client (for Google, the generative model, which has async methods).
+        """
+        if self.provider == 'google':
+            return self.generative_model
+
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                if self.provider == 'ollama':
+                    import ollama
+                    client = ollama.AsyncClient(host=self.config.get('api_base'))
+                elif self.provider == 'openai':
+                    from openai import AsyncOpenAI
+                    client = AsyncOpenAI(api_key=self.config.get('api_key'))
+                elif self.provider == 'huggingface':
+                    from huggingface_hub import AsyncInferenceClient
+                    client = AsyncInferenceClient(token=self.config.get('api_key'))
+                else:
+                    raise ValueError(f"Unsupported LLM provider: {self.provider}")
+                self._async_clients[loop] = client
+        return client
+
+    async def agenerate_text(self, prompt: str, max_tokens: int = 1000, stop_sequences: Optional[Sequence[str]] = None,
+                             max_chars: Optional[int] = None, fallback: bool = True) -> str:
+        """
+        Generate text asynchronously using the configured LLM provider.
+
+        Args:
+            prompt: The prompt to send to the LLM.
+            max_tokens: Maximum number of tokens to generate.
+            stop_sequences: If given, the response is streamed and ends right after the first of these strings.
+            max_chars: If given, the response is streamed and ends once it reaches this many characters.
+            fallback: If True, errors are logged and an apology text is returned instead of raising.
+
+        Returns:
+            The generated text response.
+        """
+        try:
+            if stop_sequences or max_chars:
+                return ''.join([chunk async for chunk in self.astream_text(prompt, max_tokens, stop_sequences, max_chars)])
+
+            logger.info(f"Generating text asynchronously with provider: {self.provider}, model: {self.model}")
+            client = self._get_async_client()
+
+            if self.provider == 'ollama':
+                response = await client.generate(
+                    model=self.model,
+                    prompt=prompt,
+                    options={"num_predict": max_tokens}
+                )
+                return response['response']
+
+            elif self.provider == 'openai':
+                response = await client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens
+                )
+                return response.choices[0].message.content
+
+            elif self.provider == 'google':
+                response = await client.generate_content_async(prompt)
+                return response.text
+
+            elif self.provider == 'huggingface':
+                return await client.text_generation(
+                    prompt,
+                    model=self.model,
+                    max_new_tokens=max_tokens
+                )
+
+        except Exception as e:
+            logger.error(f"Error generating text with {self.provider}: {str(e)}")
+            if not fallback:
+                raise
+            # Fallback to a simpler response if the LLM fails
+            return f"I apologize, but I'm unable to generate a response at this time due to a technical issue: {str(e)}"
+
+    def _open_stream(self, prompt: str, max_tokens: int):
+        """Start a streaming generation request and return (stream, function extracting the text of a chunk)."""
+        if self.provider == 'ollama':
+            stream = self.client.generate(
+                model=self.model,
+                prompt=prompt,
+                options={"num_predict": max_tokens},
+                stream=True
+            )
+            return stream, lambda chunk: chunk['response']
+
+        elif self.provider == 'openai':
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                stream=True
+            )
+            return stream, lambda chunk: chunk.choices[0].delta.content if chunk.choices else None
+
+        elif self.provider == 'google':
+            stream = self.generative_model.generate_content(prompt, stream=True)
+            return stream, lambda chunk: chunk.text
+
+        elif self.provider == 'huggingface':
+            stream = self.client.text_generation(
+                prompt,
+                model=self.model,
+                max_new_tokens=max_tokens,
+                stream=True
+            )
+            return stream, lambda chunk: chunk
+
+        raise ValueError(f"Unsupported LLM provider: {self.provider}")
+
+    def stream_text(self, prompt: str, max_tokens: int = 1000,
+                    stop_sequences: Optional[Sequence[str]] = None, max_chars: Optional[int] = None) -> Iterator[str]:
+        """
+        Stream generated text in chunks, cancelling the request early once a stop condition is met.
+
+        Args:
+            prompt: The prompt to send to the LLM.
+            max_tokens: Maximum number of tokens to generate.
+            stop_sequences: Strings that complete the response (e.g. a signature marker). The response
+                ends right after the first one found.
+            max_chars: Maximum number of characters of the response.
+
+        Yields:
+            Chunks of the generated text.
+        """
+        logger.info(f"Streaming text with provider: {self.provider}, model: {self.model}")
+        stream, chunk_text = self._open_stream(prompt, max_tokens)
+        cutter = _StreamCutter(stop_sequences, max_chars)
+        try:
+            for chunk in stream:
+                text, done = cutter.feed(chunk_text(chunk) or '')
+                if text:
+                    yield text
+                if done:
+                    logger.info(f"Stopped generation early after {cutter.length} characters")
+                    break
+        finally:
+            # Closing the stream cancels the request so the provider stops generating
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+
+    async def _aopen_stream(self, prompt: str, max_tokens: int):
+        """Start an async streaming generation request and return (stream, function extracting the text of a chunk)."""
+        client = self._get_async_client()
+
+        if self.provider == 'ollama':
+            stream = await client.generate(
+                model=self.model,
+                prompt=prompt,
+                options={"num_predict": max_tokens},
+                stream=True
+            )
+            return stream, lambda chunk: chunk['response']
+
+        elif self.provider == 'openai':
+            stream = await client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                stream=True
+            )
+            return stream, lambda chunk: chunk.choices[0].delta.content if chunk.choices else None
+
+        elif self.provider == 'google':
+            stream = await client.generate_content_async(prompt, stream=True)
+            return stream, lambda chunk: chunk.text
+
+        elif self.provider == 'huggingface':
+            stream = await client.text_generation(
+                prompt,
+                model=self.model,
+                max_new_tokens=max_tokens,
+                stream=True
+            )
+            return stream, lambda chunk: chunk
+
+        raise ValueError(f"Unsupported LLM provider: {self.provider}")
+
+    async def astream_text(self, prompt: str, max_tokens: int = 1000, stop_sequences: Optional[Sequence[str]] = None,
+                           max_chars: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Asynchronously stream generated text in chunks, cancelling the request early once a stop condition is met.
+
+        Args:
+            prompt: The prompt to send to the LLM.
+            max_tokens: Maximum number of tokens to generate.
+            stop_sequences: Strings that complete the response (e.g. a signature marker). The response
+                ends right after the first one found.
+            max_chars: Maximum number of characters of the response.
+
+        Yields:
+            Chunks of the generated text.
+        """
+        logger.info(f"Streaming text asynchronously with provider: {self.provider}, model: {self.model}")
+        stream, chunk_text = await self._aopen_stream(prompt, max_tokens)
+        cutter = _StreamCutter(stop_sequences, max_chars)
+        try:
+            async for chunk in stream:
+                text, done = cutter.feed(chunk_text(chunk) or '')
+                if text:
+                    yield text
+                if done:
+                    logger.info(f"Stopped generation early after {cutter.length} characters")
+                    break
+        finally:
+            # Closing the stream cancels the request so the provider stops generating
+            close = getattr(stream, 'aclose', None) or getattr(stream, 'close', None)
+            if close is not None:
+                result = close()
+                if asyncio.iscoroutine(result):
+                    await result
+
     def get_available_models(self) -> List[str]:
         """
         Get a list of available models for the current provider.
@@ -177,4 +462,28 @@ class LLMService:
 
         except Exception as e:
             logger.error(f"Error getting available models for {self.provider}: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+
+def get_llm_service(provider: Optional[str] = None, model: Optional[str] = None) -> LLMService:
+    """
+    Get a shared, initialized LLM service for the provider and model.
+
+    Services are created once per process and reused, so their clients keep
+    HTTP connections alive instead of being set up again for every request.
+
+    Args:
+        provider: The LLM provider to use. If None, uses the configured provider.
+        model: The model to use. If None, uses the configured model for the provider.
+
+    Returns:
+        The shared LLMService instance.
+    """
+    provider = provider or LLM_PROVIDER
+    model = model or LLM_CONFIG.get(provider, {}).get('model')
+
+    with _service_pool_lock:
+        service = _service_pool.get((provider, model))
+        if service is None:
+            service = LLMService(provider=provider, model=model)
+            _service_pool[(provider, model)] = service
+    return service
@@ -1,10 +1,8 @@
 import logging
 import argparse
+import signal
 import sys
-from apscheduler.schedulers.blocking import BlockingScheduler
-from .bot import authenticate_gmail, process_unread_emails
 from .config import POLLING_INTERVAL_MINUTES, LOG_LEVEL, LOG_FORMAT
-from . import app
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
@@ -12,21 +10,44 @@ logger = logging.getLogger(__name__)
 
 def job():
     """
-    Main job function that authenticates with Gmail and processes unread emails.
+    Main job function that processes unread emails with the long-lived Gmail service.
     This function is called periodically by the scheduler.
     """
+    from .bot import get_gmail_service, reset_gmail_service, process_unread_emails
+
     try:
         logger.info("Starting email processing job")
-        service = authenticate_gmail()
+        service = get_gmail_service()
         process_unread_emails(service)
         logger.info("Email processing job completed successfully")
     except Exception as e:
         logger.error(f"Error in email processing job: {e}")
+        # Authenticate from scratch on the next run
+        reset_gmail_service()
+
+def _raise_keyboard_interrupt(signum, frame):
+    """Signal handler that stops the process like Ctrl+C does."""
+    raise KeyboardInterrupt
+
+def run_process(once=False):
+    """
+    Run the email processing job once and then start the scheduler.
+
+    On Ctrl+C or SIGTERM, the running job stops listing new messages and finishes the ones in progress.
 
-def run_process():
-    """Run the email processing job once and then start the scheduler."""
+    Args:
+        once: If True, exit after the first job instead of starting the scheduler.
+    """
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    from .pipeline import request_shutdown
+
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    scheduler = None
     try:
         job()
+        if once:
+            return
+
         # Initialize scheduler
         scheduler = BlockingScheduler()
 
@@ -36,12 +57,21 @@ def run_process():
         logger.info(f"Starting scheduler with {POLLING_INTERVAL_MINUTES} minute interval")
         scheduler.start()
     except KeyboardInterrupt:
-        logger.info("Application stopped by user")
+        logger.info("Application stopped by user, finishing the messages in progress")
+        request_shutdown()
+        if scheduler is not None and scheduler.running:
+            scheduler.shutdown(wait=True)
     except Exception as e:
         logger.error(f"Error in scheduler: {e}")
 
+def run_accounts():
+    """Poll every account of the accounts directory, each in its own worker process."""
+    from .accounts import run_accounts as run_all_accounts
+    run_all_accounts()
+
 def run_auth():
     """Run the authentication server."""
+    from . import app
     app.run()
 
 def main():
@@ -49,13 +79,18 @@ def main():
     parser = argparse.ArgumentParser(description="Gmail AI Bot - Email automation with AI")
     parser.add_argument("--auth", action="store_true", help="Start the authentication server")
     parser.add_argument("--process", action="store_true", help="Start the email processing service")
+    parser.add_argument("--once", action="store_true", help="With --process, process the emails once and exit")
+    parser.add_argument("--accounts", action="store_true",
+                        help="Start the email processing service for every account in ACCOUNTS_DIR")
     
     args = parser.parse_args()
     
     if args.auth:
         run_auth()
     elif args.process:
-        run_process()
+        run_process(once=args.once)
+    elif args.accounts:
+        run_accounts()
     else:
         parser.print_help()
         sys.exit(1)
@@ -0,0 +1,149 @@
+import base64
+import codecs
+import logging
+import re
+from html.parser import HTMLParser
+
+from .config import MAX_BODY_BYTES, LOG_LEVEL, LOG_FORMAT
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+CHARSET_PATTERN = re.compile(r'charset\s*=\s*"?([^";\s]+)', re.IGNORECASE)
+
+# HTML elements whose content is never shown as text
+HIDDEN_HTML_TAGS = {'script', 'style', 'head', 'title', 'template', 'noscript'}
+
+# HTML elements that start a new line of text
+BLOCK_HTML_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'footer', 'form', 'h1', 'h2',
+    'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td',
+    'th', 'tr', 'ul',
+}
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self.hidden_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HIDDEN_HTML_TAGS:
+            self.hidden_depth += 1
+        elif tag in BLOCK_HTML_TAGS:
+            self.chunks.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_HTML_TAGS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in HIDDEN_HTML_TAGS:
+            self.hidden_depth = max(self.hidden_depth - 1, 0)
+        elif tag in BLOCK_HTML_TAGS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self.hidden_depth:
+            self.chunks.append(data)
+
+def html_to_text(html):
+    """
+    Convert HTML to plain text, dropping tags, scripts and styles.
+
+    Args:
+        html: The HTML document.
+
+    Returns:
+        The visible text, one line per block element.
+    """
+    parser = _HTMLTextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        logger.warning(f"Error parsing HTML body: {e}")
+    lines = (' '.join(line.split()) for line in ''.join(parser.chunks).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+def _header(part, name):
+    """Return the value of a part header (case-insensitive), or an empty string if it is missing."""
+    for header in part.get('headers', []):
+        if header['name'].lower() == name:
+            return header['value']
+    return ''
+
+def _is_attachment(part):
+    """Whether a part is an attachment rather than part of the message text."""
+    if part.get('filename') or part.get('body', {}).get('attachmentId'):
+        return True
+    return _header(part, 'content-disposition').lower().startswith('attachment')
+
+def _decode_part(part, max_bytes):
+    """
+    Decode at most max_bytes of a part's body into text, honouring its charset.
+
+    Only the base64 needed for the budget is decoded, so huge parts cost no more than the budget.
+    Returns a tuple of (text, number of bytes decoded).
+    """
+    data = part.get('body', {}).get('data', '')
+    if not data:
+        return '', 0
+
+    # Every 4 base64 characters hold 3 bytes
+    encoded_budget = -(-max_bytes // 3) * 4
+    truncated = len(data) > encoded_budget
+    data = data[:encoded_budget]
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    truncated = truncated or len(raw) > max_bytes
+    raw = raw[:max_bytes]
+
+    match = CHARSET_PATTERN.search(_header(part, 'content-type'))
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        logger.warning(f"Unknown charset {charset}, decoding as UTF-8")
+        charset = 'utf-8'
+    # Drop a character cut in half by the budget instead of decoding it as garbage
+    decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    return decoder.decode(raw, final=not truncated), len(raw)
+
+def extract_body(payload, max_bytes=MAX_BODY_BYTES):
+    """
+    Extract the text body of a Gmail message payload.
+
+    Walks the MIME tree iteratively in document order, collecting the text/plain parts;
+    the text/html parts, stripped to text, are only used when there is no plain text.
+    Attachments are skipped without being decoded, and decoding stops once max_bytes
+    of each kind have been read.
+
+    Args:
+        payload: The payload of a Gmail message resource (format=full).
+        max_bytes: Maximum number of body bytes decoded.
+
+    Returns:
+        The body text, or an empty string if the message has none.
+    """
+    texts = {'text/plain': [], 'text/html': []}
+    remaining = {'text/plain': max_bytes, 'text/html': max_bytes}
+
+    stack = [payload]
+    while stack and remaining['text/plain'] > 0:
+        part = stack.pop()
+        mime_type = part.get('mimeType', 'text/plain').lower()
+
+        if mime_type.startswith('multipart/'):
+            # Reversed, so the parts come off the stack in document order
+            stack.extend(reversed(part.get('parts', [])))
+        elif mime_type in texts and remaining[mime_type] > 0 and not _is_attachment(part):
+            text, size = _decode_part(part, remaining[mime_type])
+            remaining[mime_type] -= size
+            texts[mime_type].append(text)
+
+    if any(texts['text/plain']):
+        return '\n'.join(texts['text/plain'])
+    return html_to_text('\n'.join(texts['text/html']))
@@ -0,0 +1,205 @@
+import argparse
+import contextlib
+import csv
+import logging
+import os
+import re
+
+from .config import CATEGORIZATION_MODEL, ONNX_CACHE_DIR, TRAINING_DATA_DIR, LOG_LEVEL, LOG_FORMAT
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+# File name of the int8-quantized model inside the per-model cache directory
+QUANTIZED_MODEL_FILE = 'model.int8.onnx'
+
+def get_model_cache_dir(model_name, cache_dir=ONNX_CACHE_DIR):
+    """
+    Get the directory where the exported ONNX files of a model are cached.
+
+    Args:
+        model_name: The HuggingFace model name.
+        cache_dir: Root directory of the ONNX cache.
+
+    Returns:
+        The cache directory path for the model.
+    """
+    return os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+
+def export_quantized_model(model_name, cache_dir=ONNX_CACHE_DIR):
+    """
+    Export a sequence classification model to ONNX with dynamic int8 quantization.
+
+    The quantized model is cached on disk, so the export only runs once per model.
+
+    Args:
+        model_name: The HuggingFace model name.
+        cache_dir: Root directory of the ONNX cache.
+
+    Returns:
+        The path of the quantized ONNX model.
+    """
+    model_dir = get_model_cache_dir(model_name, cache_dir)
+    quantized_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+    if os.path.exists(quantized_path):
+        return quantized_path
+
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    logger.info(f"Exporting categorization model {model_name} to ONNX in {model_dir}")
+    os.makedirs(model_dir, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+
+    sample = dict(tokenizer(["Subject: export sample\n\nBody: export sample"], return_tensors='pt'))
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in sample}
+    dynamic_axes['logits'] = {0: 'batch'}
+
+    # Export and quantize under temporary names so concurrent workers never load a partial file
+    suffix = f".{os.getpid()}.tmp"
+    float_path = os.path.join(model_dir, 'model.onnx' + suffix)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample,),
+                float_path,
+                input_names=list(sample),
+                output_names=['logits'],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+                dynamo=False
+            )
+        quantize_dynamic(float_path, quantized_path + suffix, weight_type=QuantType.QInt8)
+        os.replace(quantized_path + suffix, quantized_path)
+    finally:
+        for path in (float_path, quantized_path + suffix):
+            if os.path.exists(path):
+                os.remove(path)
+
+    logger.info(f"Saved quantized ONNX model to {quantized_path}")
+    return quantized_path
+
+class OnnxTextClassifier:
+    """
+    A text classifier served by ONNX Runtime on CPU.
+    Can be called like a transformers text-classification pipeline with top_k=None.
+    """
+
+    def __init__(self, model_name=CATEGORIZATION_MODEL, cache_dir=ONNX_CACHE_DIR):
+        """
+        Load (exporting first if needed) the quantized ONNX model and its tokenizer.
+
+        Args:
+            model_name: The HuggingFace model name.
+            cache_dir: Root directory of the ONNX cache.
+        """
+        import onnxruntime as ort
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.model_name = model_name
+        self.model_path = export_quantized_model(model_name, cache_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        config = AutoConfig.from_pretrained(model_name)
+        self.id2label = config.id2label
+        # Same score function the transformers pipeline picks for the model
+        self.use_sigmoid = config.problem_type == 'multi_label_classification' or config.num_labels == 1
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+        logger.info(f"Loaded ONNX categorization model from {self.model_path}")
+
+    def _scores(self, logits):
+        """Convert a batch of logits to label scores."""
+        import numpy as np
+
+        if self.use_sigmoid:
+            return 1.0 / (1.0 + np.exp(-logits))
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def __call__(self, texts, batch_size=1):
+        """
+        Classify one or more texts.
+
+        Args:
+            texts: A text or a list of texts.
+            batch_size: Number of texts per inference run.
+
+        Returns:
+            For a list input, one list of label/score dicts per text, sorted by score.
+            For a single text, the list of label/score dicts of that text.
+        """
+        import numpy as np
+
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+
+        results = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + batch_size], padding=True, truncation=True, return_tensors='np'
+            )
+            inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            logits = self.session.run(None, inputs)[0]
+
+            for row in self._scores(logits):
+                predictions = [{'label': self.id2label[i], 'score': float(score)} for i, score in enumerate(row)]
+                results.append(sorted(predictions, key=lambda prediction: prediction['score'], reverse=True))
+
+        return results[0] if single else results
+
+def load_training_samples(path=TRAINING_DATA_DIR, limit=200):
+    """
+    Load (subject, body) samples from the training data.
+
+    Args:
+        path: The training data shard directory, or a legacy training data CSV file.
+        limit: Maximum number of samples to load.
+
+    Returns:
+        List of (subject, body) tuples.
+    """
+    from .training_data import iter_training_data
+
+    samples = []
+    with contextlib.ExitStack() as stack:
+        if path.endswith('.csv'):
+            rows = csv.DictReader(stack.enter_context(open(path, newline='', encoding='utf-8')))
+        else:
+            rows = iter_training_data(path)
+        for row in rows:
+            samples.append((row['subject'], row['body']))
+            if len(samples) >= limit:
+                break
+    return samples
+
+def main():
+    """Command-line entry point that checks category agreement between the PyTorch and ONNX backends."""
+    from .categorizer import check_backend_parity
+
+    parser = argparse.ArgumentParser(description="Compare PyTorch and ONNX categorization results")
+    parser.add_argument("--data", default=TRAINING_DATA_DIR, help="Training data directory (or legacy CSV file)")
+    parser.add_argument("--limit", type=int, default=200, help="Maximum number of samples to compare")
+    parser.add_argument("--min-agreement", type=float, default=0.98, help="Lowest acceptable agreement ratio")
+    args = parser.parse_args()
+
+    report = check_backend_parity(load_training_samples(args.data, args.limit))
+    print(f"Category agreement: {report['agreement']:.2%} ({report['total'] - len(report['mismatches'])}/{report['total']})")
+    for mismatch in report['mismatches']:
+        print(f"  {mismatch['subject'][:60]!r}: pytorch={mismatch['pytorch']} onnx={mismatch['onnx']}")
+
+    raise SystemExit(0 if report['agreement'] >= args.min_agreement else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+import logging
+import queue
+import threading
+import time
+import weakref
+
+from .config import PIPELINE_IO_WORKERS, PIPELINE_QUEUE_SIZE, LOG_LEVEL, LOG_FORMAT
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+# Put on a stage's input queue once per worker after the last page
+_DONE = object()
+
+# Seconds between checks for a shutdown request while waiting on a full queue
+SUBMIT_POLL_SECONDS = 0.5
+
+# Pipelines currently running, stopped by request_shutdown
+_running_pipelines = weakref.WeakSet()
+_running_pipelines_lock = threading.Lock()
+
+class Pipeline:
+    """
+    Processes pages of messages in three concurrent stages connected by bounded queues:
+
+    - fetch: io_workers threads download and parse the pages, each with its own Gmail service;
+    - categorize: one inference worker runs the classifier, so the model is never called concurrently;
+    - respond: one worker stores the pages and saves the drafts (LLM calls run concurrently within a page).
+
+    While the classifier works on one page, the next pages are downloaded and the previous page is
+    answered. A full queue blocks the stage feeding it, so a slow stage holds back the listing instead
+    of letting pages pile up in memory. After stop(), new pages are refused but the pages already
+    submitted still go through every stage, so none is left half processed.
+    """
+
+    def __init__(self, fetch, categorize, respond, service_factory, io_workers=PIPELINE_IO_WORKERS,
+                 queue_size=PIPELINE_QUEUE_SIZE, on_error=None, service_release=None):
+        """
+        Initialize the pipeline and start its workers.
+
+        Args:
+            fetch: Function of (service, message_ids) returning a page.
+            categorize: Function of (page) returning the categorized page.
+            respond: Function of (service, page) storing and answering the page.
+            service_factory: Function returning the Gmail service of the calling thread.
+            io_workers: Number of fetch threads.
+            queue_size: Number of pages each queue holds before the stage feeding it blocks.
+            on_error: Optional function of (stage, item) called with each item a stage failed on.
+            service_release: Optional function of (service) called when a worker is done with its
+                Gmail service, e.g. to return it to a pool for the workers of the next pipeline.
+        """
+        self._fetch = fetch
+        self._categorize = categorize
+        self._respond = respond
+        self._service_factory = service_factory
+        self._service_release = service_release
+        self._on_error = on_error
+        self._fetch_queue = queue.Queue(queue_size)
+        self._categorize_queue = queue.Queue(queue_size)
+        self._respond_queue = queue.Queue(queue_size)
+        self._stopping = threading.Event()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.stats = {stage: {'pages': 0, 'errors': 0, 'seconds': 0.0} for stage in ('fetch', 'categorize', 'respond')}
+
+        self._fetch_workers = [
+            threading.Thread(target=self._fetch_worker, name=f"pipeline-fetch-{i}", daemon=True)
+            for i in range(max(io_workers, 1))
+        ]
+        self._categorize_worker = threading.Thread(target=self._categorize_worker_main, name="pipeline-categorize",
+                                                   daemon=True)
+        self._respond_worker = threading.Thread(target=self._respond_worker_main, name="pipeline-respond",
+                                                daemon=True)
+        self._stages = [
+            (self._fetch_workers, self._fetch_queue),
+            ([self._categorize_worker], self._categorize_queue),
+            ([self._respond_worker], self._respond_queue),
+        ]
+        self._ended_stages = 0
+        for workers, _ in self._stages:
+            for worker in workers:
+                worker.start()
+
+        with _running_pipelines_lock:
+            _running_pipelines.add(self)
+        logger.info(f"Started pipeline with {len(self._fetch_workers)} fetch workers")
+
+    def _run_stage(self, stage, source, handle, sink):
+        """Handle the pages of a queue until its end marker, passing the results on to the sink queue."""
+        while True:
+            page = source.get()
+            if page is _DONE:
+                return
+
+            start = time.perf_counter()
+            try:
+                result = handle(page)
+                errors = 0
+            except Exception as e:
+                logger.error(f"Error in pipeline stage {stage}: {e}")
+                result, errors = None, 1
+                if self._on_error is not None:
+                    try:
+                        self._on_error(stage, page)
+                    except Exception as callback_error:
+                        logger.error(f"Error reporting failure of pipeline stage {stage}: {callback_error}")
+
+            with self._stats_lock:
+                self.stats[stage]['pages'] += 1
+                self.stats[stage]['errors'] += errors
+                self.stats[stage]['seconds'] += time.perf_counter() - start
+
+            if sink is not None and result is not None:
+                sink.put(result)
+
+    def _worker_service(self):
+        """Build the Gmail service of a worker thread, or None if it can't be built."""
+        try:
+            return self._service_factory()
+        except Exception as e:
+            logger.error(f"Error building Gmail service for pipeline worker: {e}")
+            return None
+
+    def _release_service(self, service):
+        """Hand the Gmail service of a finished worker back to service_release."""
+        if service is None or self._service_release is None:
+            return
+        try:
+            self._service_release(service)
+        except Exception as e:
+            logger.error(f"Error releasing Gmail service of pipeline worker: {e}")
+
+    @staticmethod
+    def _with_service(service, handle):
+        """Bind a stage function to a worker's service, failing every item if there is none."""
+        def handle_with_service(item):
+            if service is None:
+                raise RuntimeError("No Gmail service for this pipeline worker")
+            return handle(service, item)
+        return handle_with_service
+
+    def _fetch_worker(self):
+        service = self._worker_service()
+        try:
+            self._run_stage('fetch', self._fetch_queue, self._with_service(service, self._fetch),
+                            self._categorize_queue)
+        finally:
+            self._release_service(service)
+
+    def _categorize_worker_main(self):
+        self._run_stage('categorize', self._categorize_queue, self._categorize, self._respond_queue)
+
+    def _respond_worker_main(self):
+        service = self._worker_service()
+        try:
+            self._run_stage('respond', self._respond_queue, self._with_service(service, self._respond), None)
+        finally:
+            self._release_service(service)
+
+    def submit(self, message_ids):
+        """
+        Queue a page of message IDs, blocking while the fetch queue is full.
+
+        Args:
+            message_ids: IDs of the messages of the page.
+
+        Returns:
+            True if the page was queued, False if the pipeline is stopping or closed.
+        """
+        while not self._stopping.is_set() and not self._closed:
+            try:
+                self._fetch_queue.put(list(message_ids), timeout=SUBMIT_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def stop(self):
+        """Refuse new pages; the pages already submitted are still processed."""
+        if not self._stopping.is_set():
+            logger.info("Pipeline is stopping, finishing the pages in progress")
+        self._stopping.set()
+
+    def _finish(self):
+        """End the stages in order, so each one finishes its input before the next is told to stop."""
+        for index, (workers, source) in enumerate(self._stages):
+            if index >= self._ended_stages:
+                for _ in workers:
+                    source.put(_DONE)
+                self._ended_stages = index + 1
+            for worker in workers:
+                worker.join()
+
+    def close(self):
+        """
+        Wait until every submitted page has been through all stages and stop the workers.
+
+        An interrupt while waiting stops the pipeline and keeps waiting for the pages in
+        progress; a second interrupt gives up on them.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        try:
+            self._finish()
+        except KeyboardInterrupt:
+            self.stop()
+            self._finish()
+            raise
+        finally:
+            with _running_pipelines_lock:
+                _running_pipelines.discard(self)
+
+        logger.info("Pipeline finished: " + ", ".join(
+            f"{stage} {stats['pages']} pages in {stats['seconds']:.1f}s ({stats['errors']} errors)"
+            for stage, stats in self.stats.items()
+        ))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.stop()
+        self.close()
+
+def request_shutdown():
+    """
+    Stop every running pipeline from taking new pages, letting the pages in progress finish.
+
+    Returns:
+        The number of pipelines stopped.
+    """
+    with _running_pipelines_lock:
+        pipelines = list(_running_pipelines)
+    for pipeline in pipelines:
+        pipeline.stop()
+    return len(pipelines)
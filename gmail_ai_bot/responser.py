@@ -1,69 +1,180 @@
+import asyncio
 import logging
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import base64
 
-from .llm_service import LLMService
-from .config import USER_INFO, LOG_LEVEL, LOG_FORMAT
-from .connector import update_draft_status, check_draft_created
+from .cache import content_hash, normalize_whitespace
+from .llm_service import get_llm_service
+from .mime import extract_body
+from .config import (
+    USER_INFO, RESPONSE_CATEGORIES, LLM_PROVIDERS, LLM_MAX_CONCURRENCY, THREAD_CONTEXT_MESSAGES, LLM_STOP_SEQUENCES, LLM_MAX_RESPONSE_CHARS, RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_TTL_HOURS, RESPONSE_CACHE_MAX_ENTRIES, LOG_LEVEL, LOG_FORMAT
+)
+from .connector import (
+    update_draft_status_many, check_draft_created, get_drafted_message_ids, get_thread_draft, save_thread_draft,
+    get_cached_response, save_cached_response
+)
 
 # Set up logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
-def generate_response(prompt, max_tokens=1000):
+# Maximum number of words of each earlier thread message included in a draft prompt
+THREAD_CONTEXT_MAX_WORDS = 200
+
+# Partial response mask of the thread fetched for a draft's conversation history
+THREAD_CONTEXT_FIELDS = 'messages(id,labelIds,payload)'
+
+# Options of the draft generation calls: stop as soon as the reply is complete, and raise on
+# errors instead of returning an apology text
+GENERATION_OPTIONS = dict(stop_sequences=LLM_STOP_SEQUENCES, max_chars=LLM_MAX_RESPONSE_CHARS, fallback=False)
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop():
+    """
+    Get the process-wide event loop the concurrent drafts run on, starting its thread on first use.
+
+    The async LLM clients are cached per event loop, so running every page on this one loop keeps
+    their HTTP connections open between pages instead of building a new client for each page.
+
+    Returns:
+        The running asyncio event loop.
+    """
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name="responser-event-loop", daemon=True).start()
+    return _event_loop
+
+def _prompt_hash(prompt, max_tokens):
+    """Hash the normalized prompt together with the generation settings that shape the response."""
+    return content_hash(prompt, str(max_tokens), '|'.join(LLM_STOP_SEQUENCES), str(LLM_MAX_RESPONSE_CHARS),
+                        normalize=normalize_whitespace)
+
+def get_text_generator():
+    """
+    Get the shared text generator for drafts.
+
+    Returns:
+        The LLM router when several providers are configured, otherwise the shared LLM service.
+    """
+    if len(LLM_PROVIDERS) > 1:
+        from .llm_router import get_llm_router
+        return get_llm_router()
+    return get_llm_service()
+
+def _lookup_response(prompt, max_tokens, use_cache):
+    """
+    Get the text generator for a prompt and look the prompt up in the response cache.
+
+    Args:
+        prompt: The prompt to send to the LLM.
+        max_tokens: Maximum number of tokens to generate.
+        use_cache: If False, bypass the response cache.
+
+    Returns:
+        A (text generator, cache key, cached response) tuple. The cache key is None when the
+        cache is bypassed, the cached response is None when there is none.
+    """
+    # Reuse the shared LLM service (or router) of the configured providers
+    llm_service = get_text_generator()
+    if not (use_cache and RESPONSE_CACHE_ENABLED):
+        return llm_service, None, None
+
+    prompt_hash = _prompt_hash(prompt, max_tokens)
+    cached = get_cached_response(prompt_hash, llm_service.provider, llm_service.model, RESPONSE_CACHE_TTL_HOURS)
+    if cached is not None:
+        logger.info("Using cached response")
+    return llm_service, prompt_hash, cached
+
+def _store_response(prompt_hash, llm_service, response):
+    """Store a response under its key from _lookup_response; error texts and empty responses are never cached."""
+    if prompt_hash is not None and isinstance(response, str) and response.strip():
+        save_cached_response(prompt_hash, llm_service.provider, llm_service.model, response, RESPONSE_CACHE_MAX_ENTRIES)
+
+def generate_response(prompt, max_tokens=1000, use_cache=True):
     """
     Generate a response using the configured LLM provider.
 
+    Only successful generations are cached: the provider is called with fallback=False, so errors
+    raise instead of returning an apology text, and None or empty responses are not stored.
+
     Args:
         prompt: The prompt to send to the LLM.
         max_tokens: Maximum number of tokens to generate.
+        use_cache: If False, bypass the response cache for this call.
 
     Returns:
-        The generated text response.
+        The generated text response, or None if it could not be generated.
     """
     try:
-        # Initialize the LLM service with the configured provider
-        llm_service = LLMService()
+        llm_service, prompt_hash, cached = _lookup_response(prompt, max_tokens, use_cache)
+        if cached is not None:
+            return cached
+        response = llm_service.generate_text(prompt, max_tokens, **GENERATION_OPTIONS)
+        _store_response(prompt_hash, llm_service, response)
+        return response
+    except Exception as e:
+        logger.error(f"Error generating response: {e}")
+        return None
 
-        # Generate the response
-        return llm_service.generate_text(prompt, max_tokens)
+async def agenerate_response(prompt, max_tokens=1000, use_cache=True):
+    """Generate a response asynchronously; see generate_response."""
+    try:
+        llm_service, prompt_hash, cached = _lookup_response(prompt, max_tokens, use_cache)
+        if cached is not None:
+            return cached
+        response = await llm_service.agenerate_text(prompt, max_tokens, **GENERATION_OPTIONS)
+        _store_response(prompt_hash, llm_service, response)
+        return response
     except Exception as e:
         logger.error(f"Error generating response: {e}")
-        # Return a fallback response
-        return f"I apologize, but I'm unable to generate a response at this time due to a technical issue."
+        return None
 
 def truncate_text(text, max_tokens=2000):
     """
     Truncate the text to fit within the model's maximum token limit.
+
+    The LLM providers don't expose their tokenizers, so max_tokens is applied to
+    whitespace-separated words, a rough upper bound on the prompt size.
     """
     words = text.split()
     return " ".join(words[:max_tokens])
 
-def auto_respond(service, subject, body, category, message_id, sender_email):
+def build_response_prompt(subject, body, context=None):
     """
-    Prepare an auto-response using the configured LLM and save it in drafts.
+    Build the LLM prompt for an auto-response to an email.
 
     Args:
-        service: The Gmail API service object.
         subject: The email subject.
         body: The email body.
-        category: The category of the email.
-        message_id: The Gmail message ID.
-        sender_email: The email address of the sender.
-    """
-    logger.info(f"Processing email with category: {category}")
+        context: Optional list of earlier messages of the thread (dicts with sender_email and body), oldest first.
 
-    # Check if we've already created a draft for this message
-    if check_draft_created(message_id):
-        logger.info(f"Draft already created for message {message_id}, skipping")
-        return
+    Returns:
+        The prompt, truncated to fit the LLM.
+    """
+    thread_context = ""
+    if context:
+        earlier_messages = "\n".join(
+            f"        From {message['sender_email']}: {truncate_text(message['body'], max_tokens=THREAD_CONTEXT_MAX_WORDS)}"
+            for message in context[-THREAD_CONTEXT_MESSAGES:]
+        )
+        thread_context = f"""
+        Earlier messages in this thread, oldest first:
+{earlier_messages}
+        Answer the thread as a whole, replying to the latest email above.
+"""
 
-    if category in ["urgent response", "very important", "important"]:
-        # Combine subject and body
-        prompt = f"""You are a professional assistant. Generate a polite and professional email response based on the following email:
+    # Combine subject and body
+    prompt = f"""You are a professional assistant. Generate a polite and professional email response based on the following email:
         Subject: {subject}
         Body: {body}
+{thread_context}
         your Name: "{USER_INFO['name']}"
         your Position: "{USER_INFO['position']}"
         your Contact: "{USER_INFO['contact']}"
@@ -72,40 +183,287 @@ def auto_respond(service, subject, body, category, message_id, sender_email):
         take the Recipient's Name from the context
         """
 
-        # Truncate the prompt if necessary
-        truncated_prompt = truncate_text(prompt, max_tokens=2000)
+    # Truncate the prompt if necessary
+    return truncate_text(prompt, max_tokens=2000)
 
-        # Generate response using configured LLM
-        auto_response_body = generate_response(truncated_prompt)
+def _is_unedited_draft(service, draft_id, draft_message_id):
+    """
+    Check whether a draft saved by the bot is still as the bot left it.
 
-        logger.info(f"Generated response for email with subject: {subject}")
+    Args:
+        service: The Gmail API service object.
+        draft_id: The ID of the draft.
+        draft_message_id: The message ID of the draft when the bot saved it.
+
+    Returns:
+        True if the draft still has that message, False if the user has edited, sent or deleted it
+        or if it can't be told.
+    """
+    if not draft_message_id:
+        return False
+    try:
+        draft = service.users().drafts().get(userId="me", id=draft_id, format="minimal").execute()
+    except Exception as e:
+        logger.info(f"Could not read draft {draft_id}, it may have been sent or deleted: {e}")
+        return False
+    return draft.get('message', {}).get('id') == draft_message_id
+
+def create_draft(service, subject, response_body, message_id, sender_email, thread_id=None, in_reply_to=None,
+                 answered_message_ids=None):
+    """
+    Save an auto-response as a Gmail draft and record it in the database.
 
-        try:
-            # Create the draft and save in Gmail
-            message = MIMEMultipart()
-            message["to"] = sender_email
-            message["subject"] = f"Re: {subject}"
-            message.attach(MIMEText(auto_response_body, "plain"))
+    When the thread already has a draft from an earlier run, that draft is updated
+    instead of adding another one, unless the user has changed it since: their
+    edits are kept and a new draft is added.
 
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode("utf-8")
-            draft = {"message": {"raw": raw_message}}
+    Args:
+        service: The Gmail API service object.
+        subject: The subject of the email being answered.
+        response_body: The generated response text.
+        message_id: The Gmail message ID of the email being answered.
+        sender_email: The email address of the sender.
+        thread_id: The Gmail thread ID, so the draft is saved as a reply in the thread.
+        in_reply_to: The Message-ID header of the email being answered.
+        answered_message_ids: IDs of all messages the draft answers. If None, only message_id.
+    """
+    try:
+        # Create the draft and save in Gmail
+        message = MIMEMultipart()
+        message["to"] = sender_email
+        message["subject"] = subject if subject.lower().startswith("re:") else f"Re: {subject}"
+        if in_reply_to:
+            message["In-Reply-To"] = in_reply_to
+            message["References"] = in_reply_to
+        message.attach(MIMEText(response_body, "plain"))
+
+        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode("utf-8")
+        draft = {"message": {"raw": raw_message}}
+        if thread_id:
+            draft["message"]["threadId"] = thread_id
+
+        draft_response = None
+        thread_draft = get_thread_draft(thread_id) if thread_id else None
+        if thread_draft and not _is_unedited_draft(service, thread_draft[0], thread_draft[2]):
+            logger.info(f"Draft {thread_draft[0]} of thread {thread_id} was changed since it was saved, keeping it")
+        elif thread_draft:
+            try:
+                draft_response = service.users().drafts().update(
+                    userId="me", id=thread_draft[0], body=dict(draft, id=thread_draft[0])
+                ).execute()
+                logger.info(f"Draft updated with ID: {draft_response.get('id')}")
+            except Exception as e:
+                # The user may have sent or deleted the previous draft
+                logger.warning(f"Could not update draft {thread_draft[0]} of thread {thread_id}: {e}")
+
+        if draft_response is None:
             draft_response = service.users().drafts().create(userId="me", body=draft).execute()
             logger.info(f"Draft created with ID: {draft_response.get('id')}")
-            
-            # Update the database to mark that we've created a draft
-            update_draft_status(message_id)
-        except Exception as e:
-            logger.error(f"Error creating draft: {e}")
+
+        # Update the database to mark that we've created a draft
+        if thread_id:
+            draft_message_id = draft_response.get('message', {}).get('id')
+            save_thread_draft(thread_id, draft_response.get('id'), message_id, draft_message_id)
+        update_draft_status_many(answered_message_ids or [message_id])
+    except Exception as e:
+        logger.error(f"Error creating draft: {e}")
+
+def mark_as_read(service, message_id, label_batcher=None):
+    """
+    Remove the UNREAD label from a message.
+
+    Args:
+        service: The Gmail API service object.
+        message_id: The Gmail message ID.
+        label_batcher: Optional LabelBatcher that queues the change for a single batchModify call
+            instead of modifying the message right away.
+    """
+    if label_batcher is not None:
+        label_batcher.mark_as_read(message_id)
+        return
+
+    try:
+        service.users().messages().modify(
+            userId='me',
+            id=message_id,
+            body={'removeLabelIds': ['UNREAD']}
+        ).execute()
+        logger.info(f"Email marked as read: {message_id}")
+    except Exception as e:
+        logger.error(f"Error marking email as read: {e}")
+
+def auto_respond(service, subject, body, category, message_id, sender_email, thread_id=None, in_reply_to=None):
+    """
+    Prepare an auto-response using the configured LLM and save it in drafts.
+
+    Args:
+        service: The Gmail API service object.
+        subject: The email subject.
+        body: The email body.
+        category: The category of the email.
+        message_id: The Gmail message ID.
+        sender_email: The email address of the sender.
+        thread_id: The Gmail thread ID, so the thread's existing draft gets updated.
+        in_reply_to: The Message-ID header of the email.
+    """
+    logger.info(f"Processing email with category: {category}")
+
+    # Check if we've already created a draft for this message
+    if check_draft_created(message_id):
+        logger.info(f"Draft already created for message {message_id}, skipping")
+        return
+
+    if category in RESPONSE_CATEGORIES:
+        # Generate response using configured LLM
+        auto_response_body = generate_response(build_response_prompt(subject, body))
+        if auto_response_body is None:
+            logger.warning(f"No response generated for email with subject: {subject}, no draft saved")
+            return
+
+        logger.info(f"Generated response for email with subject: {subject}")
+
+        create_draft(service, subject, auto_response_body, message_id, sender_email, thread_id, in_reply_to)
 
     else:
         logger.info(f"Email category '{category}' does not require an auto-response.")
-        try:
+        # Mark email as read
+        mark_as_read(service, message_id)
+
+def get_thread_context(service, thread_id, message_id, max_messages=THREAD_CONTEXT_MESSAGES):
+    """
+    Fetch the conversation history of a thread up to one of its messages.
+
+    Earlier messages are included whether they are read or not, as are the user's own
+    replies; drafts are left out.
+
+    Args:
+        service: The Gmail API service object.
+        thread_id: The Gmail thread ID.
+        message_id: The Gmail message ID of the email being answered.
+        max_messages: Maximum number of earlier messages returned.
+
+    Returns:
+        The earlier messages as dicts with message_id, sender_email and body, oldest first,
+        or None if the thread could not be fetched.
+    """
+    try:
+        thread = service.users().threads().get(
+            userId='me', id=thread_id, format='full', fields=THREAD_CONTEXT_FIELDS
+        ).execute()
+    except Exception as e:
+        logger.warning(f"Could not fetch thread {thread_id} for context: {e}")
+        return None
+
+    context = []
+    for message in thread.get('messages', []):
+        if message['id'] == message_id:
+            break
+        if 'DRAFT' in message.get('labelIds', []):
+            continue
+        payload = message.get('payload', {})
+        sender = next(
+            (header['value'] for header in payload.get('headers', []) if header['name'].lower() == 'from'), ''
+        )
+        context.append({'message_id': message['id'], 'sender_email': sender, 'body': extract_body(payload)})
+    return context[-max_messages:] if max_messages else []
+
+def coalesce_threads(emails):
+    """
+    Group emails by their Gmail thread.
+
+    Args:
+        emails: List of email dicts with message_id and optionally thread_id and internal_date.
+
+    Returns:
+        A dict mapping each thread ID to its emails, oldest first.
+    """
+    threads = {}
+    for email in emails:
+        threads.setdefault(email.get('thread_id') or email['message_id'], []).append(email)
+    for thread in threads.values():
+        thread.sort(key=lambda email: email.get('internal_date', 0))
+    return threads
+
+async def _respond_concurrently(service, emails, max_concurrency):
+    """Generate responses for the emails concurrently and save each draft as soon as it is ready."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def generate(email):
+        async with semaphore:
+            response_body = await agenerate_response(
+                build_response_prompt(email['subject'], email['body'], email.get('context'))
+            )
+            return email, response_body
+
+    for completed in asyncio.as_completed([generate(email) for email in emails]):
+        email, response_body = await completed
+        if response_body is None:
+            logger.warning(f"No response generated for email with subject: {email['subject']}, no draft saved")
+            continue
+
+        logger.info(f"Generated response for email with subject: {email['subject']}")
+        answered_message_ids = email.get('answered_message_ids') or [email['message_id']]
+        # Draft requests run one at a time, the Gmail service object isn't thread-safe
+        await asyncio.to_thread(
+            create_draft, service, email['subject'], response_body, email['message_id'], email['sender_email'],
+            email.get('thread_id'), email.get('rfc_message_id'), answered_message_ids
+        )
+
+def auto_respond_many(service, emails, max_concurrency=LLM_MAX_CONCURRENCY, label_batcher=None):
+    """
+    Prepare auto-responses for several emails, generating the drafts concurrently.
+
+    Emails are coalesced by thread: a thread gets a single draft answering its latest
+    message that needs a response, with the thread's conversation history (fetched from
+    Gmail, including messages already read) as context.
+
+    Args:
+        service: The Gmail API service object.
+        emails: List of dicts with the auto_respond arguments (subject, body, category,
+            message_id and sender_email), and optionally thread_id, internal_date and rfc_message_id.
+        max_concurrency: Maximum number of LLM generations running at once.
+        label_batcher: Optional LabelBatcher collecting the mark-as-read changes, flushed by the caller.
+    """
+    # Look up which messages already have a draft with a single query
+    drafted_message_ids = get_drafted_message_ids([email['message_id'] for email in emails])
+
+    pending = []
+    for email in emails:
+        logger.info(f"Processing email with category: {email['category']}")
+
+        # Check if we've already created a draft for this message
+        if email['message_id'] in drafted_message_ids:
+            logger.info(f"Draft already created for message {email['message_id']}, skipping")
+            continue
+
+        pending.append(email)
+        if email['category'] not in RESPONSE_CATEGORIES:
+            logger.info(f"Email category '{email['category']}' does not require an auto-response.")
             # Mark email as read
-            service.users().messages().modify(
-                userId='me', 
-                id=message_id, 
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute()
-            logger.info(f"Email marked as read: {message_id}")
-        except Exception as e:
-            logger.error(f"Error marking email as read: {e}")
\ No newline at end of file
+            mark_as_read(service, email['message_id'], label_batcher)
+
+    to_answer = []
+    for thread_id, thread in coalesce_threads(pending).items():
+        needs_response = [email for email in thread if email['category'] in RESPONSE_CATEGORIES]
+        if not needs_response:
+            continue
+        if len(needs_response) > 1:
+            logger.info(f"Coalesced {len(needs_response)} messages of thread {thread_id} into one draft")
+
+        # Answer the latest message that needs a response, not a later notification or bulk reply
+        target = needs_response[-1]
+        context = None
+        if target.get('thread_id'):
+            context = get_thread_context(service, target['thread_id'], target['message_id'])
+        if context is None:
+            # Fall back to the earlier messages of the thread listed in this run
+            context = thread[:thread.index(target)]
+        to_answer.append(dict(
+            target, context=context, answered_message_ids=[email['message_id'] for email in needs_response]
+        ))
+
+    if to_answer:
+        logger.info(f"Generating {len(to_answer)} responses with up to {max_concurrency} concurrent requests")
+        asyncio.run_coroutine_threadsafe(
+            _respond_concurrently(service, to_answer, max_concurrency), get_event_loop()
+        ).result()
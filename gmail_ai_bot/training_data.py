@@ -0,0 +1,189 @@
+import argparse
+import atexit
+import csv
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+
+from .config import (
+    TRAINING_DATA_PATH, TRAINING_DATA_DIR, TRAINING_DATA_BUFFER_SIZE, TRAINING_DATA_SHARD_MB, LOG_LEVEL, LOG_FORMAT
+)
+
+# Set up logging
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
+# File names of the shards, numbered in write order
+SHARD_PATTERN = 'part-{index:05d}.jsonl.gz'
+SHARD_INDEX = re.compile(r'part-(\d+)\.jsonl\.gz$')
+
+def list_shards(directory=TRAINING_DATA_DIR):
+    """
+    List the training data shards of a directory.
+
+    Args:
+        directory: The training data directory.
+
+    Returns:
+        The shard paths, in write order.
+    """
+    shards = [path for path in glob.glob(os.path.join(directory, 'part-*.jsonl.gz')) if SHARD_INDEX.search(path)]
+    return sorted(shards, key=lambda path: int(SHARD_INDEX.search(path).group(1)))
+
+class TrainingDataWriter:
+    """
+    Buffers training data entries in memory and writes them in batches to gzip-compressed
+    JSON Lines shards, starting a new shard once the current one reaches the size limit.
+
+    Each flush appends one gzip member to the current shard; gzip readers treat the
+    concatenated members as a single stream.
+    """
+
+    def __init__(self, directory=TRAINING_DATA_DIR, buffer_size=TRAINING_DATA_BUFFER_SIZE,
+                 max_shard_bytes=TRAINING_DATA_SHARD_MB * 1024 * 1024):
+        """
+        Initialize the writer.
+
+        Args:
+            directory: The training data directory.
+            buffer_size: Number of entries buffered before they are written out.
+            max_shard_bytes: Compressed size at which a new shard is started.
+        """
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.max_shard_bytes = max_shard_bytes
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def append(self, subject, body, category):
+        """
+        Add an entry, writing the buffer out once it is full.
+
+        Args:
+            subject: The email subject.
+            body: The email body.
+            category: The assigned category.
+        """
+        with self._lock:
+            self._buffer.append({'subject': subject, 'body': body, 'category': category})
+            if len(self._buffer) >= self.buffer_size:
+                self._write()
+
+    def _current_shard(self):
+        """Path of the shard to append to: the last one, or a new one if it is full."""
+        shards = list_shards(self.directory)
+        if shards and os.path.getsize(shards[-1]) < self.max_shard_bytes:
+            return shards[-1]
+        index = int(SHARD_INDEX.search(shards[-1]).group(1)) + 1 if shards else 0
+        return os.path.join(self.directory, SHARD_PATTERN.format(index=index))
+
+    def _write(self):
+        """Write the buffered entries to the current shard. Must be called with the lock held."""
+        if not self._buffer:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._current_shard()
+        lines = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in self._buffer)
+        with gzip.open(path, 'at', encoding='utf-8') as file:
+            file.write(lines)
+        logger.info(f"Wrote {len(self._buffer)} training data entries to {path}")
+        self._buffer = []
+
+    def flush(self):
+        """Write all buffered entries out."""
+        with self._lock:
+            try:
+                self._write()
+            except Exception as e:
+                logger.error(f"Error writing training data: {e}")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buffer)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_training_data_writer():
+    """
+    Get the process-wide training data writer; buffered entries are flushed at exit.
+
+    Returns:
+        The shared TrainingDataWriter instance.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = TrainingDataWriter()
+            atexit.register(_writer.flush)
+    return _writer
+
+def iter_training_data(directory=TRAINING_DATA_DIR, categories=None):
+    """
+    Stream the training data entries of all shards, in write order.
+
+    Args:
+        directory: The training data directory.
+        categories: Optional collection of categories to keep.
+
+    Yields:
+        Dicts with subject, body and category.
+    """
+    for path in list_shards(directory):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                entry = json.loads(line)
+                if categories is None or entry['category'] in categories:
+                    yield entry
+
+def convert_csv(csv_path=TRAINING_DATA_PATH, writer=None):
+    """
+    Move the entries of a legacy training data CSV file into the shards.
+
+    Args:
+        csv_path: Path of the CSV file.
+        writer: The TrainingDataWriter to write to. If None, uses the shared writer.
+
+    Returns:
+        The number of converted entries.
+    """
+    if writer is None:
+        writer = get_training_data_writer()
+    count = 0
+    with open(csv_path, newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            writer.append(row['subject'], row['body'], row['category'])
+            count += 1
+    writer.flush()
+    logger.info(f"Converted {count} training data entries from {csv_path}")
+    return count
+
+def main():
+    """Command-line entry point to convert the legacy CSV file and summarize the shards."""
+    parser = argparse.ArgumentParser(description="Manage the gmail-ai-bot training data")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help="Convert the legacy training data CSV file into shards")
+    convert_parser.add_argument("--csv", default=TRAINING_DATA_PATH, help="Training data CSV file")
+    convert_parser.add_argument("--dir", default=TRAINING_DATA_DIR, help="Training data shard directory")
+    stats_parser = subparsers.add_parser('stats', help="Count the training data entries per category")
+    stats_parser.add_argument("--dir", default=TRAINING_DATA_DIR, help="Training data shard directory")
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        count = convert_csv(args.csv, TrainingDataWriter(args.dir))
+        print(f"Converted {count} entries from {args.csv} into {args.dir}")
+    else:
+        counts = {}
+        for entry in iter_training_data(args.dir):
+            counts[entry['category']] = counts.get(entry['category'], 0) + 1
+        for category, count in sorted(counts.items(), key=lambda item: -item[1]):
+            print(f"{category:<24} {count}")
+        print(f"{'total':<24} {sum(counts.values())}")
+
+if __name__ == '__main__':
+    main()
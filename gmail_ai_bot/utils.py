@@ -1,8 +1,8 @@
 import os
-import csv
 import logging
 
-from .config import TRAINING_DATA_PATH, LOG_LEVEL, LOG_FORMAT
+from .config import TRAINING_DATA_PATH, TRAINING_DATA_DIR, LOG_LEVEL, LOG_FORMAT
+from .training_data import get_training_data_writer, list_shards
 
 # Set up logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
@@ -10,28 +10,27 @@ logger = logging.getLogger(__name__)
 
 def initialize_training_data():
     """
-    Initialize the training data CSV file if it doesn't exist.
+    Initialize the training data directory if it doesn't exist.
 
-    Creates a new CSV file with headers for subject, body, and category
-    if the file doesn't already exist.
+    Points at the converter when a legacy CSV file exists but hasn't been moved into
+    the shards yet.
     """
-    if not os.path.exists(TRAINING_DATA_PATH):
-        try:
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(TRAINING_DATA_PATH), exist_ok=True)
-            
-            with open(TRAINING_DATA_PATH, mode='w', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow(["subject", "body", "category"])
-            logger.info(f"Created new training data file at {TRAINING_DATA_PATH}")
-        except Exception as e:
-            logger.error(f"Error creating training data file: {e}")
-            raise
+    try:
+        os.makedirs(TRAINING_DATA_DIR, exist_ok=True)
+    except Exception as e:
+        logger.error(f"Error creating training data directory: {e}")
+        raise
+
+    if os.path.exists(TRAINING_DATA_PATH) and not list_shards(TRAINING_DATA_DIR):
+        logger.warning(f"Found legacy training data at {TRAINING_DATA_PATH}, convert it with "
+                       f"`python -m gmail_ai_bot.training_data convert`")
 
 
 def append_to_training_data(subject, body, category):
     """
-    Append categorized email data to the training data file.
+    Append categorized email data to the training data buffer.
+
+    The entries are written to disk in batches, see flush_training_data.
 
     Args:
         subject: The email subject.
@@ -39,13 +38,11 @@ def append_to_training_data(subject, body, category):
         category: The assigned category.
     """
     try:
-        # Initialize the file if it doesn't exist
-        if not os.path.exists(TRAINING_DATA_PATH):
-            initialize_training_data()
-            
-        with open(TRAINING_DATA_PATH, mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow([subject, body, category])
-        logger.info(f"Added new training data entry with category: {category}")
+        get_training_data_writer().append(subject, body, category)
     except Exception as e:
-        logger.error(f"Error appending to training data: {e}")
\ No newline at end of file
+        logger.error(f"Error appending to training data: {e}")
+
+
+def flush_training_data():
+    """Write all buffered training data entries to disk."""
+    get_training_data_writer().flush()
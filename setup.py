@@ -38,6 +38,15 @@ setup(
         "pydantic>=2.8.2",
         "PyYAML>=6.0.2",
     ],
+    extras_require={
+        "onnx": [
+            "onnx>=1.16.0",
+            "onnxruntime>=1.18.0",
+        ],
+        "zstd": [
+            "zstandard>=0.22.0",
+        ],
+    },
     entry_points={
         "console_scripts": [
             "gmail-ai-bot=gmail_ai_bot.main:main",
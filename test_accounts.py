@@ -0,0 +1,100 @@
+import pytest
+
+from gmail_ai_bot import accounts, bot, categorizer, classifier_server
+
+def test_list_accounts_only_lists_authorized_accounts(tmp_path):
+    for name in ('bob', 'alice', 'new'):
+        (tmp_path / name).mkdir()
+    for name in ('bob', 'alice'):
+        (tmp_path / name / accounts.ACCOUNT_TOKEN_FILE).write_bytes(b'token')
+
+    assert accounts.list_accounts(str(tmp_path)) == ['alice', 'bob']
+    assert accounts.list_accounts(str(tmp_path / 'missing')) == []
+
+def test_account_environment_keeps_the_account_files_apart(tmp_path):
+    (tmp_path / 'alice').mkdir()
+    (tmp_path / 'alice' / accounts.ACCOUNT_ENV_FILE).write_text('POLLING_INTERVAL_MINUTES=1\nDB_PATH=sqlite:///other.db\n')
+
+    env = accounts.account_environment('alice', str(tmp_path), {'CLASSIFIER_SERVER_ADDRESS': '127.0.0.1:5000'})
+    assert env['GMAIL_ACCOUNT'] == 'alice'
+    assert env['TOKEN_FILE'] == str(tmp_path / 'alice' / accounts.ACCOUNT_TOKEN_FILE)
+    assert env['CLASSIFIER_SERVER_ADDRESS'] == '127.0.0.1:5000'
+    # The .env file of the account takes precedence
+    assert env['POLLING_INTERVAL_MINUTES'] == '1'
+    assert env['DB_PATH'] == 'sqlite:///other.db'
+
+@pytest.fixture
+def unreachable_classifier_server(monkeypatch):
+    resets = []
+
+    def get_remote_classifier():
+        raise ConnectionRefusedError("Connection refused")
+
+    monkeypatch.setattr(categorizer, 'CLASSIFIER_SERVER_ADDRESS', '127.0.0.1:50000')
+    monkeypatch.setattr(classifier_server, 'get_remote_classifier', get_remote_classifier)
+    monkeypatch.setattr(classifier_server, 'reset_remote_classifier', lambda: resets.append(True))
+    return resets
+
+def test_emails_are_not_categorized_while_the_classifier_server_is_down(unreachable_classifier_server):
+    with pytest.raises(ConnectionRefusedError):
+        categorizer.categorize_emails([('Hello', 'Hi there')])
+    assert unreachable_classifier_server == [True]
+
+def test_emails_are_retried_while_the_classifier_server_is_down(run, unreachable_classifier_server, monkeypatch):
+    monkeypatch.setattr(bot, 'categorize_emails', categorizer.categorize_emails)
+    run.gmail.add_message('m1', 'Newsletter')
+    run()
+
+    assert run.responded == []
+    assert 'UNREAD' in run.gmail.mailbox['m1']['labelIds']
+    assert bot.load_retry_message_ids() == {'m1': 1}
+
+class FakeProcess:
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+class FakeClassifierManager:
+    def __init__(self, address):
+        self.address = address
+        self._process = FakeProcess()
+        self.shut_down = False
+
+    def shutdown(self):
+        self.shut_down = True
+
+def test_supervisor_restarts_the_classifier_server_where_the_workers_expect_it(monkeypatch):
+    started = []
+
+    def start_classifier_server(authkey, host='127.0.0.1', port=0):
+        if started and len(started) < 3:
+            # The first restart fails, e.g. because the port is still in use
+            started.append(None)
+            raise OSError("Address already in use")
+        manager = FakeClassifierManager((host, port or 50123))
+        started.append(manager)
+        return manager
+
+    monkeypatch.setattr(classifier_server, 'start_classifier_server', start_classifier_server)
+    supervisor = accounts.AccountSupervisor([])
+    supervisor._classifier_authkey = 'key'
+    assert supervisor._start_classifier_server() == ('127.0.0.1', 50123)
+
+    supervisor._check_classifier_server(now=0)
+    assert len(started) == 1
+
+    server = started[0]
+    server._process.alive = False
+    supervisor._check_classifier_server(now=0)
+    assert server.shut_down and started[1:] == [None]
+
+    # The next attempt waits for the restart delay
+    supervisor._check_classifier_server(now=1)
+    assert len(started) == 2
+    supervisor._check_classifier_server(now=accounts.WORKER_RESTART_SECONDS)
+    assert started[2:] == [None]
+    supervisor._check_classifier_server(now=3 * accounts.WORKER_RESTART_SECONDS)
+    assert started[3].address == ('127.0.0.1', 50123)
+    assert supervisor._classifier_server is started[3]
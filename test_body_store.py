@@ -0,0 +1,66 @@
+import pytest
+
+from gmail_ai_bot.body_store import BodyCodec, cap_body, prepare_body, _import_zstd
+
+BODY = "Hello,\n\nThe build 1234 passed. Grüße, ✓\n" * 20
+
+@pytest.mark.parametrize('method', [
+    'zlib',
+    'none',
+    pytest.param('zstd', marks=pytest.mark.skipif(_import_zstd() is None, reason="zstandard isn't installed")),
+])
+def test_body_codec_round_trip(method):
+    codec = BodyCodec(method=method, dictionary_path=None)
+    name, data = codec.compress(BODY)
+    assert name == method
+    assert codec.decompress(name, data) == BODY
+    if method != 'none':
+        assert len(data) < len(BODY.encode('utf-8'))
+
+def test_body_codec_round_trip_with_dictionary(tmp_path):
+    dictionary = tmp_path / 'bodies.dict'
+    dictionary.write_bytes(b"The build passed. Hello, regards" * 10)
+    codec = BodyCodec(method='zlib', dictionary_path=str(dictionary))
+    name, data = codec.compress(BODY)
+    assert name == f"zlib:{codec.dictionary_id}"
+    assert codec.decompress(name, data) == BODY
+
+    # Bodies written without the dictionary stay readable
+    plain_name, plain_data = BodyCodec(method='zlib', dictionary_path=None).compress(BODY)
+    assert codec.decompress(plain_name, plain_data) == BODY
+
+    with pytest.raises(ValueError):
+        BodyCodec(method='zlib', dictionary_path=None).decompress(name, data)
+
+def test_prepare_body_hashes_the_capped_text():
+    first, second = prepare_body(BODY), prepare_body(BODY)
+    assert first['body_hash'] == second['body_hash']
+    assert prepare_body('')['body_hash'] == prepare_body(None)['body_hash']
+    assert cap_body('ab' + 'é' * 10, max_bytes=5) == 'abé'
+
+def test_email_body_assignment_stores_the_compressed_body(database):
+    with database.session_scope() as session:
+        session.add(database.Email(message_id='a', thread_id='t', body='Same text'))
+        session.add(database.Email(message_id='b', thread_id='t', body='Same text'))
+
+    with database.session_scope() as session:
+        email = session.query(database.Email).filter_by(message_id='a').one()
+        assert email.body == 'Same text' and email.legacy_body is None
+        email.body = 'New text'
+        assert email.body == 'New text'
+
+    with database.session_scope() as session:
+        assert session.query(database.Email).filter_by(message_id='a').one().body == 'New text'
+        assert session.query(database.EmailBody).count() == 2
+
+def test_saving_stored_messages_adds_no_bodies(database):
+    from gmail_ai_bot.connector import save_messages_to_db
+
+    def email(message_id, body):
+        return {'message_id': message_id, 'thread_id': 't', 'subject': 's', 'body': body, 'category': 'Other'}
+
+    assert save_messages_to_db([email('a', 'first'), email('a', 'duplicate')])
+    assert save_messages_to_db([email('a', 'changed'), email('b', 'second')])
+    with database.session_scope() as session:
+        assert sorted(e.body for e in session.query(database.Email)) == ['first', 'second']
+        assert session.query(database.EmailBody).count() == 2
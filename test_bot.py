@@ -0,0 +1,65 @@
+import base64
+
+import pytest
+
+from gmail_ai_bot import bot
+from gmail_ai_bot.config import RESPONSE_CATEGORIES
+
+def message(message_id, subject, body, bulk=False):
+    headers = [{'name': 'Subject', 'value': subject}, {'name': 'From', 'value': 'someone@example.com'}]
+    if bulk:
+        headers.append({'name': 'List-Unsubscribe', 'value': '<mailto:leave@example.com>'})
+    return {
+        'id': message_id,
+        'threadId': f"thread-{message_id}",
+        'snippet': body[:10],
+        'payload': {
+            'mimeType': 'text/plain',
+            'headers': headers,
+            'body': {'data': base64.urlsafe_b64encode(body.encode()).decode()},
+        },
+    }
+
+@pytest.fixture
+def gmail(database, monkeypatch):
+    """Fake Gmail mailbox, classifier and responder; records the full downloads and the answered messages."""
+    mailbox = {
+        'news': message('news', 'Weekly news', 'Lots of news in this letter', bulk=True),
+        'list': message('list', 'Can you review?', 'Please review my change today', bulk=True),
+        'mail': message('mail', 'Lunch', 'Lunch tomorrow?'),
+    }
+    calls = {'full': [], 'answered': [], 'training': []}
+
+    def fetch_messages(service, message_ids, **kwargs):
+        if kwargs.get('format') != 'metadata':
+            calls['full'].extend(message_ids)
+        return {message_id: mailbox[message_id] for message_id in message_ids}
+
+    def categorize_emails(emails):
+        return [sorted(RESPONSE_CATEGORIES)[0] if 'review' in subject else 'not important' for subject, _ in emails]
+
+    monkeypatch.setattr(bot, 'METADATA_PREFILTER', True)
+    monkeypatch.setattr(bot, 'fetch_messages', fetch_messages)
+    monkeypatch.setattr(bot, 'categorize_emails', categorize_emails)
+    monkeypatch.setattr(bot, 'append_to_training_data', lambda *args: calls['training'].append(args))
+    monkeypatch.setattr(bot, 'auto_respond_many', lambda service, emails, label_batcher=None: calls['answered'].extend(
+        (email['message_id'], email['body']) for email in emails if email['category'] in RESPONSE_CATEGORIES
+    ))
+    monkeypatch.setattr(bot, 'get_drafted_message_ids', lambda message_ids: set(message_ids))
+    return calls
+
+def test_bulk_mail_is_categorized_on_its_snippet(gmail):
+    page = bot.categorize_page(bot.fetch_page('service', ['news', 'list', 'mail']))
+
+    assert gmail['full'] == ['mail']
+    assert page['parsed_messages']['news'][1] == 'Lots of ne'
+    assert page['categories']['news'] == 'not important'
+    assert page['categories']['list'] in RESPONSE_CATEGORIES
+
+def test_bulk_mail_needing_a_response_is_answered_from_its_body(gmail):
+    failed = bot.process_messages('service', ['news', 'list', 'mail'])
+
+    assert failed == set()
+    assert gmail['answered'] == [('list', 'Please review my change today')]
+    assert sorted(gmail['full']) == ['list', 'mail']
+    assert sorted(args[0] for args in gmail['training']) == ['Can you review?', 'Lunch']
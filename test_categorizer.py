@@ -0,0 +1,100 @@
+import re
+
+import pytest
+
+from gmail_ai_bot import categorizer
+from gmail_ai_bot.categorizer import truncate_to_tokens
+
+class FakeTokenizer:
+    """Whitespace tokenizer with the interface of a transformers tokenizer and two special tokens."""
+
+    model_max_length = 512
+
+    def __init__(self, is_fast=True):
+        self.is_fast = is_fast
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+    def __call__(self, text, add_special_tokens=False, return_offsets_mapping=False):
+        return {'offset_mapping': [match.span() for match in re.finditer(r'\S+', text)]}
+
+    def encode(self, text, add_special_tokens=False):
+        return text.split()
+
+    def decode(self, token_ids):
+        return ' '.join(token_ids)
+
+@pytest.fixture(params=[True, False], ids=['fast', 'slow'])
+def tokenizer(request, monkeypatch):
+    fake = FakeTokenizer(is_fast=request.param)
+    monkeypatch.setattr(categorizer, 'get_tokenizer', lambda: fake)
+    return fake
+
+def words(count, prefix='w'):
+    return ' '.join(f"{prefix}{i}" for i in range(count))
+
+def test_short_text_is_unchanged(tokenizer):
+    text = words(5)
+    assert truncate_to_tokens(text, max_tokens=10, tail_tokens=0) == text
+
+def test_text_fills_the_budget_minus_special_tokens(tokenizer):
+    assert truncate_to_tokens(words(20), max_tokens=10, tail_tokens=0) == words(8)
+
+def test_tail_tokens_are_kept_from_the_end(tokenizer):
+    assert truncate_to_tokens(words(20), max_tokens=10, tail_tokens=3) == f"{words(5)} w17 w18 w19"
+
+def test_tail_can_take_the_whole_budget(tokenizer):
+    assert truncate_to_tokens(words(20), max_tokens=6, tail_tokens=10) == 'w16 w17 w18 w19'
+
+def test_budget_is_capped_at_the_model_maximum(tokenizer):
+    result = truncate_to_tokens(words(1000), max_tokens=10000, tail_tokens=0)
+    assert result.split() == words(510).split()
+
+def test_long_texts_are_cut_before_tokenizing(tokenizer):
+    text = words(5) + ' ' + 'x' * 10000 + ' ' + words(5, prefix='end')
+    result = truncate_to_tokens(text, max_tokens=4, tail_tokens=1)
+    assert result.startswith('w0') and result.endswith('end4')
+
+class FakeClassifier:
+    """Scores the first category highest for every text, counting the texts it is called with."""
+
+    def __init__(self, category_count):
+        self.category_count = category_count
+        self.texts = []
+
+    def __call__(self, texts, batch_size=None):
+        self.texts.extend(texts)
+        return [[{'score': 1.0 if i == 0 else 0.0} for i in range(self.category_count)] for _ in texts]
+
+def test_cache_stats_count_batch_duplicates_separately(tokenizer, database, monkeypatch):
+    labels = {'important': 'Important', 'other': 'Other'}
+    classifier = FakeClassifier(len(labels))
+    monkeypatch.setattr(categorizer, 'get_classifier', lambda: classifier)
+    monkeypatch.setattr(categorizer, 'category_cache', categorizer.LRUCache(100))
+    monkeypatch.setattr(categorizer, 'cache_stats', dict.fromkeys(categorizer.cache_stats, 0))
+
+    emails = [('Hi', 'one'), ('Hi', 'one'), ('Hi', 'two')]
+    assert categorizer.categorize_emails(emails, labels=labels, use_server=False) == ['important'] * 3
+    assert len(classifier.texts) == 2
+    assert categorizer.cache_stats == {'memory_hits': 0, 'persistent_hits': 0, 'misses': 2, 'batch_duplicates': 1}
+
+    categorizer.categorize_emails(emails, labels=labels, use_server=False)
+    assert categorizer.cache_stats == {'memory_hits': 2, 'persistent_hits': 0, 'misses': 2, 'batch_duplicates': 2}
+
+    categorizer.category_cache.clear()
+    categorizer.categorize_emails(emails[:1], labels=labels, use_server=False)
+    assert categorizer.cache_stats['persistent_hits'] == 1
+    assert len(classifier.texts) == 2
+
+def test_persistent_cache_is_keyed_by_backend(tokenizer, database, monkeypatch):
+    labels = {'important': 'Important', 'other': 'Other'}
+    classifier = FakeClassifier(len(labels))
+    monkeypatch.setattr(categorizer, 'get_classifier', lambda: classifier)
+    monkeypatch.setattr(categorizer, 'category_cache', categorizer.LRUCache(100))
+
+    categorizer.categorize_emails([('Hi', 'one')], labels=labels, use_server=False)
+    categorizer.category_cache.clear()
+    monkeypatch.setattr(categorizer, 'CACHE_MODEL_NAME', 'model:other-backend')
+    categorizer.categorize_emails([('Hi', 'one')], labels=labels, use_server=False)
+    assert len(classifier.texts) == 2
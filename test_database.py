@@ -0,0 +1,62 @@
+import sqlite3
+
+from sqlalchemy import inspect
+
+from gmail_ai_bot.body_store import compact_bodies
+
+def create_old_database(path):
+    """Create a database with the schema of the versions before the migrations existed."""
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id VARCHAR(255) NOT NULL UNIQUE,
+            thread_id VARCHAR(255) NOT NULL,
+            subject TEXT,
+            body TEXT,
+            category VARCHAR(50),
+            draft_created BOOLEAN
+        );
+        INSERT INTO emails (message_id, thread_id, subject, body, category, draft_created)
+        VALUES ('m1', 't1', 'Hello', 'Old body', 'Other', 0),
+               ('m2', 't2', 'Hi', 'Old body', 'Other', 0);
+    """)
+    connection.commit()
+    connection.close()
+
+def test_migrations_upgrade_an_old_database(database, tmp_path):
+    create_old_database(tmp_path / 'database.db')
+    engine = database.get_engine()
+
+    inspector = inspect(engine)
+    assert 'body_hash' in {column['name'] for column in inspector.get_columns('emails')}
+    assert 'ix_emails_message_id_draft_created' in {index['name'] for index in inspector.get_indexes('emails')}
+    with database.session_scope() as session:
+        version = session.get(database.SyncState, database.SCHEMA_VERSION_KEY).value
+        assert int(version) == len(database.MIGRATIONS)
+        assert session.get(database.Email, 1).body == 'Old body'
+
+    assert compact_bodies() == 2
+    with database.session_scope() as session:
+        emails = session.query(database.Email).all()
+        assert [email.body for email in emails] == ['Old body', 'Old body']
+        assert all(email.legacy_body is None for email in emails)
+        assert session.query(database.EmailBody).count() == 1
+
+def test_migrations_run_once(database, tmp_path):
+    create_old_database(tmp_path / 'database.db')
+    database.migrate(database.get_engine())
+    database.migrate(database.get_engine())
+    with database.session_scope() as session:
+        assert int(session.get(database.SyncState, database.SCHEMA_VERSION_KEY).value) == len(database.MIGRATIONS)
+
+def test_sqlite_connections_use_the_tuning_profile(database, monkeypatch):
+    monkeypatch.setattr(database, 'DB_SQLITE_SYNCHRONOUS', 'bogus')
+    monkeypatch.setattr(database, 'DB_SQLITE_CACHE_SIZE_MB', 8)
+    with database.get_engine().connect() as connection:
+        pragmas = {name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+                   for name in ('journal_mode', 'synchronous', 'cache_size', 'busy_timeout')}
+
+    # An unknown synchronous level falls back to NORMAL (1)
+    assert pragmas == {'journal_mode': 'wal', 'synchronous': 1, 'cache_size': -8 * 1024,
+                       'busy_timeout': database.DB_BUSY_TIMEOUT_MS}
@@ -0,0 +1,40 @@
+from gmail_ai_bot import bot
+
+def test_messages_are_fetched_in_batches(gmail_service):
+    for i in range(5):
+        gmail_service.add_message(f"m{i}")
+
+    messages = bot.fetch_messages(gmail_service, [f"m{i}" for i in range(5)], batch_size=2, format='metadata')
+
+    assert gmail_service.batches == [['m0', 'm1'], ['m2', 'm3'], ['m4']]
+    assert sorted(messages) == [f"m{i}" for i in range(5)]
+    assert {fetch_format for _, fetch_format in gmail_service.gets} == {'metadata'}
+
+def test_a_failed_message_does_not_sink_its_batch(gmail_service):
+    for message_id in ('a', 'b', 'c'):
+        gmail_service.add_message(message_id)
+    gmail_service.failing_gets.add('b')
+    missing_ids = set()
+
+    messages = bot.fetch_messages(gmail_service, ['a', 'b', 'c', 'gone'], missing_ids=missing_ids)
+
+    assert sorted(messages) == ['a', 'c']
+    assert missing_ids == {'gone'}
+
+def test_unread_messages_are_listed_page_by_page(gmail_service):
+    for i in range(5):
+        gmail_service.add_message(f"m{i}")
+    gmail_service.add_message('read', label_ids=['INBOX'])
+
+    pages = bot.iter_unread_message_pages(gmail_service, query='-category:promotions', max_results=2)
+    first_page = next(pages)
+    # Later pages are only requested once the first one has been handled
+    assert len(gmail_service.list_calls) == 1
+    assert [[message['id'] for message in page] for page in [first_page, *pages]] == [
+        ['m0', 'm1'], ['m2', 'm3'], ['m4']
+    ]
+    assert [call.get('pageToken') for call in gmail_service.list_calls] == [None, '2', '4']
+    assert all(call['q'] == '-category:promotions' for call in gmail_service.list_calls)
+
+def test_empty_mailbox_yields_no_pages(gmail_service):
+    assert list(bot.iter_unread_message_pages(gmail_service)) == []
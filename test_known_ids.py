@@ -0,0 +1,54 @@
+from gmail_ai_bot.cache import BloomFilter
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    items = [f"18c{i:013x}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"known-{i}")
+    false_positives = sum(f"unknown-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+def test_known_message_ids(database, monkeypatch):
+    from gmail_ai_bot import connector
+    from gmail_ai_bot.config import RESPONSE_CATEGORIES
+
+    response_category = sorted(RESPONSE_CATEGORIES)[0]
+    connector.save_messages_to_db([
+        {'message_id': 'done', 'thread_id': 't', 'body': '', 'category': 'Other'},
+        {'message_id': 'drafted', 'thread_id': 't', 'body': '', 'category': response_category, 'draft_created': True},
+        {'message_id': 'waiting', 'thread_id': 't', 'body': '', 'category': response_category},
+    ])
+
+    for bloom_threshold in (100, 0):
+        known = connector.KnownMessageIds(bloom_threshold=bloom_threshold)
+        assert known.use_bloom_filter == (bloom_threshold == 0)
+        assert known.filter_unknown(['new', 'done', 'waiting', 'drafted']) == ['new', 'waiting']
+        known.add_many(['new'])
+        assert known.filter_unknown(['new', 'other']) == (['new', 'other'] if known.use_bloom_filter else ['other'])
+
+def test_saved_messages_become_known(database):
+    from gmail_ai_bot import connector
+
+    known = connector.get_known_message_ids()
+    connector.save_messages_to_db([{'message_id': 'a', 'thread_id': 't', 'body': '', 'category': 'Other'}])
+    assert known.filter_unknown(['a', 'b']) == ['b']
+
+def test_known_messages_are_not_fetched_again(run, monkeypatch):
+    from gmail_ai_bot import bot
+
+    monkeypatch.setattr(bot, 'INCREMENTAL_SYNC', False)
+    run.gmail.add_message('m1', 'Newsletter')
+    run()
+    # Marked unread again by the user, the message is listed but not downloaded
+    run.gmail.mailbox['m1']['labelIds'].append('UNREAD')
+    fetched = len(run.gmail.gets)
+    run.gmail.add_message('m2', 'Newsletter')
+    run()
+
+    assert {message_id for message_id, _ in run.gmail.gets[fetched:]} == {'m2'}
@@ -0,0 +1,84 @@
+from gmail_ai_bot import labels
+from gmail_ai_bot.labels import LabelBatcher
+
+class FakeGmailService:
+    """Records batchModify calls, failing the first `failures` of them."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def batchModify(self, userId, body):
+        self.calls.append(body)
+        return self
+
+    def execute(self):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("rate limited")
+        return {}
+
+def no_sleep(monkeypatch):
+    delays = []
+    monkeypatch.setattr(labels.time, 'sleep', delays.append)
+    return delays
+
+def test_changes_are_grouped_and_chunked(monkeypatch):
+    no_sleep(monkeypatch)
+    service = FakeGmailService()
+    batcher = LabelBatcher(service, batch_size=2, retries=0)
+    for message_id in ('a', 'b', 'c', 'a'):
+        batcher.mark_as_read(message_id)
+    batcher.modify('d', add_label_ids=['STARRED'])
+    assert len(batcher) == 4
+
+    assert batcher.flush() == []
+    assert service.calls == [
+        {'ids': ['a', 'b'], 'removeLabelIds': ['UNREAD']},
+        {'ids': ['c'], 'removeLabelIds': ['UNREAD']},
+        {'ids': ['d'], 'addLabelIds': ['STARRED']},
+    ]
+    assert len(batcher) == 0
+
+def test_failed_calls_are_retried_with_backoff(monkeypatch):
+    delays = no_sleep(monkeypatch)
+    service = FakeGmailService(failures=2)
+    batcher = LabelBatcher(service, retries=3)
+    batcher.mark_as_read('a')
+
+    assert batcher.flush() == []
+    assert len(service.calls) == 3
+    assert delays == [1, 2]
+
+def test_ids_are_returned_when_retries_run_out(monkeypatch):
+    delays = no_sleep(monkeypatch)
+    service = FakeGmailService(failures=10)
+    batcher = LabelBatcher(service, batch_size=1, retries=1)
+    batcher.mark_as_read('a')
+    batcher.mark_as_read('b')
+
+    assert batcher.flush() == ['a', 'b']
+    assert len(service.calls) == 4
+    assert delays == [1, 1]
+
+def test_batch_size_is_capped_at_the_api_limit():
+    assert LabelBatcher(FakeGmailService(), batch_size=5000).batch_size == 1000
+
+def test_messages_that_could_not_be_marked_as_read_are_retried(run, monkeypatch):
+    no_sleep(monkeypatch)
+    run.gmail.add_message('m1', 'Newsletter')
+    run.gmail.failing_modifies = 100
+    run()
+    assert 'UNREAD' in run.gmail.mailbox['m1']['labelIds']
+
+    # The message is stored and known, the retry list still brings it back
+    run.gmail.failing_modifies = 0
+    run()
+    assert 'UNREAD' not in run.gmail.mailbox['m1']['labelIds']
+    assert run.gmail.modified == [{'ids': ['m1'], 'removeLabelIds': ['UNREAD']}]
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from gmail_ai_bot.llm_router import LLMRouter, LLMUnavailableError, ProviderHealth
+
+class FakeService:
+    """LLM service answering after a delay, or failing."""
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_text(self, prompt, max_tokens, fallback=True, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return f"{self.name}: {prompt}"
+
+    async def agenerate_text(self, prompt, max_tokens, fallback=True, **kwargs):
+        with self._lock:
+            self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return f"{self.name}: {prompt}"
+
+class FakeRouter(LLMRouter):
+    def __init__(self, services, **kwargs):
+        self.services = services
+        super().__init__(providers=list(services), **kwargs)
+
+    def _service(self, provider):
+        return self.services[provider]
+
+def test_router_uses_the_first_provider():
+    router = FakeRouter({'a': FakeService('a'), 'b': FakeService('b')}, hedge_after=5)
+    assert router.generate_text('hi') == 'a: hi'
+    assert router.services['b'].calls == 0
+
+def test_router_falls_back_when_a_provider_fails():
+    router = FakeRouter({'a': FakeService('a', error=RuntimeError('down')), 'b': FakeService('b')}, hedge_after=5)
+    assert router.generate_text('hi') == 'b: hi'
+    assert router.get_stats()['a']['error_rate'] == 1.0
+
+def test_router_hedges_slow_requests():
+    router = FakeRouter({'a': FakeService('a', delay=1.0), 'b': FakeService('b')}, hedge_after=0.05)
+    start = time.monotonic()
+    assert router.generate_text('hi') == 'b: hi'
+    assert time.monotonic() - start < 0.5
+
+def test_router_hedges_slow_async_requests():
+    router = FakeRouter({'a': FakeService('a', delay=1.0), 'b': FakeService('b')}, hedge_after=0.05)
+    assert asyncio.run(router.agenerate_text('hi')) == 'b: hi'
+    # The losing request was cancelled, which doesn't count against the provider
+    assert router.get_stats()['a']['error_rate'] == 0.0
+    assert not router.health['a'].trial_in_progress
+
+def test_router_raises_when_every_provider_fails():
+    router = FakeRouter({'a': FakeService('a', error=RuntimeError('down'))}, hedge_after=5)
+    with pytest.raises(LLMUnavailableError):
+        router.generate_text('hi')
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(router.agenerate_text('hi'))
+
+def test_router_skips_providers_with_an_open_circuit():
+    services = {'a': FakeService('a', error=RuntimeError('down'))}
+    router = FakeRouter(services, hedge_after=5)
+    router.health['a'] = ProviderHealth('a', min_requests=2, failure_rate=0.5, cooldown=60)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError):
+            router.generate_text('hi')
+    assert router.get_stats()['a']['circuit_open']
+
+    with pytest.raises(LLMUnavailableError, match='all circuits open'):
+        router.generate_text('hi')
+    assert services['a'].calls == 2
+
+def test_router_prefers_providers_that_answered():
+    services = {'a': FakeService('a', error=RuntimeError('down')), 'b': FakeService('b')}
+    router = FakeRouter(services, hedge_after=5)
+    router.generate_text('one')
+    assert router.generate_text('two') == 'b: two'
+    assert services['a'].calls == 1
+
+def test_circuit_breaker_lets_one_trial_request_through_after_the_cooldown():
+    health = ProviderHealth('a', min_requests=2, failure_rate=0.5, cooldown=0.05)
+    health.record_failure()
+    assert not health.is_open
+    health.record_failure()
+    assert health.is_open and not health.acquire()
+
+    time.sleep(0.06)
+    assert health.acquire()
+    assert not health.acquire()
+    health.record_failure()
+    assert health.is_open and not health.acquire()
+
+    time.sleep(0.06)
+    assert health.acquire()
+    health.record_success(0.1)
+    assert not health.is_open and health.acquire()
+
+def test_released_trial_request_can_be_retried():
+    health = ProviderHealth('a', min_requests=1, failure_rate=0.5, cooldown=0)
+    health.record_failure()
+    assert health.acquire()
+    health.release()
+    assert health.acquire()
+
+def test_providers_are_ranked_by_latency():
+    router = FakeRouter({'a': FakeService('a'), 'b': FakeService('b'), 'c': FakeService('c')}, hedge_after=5)
+    router.health['a'].record_success(2.0)
+    router.health['b'].record_success(0.5)
+    assert router._ranked_providers() == ['b', 'a', 'c']
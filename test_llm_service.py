@@ -0,0 +1,31 @@
+from gmail_ai_bot.llm_service import _StreamCutter
+
+def feed_all(cutter, chunks):
+    emitted, done = [], False
+    for chunk in chunks:
+        text, done = cutter.feed(chunk)
+        emitted.append(text)
+        if done:
+            break
+    return ''.join(emitted), done
+
+def test_stream_cutter_passes_text_through():
+    cutter = _StreamCutter()
+    assert feed_all(cutter, ['Hello ', 'world']) == ('Hello world', False)
+    assert cutter.length == len('Hello world')
+
+def test_stream_cutter_stops_at_a_stop_sequence():
+    cutter = _StreamCutter(stop_sequences=['\n\n'])
+    assert feed_all(cutter, ['Dear Bob,', '\n\nBest', ' regards']) == ('Dear Bob,\n\n', True)
+
+def test_stream_cutter_finds_stop_sequences_across_chunks():
+    cutter = _StreamCutter(stop_sequences=['END'])
+    assert feed_all(cutter, ['text E', 'N', 'D more']) == ('text END', True)
+    assert cutter.text == 'text END'
+
+def test_stream_cutter_stops_at_the_earliest_condition():
+    cutter = _StreamCutter(stop_sequences=['STOP'], max_chars=5)
+    assert feed_all(cutter, ['abcdefSTOP']) == ('abcde', True)
+
+    cutter = _StreamCutter(stop_sequences=['', 'x'], max_chars=100)
+    assert feed_all(cutter, ['abxcd']) == ('abx', True)
@@ -0,0 +1,85 @@
+import base64
+
+from gmail_ai_bot.mime import extract_body, html_to_text
+
+def encode(text, charset='utf-8'):
+    return base64.urlsafe_b64encode(text.encode(charset)).decode('ascii')
+
+def part(mime_type, text, charset='utf-8', **extra):
+    return {
+        'mimeType': mime_type,
+        'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; charset="{charset}"'}],
+        'body': {'data': encode(text, charset)},
+        **extra,
+    }
+
+def test_single_part_body():
+    assert extract_body(part('text/plain', 'Hello there')) == 'Hello there'
+
+def test_plain_text_is_preferred_over_html():
+    payload = {'mimeType': 'multipart/alternative', 'parts': [
+        part('text/html', '<p>Hello <b>HTML</b></p>'),
+        part('text/plain', 'Hello plain'),
+    ]}
+    assert extract_body(payload) == 'Hello plain'
+
+def test_html_is_converted_when_there_is_no_plain_text():
+    payload = {'mimeType': 'multipart/alternative', 'parts': [
+        part('text/html', '<html><head><style>p {}</style></head><body><p>First</p><p>Second&amp;more</p>'
+                          '<script>alert(1)</script></body></html>'),
+    ]}
+    assert extract_body(payload) == 'First\nSecond&more'
+
+def test_nested_parts_are_read_in_document_order():
+    payload = {'mimeType': 'multipart/mixed', 'parts': [
+        {'mimeType': 'multipart/alternative', 'parts': [part('text/plain', 'one')]},
+        part('text/plain', 'two'),
+        {'mimeType': 'multipart/related', 'parts': [part('text/plain', 'three')]},
+    ]}
+    assert extract_body(payload) == 'one\ntwo\nthree'
+
+def test_attachments_are_skipped():
+    payload = {'mimeType': 'multipart/mixed', 'parts': [
+        part('text/plain', 'Body'),
+        part('text/plain', 'Attached file', filename='notes.txt'),
+        {'mimeType': 'text/plain', 'filename': '', 'body': {'attachmentId': 'x'}},
+        {**part('text/plain', 'Inline attachment'),
+         'headers': [{'name': 'Content-Disposition', 'value': 'attachment; filename="a.txt"'}]},
+    ]}
+    assert extract_body(payload) == 'Body'
+
+def test_charset_is_honoured():
+    assert extract_body(part('text/plain', 'Grüße', charset='iso-8859-1')) == 'Grüße'
+
+def test_unknown_charset_falls_back_to_utf8():
+    payload = part('text/plain', 'Grüße')
+    payload['headers'] = [{'name': 'Content-Type', 'value': 'text/plain; charset=x-unknown'}]
+    assert extract_body(payload) == 'Grüße'
+
+def test_body_is_capped_without_splitting_characters():
+    assert extract_body(part('text/plain', 'ab' + 'é' * 10), max_bytes=5) == 'abé'
+
+def test_message_without_body():
+    assert extract_body({'mimeType': 'multipart/mixed', 'parts': []}) == ''
+    assert extract_body({'mimeType': 'text/plain', 'body': {}}) == ''
+
+def test_html_to_text_drops_hidden_elements():
+    assert html_to_text('<title>T</title><div>a  b</div><noscript>x</noscript>c') == 'a b\nc'
+
+def test_byte_budget_is_shared_by_the_parts():
+    payload = {'mimeType': 'multipart/mixed', 'parts': [
+        part('text/plain', 'abcd'),
+        part('text/plain', 'efgh'),
+        part('text/plain', 'never read'),
+    ]}
+    assert extract_body(payload, max_bytes=6) == 'abcd\nef'
+
+def test_multipart_message_body_is_used_by_the_bot():
+    from gmail_ai_bot.bot import get_message_subject_body_and_sender
+
+    message = {'payload': {
+        'mimeType': 'multipart/alternative',
+        'headers': [{'name': 'Subject', 'value': 'Report'}, {'name': 'From', 'value': 'bob@example.com'}],
+        'parts': [part('text/html', '<p>Numbers</p>')],
+    }}
+    assert get_message_subject_body_and_sender(message) == ('Report', 'Numbers', 'bob@example.com')
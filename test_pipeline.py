@@ -0,0 +1,108 @@
+import threading
+
+from gmail_ai_bot.pipeline import Pipeline, request_shutdown
+
+def make_pipeline(log, fail=None, service_factory=lambda: 'service', **kwargs):
+    """Build a pipeline whose stages record (stage, page) in log and raise on the pages listed in fail."""
+    fail = fail or {}
+    lock = threading.Lock()
+
+    def stage(name):
+        def handle(*args):
+            page = args[-1]
+            with lock:
+                log.append((name, tuple(page)))
+            if tuple(page) in fail.get(name, ()):
+                raise ValueError(f"{name} failed")
+            return page
+        return handle
+
+    return Pipeline(stage('fetch'), stage('categorize'), stage('respond'), service_factory, **kwargs)
+
+def test_pages_go_through_the_stages_in_order():
+    log = []
+    pipeline = make_pipeline(log, io_workers=1, queue_size=1)
+    pages = [[f'm{i}'] for i in range(5)]
+    for page in pages:
+        assert pipeline.submit(page)
+    pipeline.close()
+
+    for page in pages:
+        assert [stage for stage, item in log if item == tuple(page)] == ['fetch', 'categorize', 'respond']
+    assert [item for stage, item in log if stage == 'respond'] == [tuple(page) for page in pages]
+    assert all(stats['pages'] == 5 and stats['errors'] == 0 for stats in pipeline.stats.values())
+
+def test_stop_refuses_new_pages_but_finishes_submitted_ones():
+    log = []
+    pipeline = make_pipeline(log, io_workers=2)
+    assert pipeline.submit(['a'])
+    assert request_shutdown() >= 1
+    assert not pipeline.submit(['b'])
+    pipeline.close()
+
+    assert ('respond', ('a',)) in log
+    assert all(item != ('b',) for _, item in log)
+    assert not pipeline.submit(['c'])
+
+def test_failed_pages_are_counted_and_reported():
+    log, errors = [], []
+    pipeline = make_pipeline(
+        log, fail={'fetch': {('a',)}, 'categorize': {('b',)}}, io_workers=1,
+        on_error=lambda stage, page: errors.append((stage, tuple(page)))
+    )
+    for page in (['a'], ['b'], ['c']):
+        pipeline.submit(page)
+    pipeline.close()
+
+    assert sorted(errors) == [('categorize', ('b',)), ('fetch', ('a',))]
+    assert pipeline.stats['fetch'] == {**pipeline.stats['fetch'], 'pages': 3, 'errors': 1}
+    assert pipeline.stats['categorize'] == {**pipeline.stats['categorize'], 'pages': 2, 'errors': 1}
+    assert [item for stage, item in log if stage == 'respond'] == [('c',)]
+
+def test_pages_fail_when_the_worker_service_cannot_be_built():
+    def broken_factory():
+        raise OSError("no network")
+
+    log, errors = [], []
+    pipeline = make_pipeline(log, service_factory=broken_factory, io_workers=1,
+                             on_error=lambda stage, page: errors.append(stage))
+    pipeline.submit(['a'])
+    pipeline.close()
+
+    assert errors == ['fetch']
+    assert log == []
+
+def test_context_manager_closes_the_pipeline():
+    log = []
+    with make_pipeline(log) as pipeline:
+        pipeline.submit(['a'])
+    assert ('respond', ('a',)) in log
+    assert not pipeline.submit(['b'])
+
+class FakeCredentials:
+    pass
+
+class FakeService:
+    def __init__(self, creds):
+        self._http = type('Http', (), {'credentials': creds})()
+
+def test_worker_services_are_reused_by_the_next_pipeline(monkeypatch):
+    from gmail_ai_bot import bot
+
+    built = []
+    monkeypatch.setattr(bot, 'build_gmail_service', lambda creds: built.append(creds) or object())
+    monkeypatch.setattr(bot, '_gmail_service_pool', None)
+    creds = FakeCredentials()
+
+    for _ in range(3):
+        pool = bot.get_gmail_service_pool(FakeService(creds))
+        pipeline = make_pipeline([], service_factory=pool.acquire, service_release=pool.release, io_workers=2)
+        pipeline.submit(['a'])
+        pipeline.close()
+
+    # Two fetch workers and the respond worker
+    assert built == [creds] * 3
+
+    # New credentials, e.g. after authenticating again, get services of their own
+    assert bot.get_gmail_service_pool(FakeService(FakeCredentials())) is not pool
+    assert bot.get_gmail_service_pool(object()) is None
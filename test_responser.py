@@ -0,0 +1,189 @@
+import asyncio
+import itertools
+
+import pytest
+
+from gmail_ai_bot import responser
+from gmail_ai_bot.config import RESPONSE_CATEGORIES
+
+class FakeRequest:
+    def __init__(self, function):
+        self.function = function
+
+    def execute(self):
+        return self.function()
+
+class FakeDrafts:
+    """Gmail drafts of a mailbox; like Gmail, each save gives the draft a new message ID."""
+
+    def __init__(self):
+        self.drafts = {}
+        self.calls = []
+        self._ids = itertools.count(1)
+
+    def _save(self, draft_id, body):
+        self.drafts[draft_id] = {'id': draft_id, 'message': dict(body['message'], id=f"msg-{next(self._ids)}")}
+        return self.drafts[draft_id]
+
+    def create(self, userId, body):
+        self.calls.append('create')
+        return FakeRequest(lambda: self._save(f"draft-{len(self.drafts) + 1}", body))
+
+    def update(self, userId, id, body):
+        self.calls.append('update')
+        return FakeRequest(lambda: self._save(id, body))
+
+    def get(self, userId, id, format=None):
+        return FakeRequest(lambda: self.drafts[id])
+
+    def edit(self, draft_id):
+        """Save the draft as the user would in the Gmail editor."""
+        self._save(draft_id, self.drafts[draft_id])
+
+class FakeService:
+    def __init__(self):
+        self.fake_drafts = FakeDrafts()
+
+    def users(self):
+        return self
+
+    def drafts(self):
+        return self.fake_drafts
+
+    def threads(self):
+        return self
+
+    def get(self, **kwargs):
+        def fail():
+            raise OSError("Thread not available")
+        return FakeRequest(fail)
+
+@pytest.fixture
+def service(database):
+    return FakeService()
+
+def draft(service, message_id):
+    responser.create_draft(service, 'Question', f"Answer to {message_id}", message_id, 'bob@example.com',
+                           thread_id='thread-1')
+
+def test_thread_draft_is_updated_while_unedited(service):
+    draft(service, 'm1')
+    draft(service, 'm2')
+
+    assert service.fake_drafts.calls == ['create', 'update']
+    assert list(service.fake_drafts.drafts) == ['draft-1']
+    assert responser.get_thread_draft('thread-1')[:2] == ('draft-1', 'm2')
+
+def test_thread_draft_edited_by_the_user_is_kept(service):
+    draft(service, 'm1')
+    service.fake_drafts.edit('draft-1')
+    edited = dict(service.fake_drafts.drafts['draft-1'])
+    draft(service, 'm2')
+
+    assert service.fake_drafts.calls == ['create', 'create']
+    assert service.fake_drafts.drafts['draft-1'] == edited
+    assert responser.get_thread_draft('thread-1')[:2] == ('draft-2', 'm2')
+
+    # The new draft is the one updated from now on
+    draft(service, 'm3')
+    assert service.fake_drafts.calls[-1] == 'update'
+    assert responser.get_thread_draft('thread-1')[:2] == ('draft-2', 'm3')
+
+def test_coalesce_threads_groups_emails_oldest_first():
+    emails = [
+        {'message_id': 'b', 'thread_id': 't1', 'internal_date': 2},
+        {'message_id': 'c'},
+        {'message_id': 'a', 'thread_id': 't1', 'internal_date': 1},
+    ]
+    threads = responser.coalesce_threads(emails)
+
+    assert [email['message_id'] for email in threads['t1']] == ['a', 'b']
+    assert [email['message_id'] for email in threads['c']] == ['c']
+
+def test_a_thread_gets_one_draft_answering_its_latest_message_needing_a_response(service, monkeypatch):
+    prompts, drafts = [], []
+
+    async def agenerate_response(prompt):
+        prompts.append(prompt)
+        return 'Reply'
+
+    monkeypatch.setattr(responser, 'agenerate_response', agenerate_response)
+    monkeypatch.setattr(responser, 'create_draft', lambda *args: drafts.append(args))
+    response_category = sorted(RESPONSE_CATEGORIES)[0]
+    emails = [
+        dict(message_id=message_id, thread_id='t1', internal_date=date, category=category, subject=subject,
+             body=f"Body of {message_id}", sender_email='bob@example.com')
+        for message_id, date, category, subject in [
+            ('notification', 3, 'not important', 'Re: Plan'),
+            ('question', 2, response_category, 'Re: Plan'),
+            ('plan', 1, response_category, 'Plan'),
+        ]
+    ]
+    responser.auto_respond_many(service, emails)
+
+    assert len(drafts) == 1
+    assert drafts[0][3] == 'question'
+    assert drafts[0][-1] == ['plan', 'question']
+    # The thread can't be fetched, the earlier messages of the run are the context
+    assert 'Body of plan' in prompts[0]
+
+class FakeGenerator:
+    """Text generator returning the given responses in turn, raising the ones that are exceptions."""
+
+    provider = 'fake'
+    model = 'fake-model'
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def _next(self):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def generate_text(self, prompt, max_tokens, fallback=True, **kwargs):
+        assert not fallback
+        return self._next()
+
+    async def agenerate_text(self, prompt, max_tokens, fallback=True, **kwargs):
+        assert not fallback
+        return self._next()
+
+@pytest.fixture
+def response_cache(database, monkeypatch):
+    monkeypatch.setattr(responser, 'RESPONSE_CACHE_ENABLED', True)
+    return responser
+
+def test_only_successful_responses_are_cached(response_cache, monkeypatch):
+    generator = FakeGenerator(RuntimeError('down'), None, '', 'Draft', 'Other draft')
+    monkeypatch.setattr(response_cache, 'get_text_generator', lambda: generator)
+
+    assert response_cache.generate_response('prompt') is None
+    assert response_cache.generate_response('prompt') is None
+    assert response_cache.generate_response('prompt') == ''
+    assert response_cache.generate_response('prompt') == 'Draft'
+    assert response_cache.generate_response('prompt') == 'Draft'
+    assert generator.responses == ['Other draft']
+
+def test_only_successful_async_responses_are_cached(response_cache, monkeypatch):
+    generator = FakeGenerator(RuntimeError('down'), 'Draft', 'Other draft')
+    monkeypatch.setattr(response_cache, 'get_text_generator', lambda: generator)
+
+    assert asyncio.run(response_cache.agenerate_response('prompt')) is None
+    assert asyncio.run(response_cache.agenerate_response('prompt')) == 'Draft'
+    assert asyncio.run(response_cache.agenerate_response('prompt')) == 'Draft'
+    assert generator.responses == ['Other draft']
+
+def test_the_cache_can_be_bypassed(response_cache, monkeypatch):
+    generator = FakeGenerator('Draft', 'Other draft', 'Third draft')
+    monkeypatch.setattr(response_cache, 'get_text_generator', lambda: generator)
+
+    assert response_cache.generate_response('prompt') == 'Draft'
+    assert response_cache.generate_response('prompt', use_cache=False) == 'Other draft'
+    assert asyncio.run(response_cache.agenerate_response('prompt', use_cache=False)) == 'Third draft'
+    assert response_cache.generate_response('prompt') == 'Draft'
+
+def test_truncate_text_keeps_its_max_tokens_keyword():
+    assert responser.truncate_text('one  two\nthree four', max_tokens=3) == 'one two three'
+    assert responser.truncate_text('one two', 5) == 'one two'
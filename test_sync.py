@@ -0,0 +1,108 @@
+import functools
+
+from gmail_ai_bot import bot
+
+def stored_checkpoint():
+    return bot.get_sync_state(bot.HISTORY_ID_KEY)
+
+def test_first_run_lists_everything_and_stores_the_checkpoint(run):
+    run.gmail.add_message('m1', 'Urgent: call me')
+    run.gmail.add_message('m2', 'Newsletter')
+    run()
+
+    assert run.responded == ['m1']
+    assert run.gmail.list_calls and not run.gmail.history_calls
+    assert stored_checkpoint() == str(run.gmail.history_id)
+    assert 'UNREAD' not in run.gmail.mailbox['m2']['labelIds']
+
+def test_later_runs_only_list_new_mail(run):
+    run.gmail.add_message('m1', 'Urgent: call me')
+    run()
+    checkpoint = stored_checkpoint()
+    run.gmail.add_message('m2', 'Urgent: second')
+    run()
+
+    assert run.gmail.history_calls[-1]['startHistoryId'] == checkpoint
+    assert run.responded == ['m1', 'm2']
+    assert stored_checkpoint() == str(run.gmail.history_id)
+
+def test_failed_messages_hold_the_checkpoint_and_are_retried_once_per_run(run):
+    run.gmail.add_message('m1', 'Urgent: call me')
+    run.failing_drafts.add('m1')
+    run()
+    assert stored_checkpoint() is None
+    assert bot.load_retry_message_ids() == {'m1': 1}
+
+    # The message is listed again and is on the retry list, it is still only processed once
+    run.failing_drafts.clear()
+    run()
+    assert run.responded == ['m1', 'm1']
+    assert bot.load_retry_message_ids() == {}
+    assert stored_checkpoint() == str(run.gmail.history_id)
+
+def test_retried_messages_that_fail_again_do_not_hold_the_checkpoint(run):
+    run.gmail.add_message('m1', 'Urgent: call me')
+    run.failing_drafts.add('m1')
+    run()
+    run()
+
+    assert bot.load_retry_message_ids() == {'m1': 2}
+    assert stored_checkpoint() == str(run.gmail.history_id)
+
+def test_messages_are_given_up_on_after_the_maximum_attempts(run, monkeypatch):
+    monkeypatch.setattr(bot, 'update_retry_attempts', functools.partial(bot.update_retry_attempts, max_attempts=2))
+    run.gmail.add_message('m1', 'Urgent: call me')
+    run.failing_drafts.add('m1')
+    run()
+    run()
+    assert bot.load_retry_message_ids() == {}
+
+    run()
+    assert run.responded == ['m1', 'm1']
+
+def test_handled_and_deleted_messages_leave_the_retry_list(run):
+    for message_id in ('read', 'archived', 'deleted', 'waiting'):
+        run.gmail.add_message(message_id, 'Urgent: call me')
+    run.failing_drafts.update(['read', 'archived', 'deleted', 'waiting'])
+    run()
+    assert set(bot.load_retry_message_ids()) == {'read', 'archived', 'deleted', 'waiting'}
+
+    run.gmail.mailbox['read']['labelIds'].remove('UNREAD')
+    run.gmail.mailbox['archived']['labelIds'].remove('INBOX')
+    del run.gmail.mailbox['deleted']
+    run()
+
+    assert run.responded.count('waiting') == 2
+    assert all(run.responded.count(message_id) == 1 for message_id in ('read', 'archived', 'deleted'))
+    assert bot.load_retry_message_ids() == {'waiting': 2}
+
+def test_messages_deleted_before_their_fetch_are_not_failures(run):
+    run.gmail.add_message('m1', 'Urgent: call me')
+    run.gmail.add_message('m2', 'Urgent: gone soon')
+    original_get = run.gmail._get
+
+    def get_after_delete(message_id, kwargs):
+        run.gmail.mailbox.pop('m2', None)
+        return original_get(message_id, kwargs)
+
+    run.gmail._get = get_after_delete
+    run()
+
+    assert run.responded == ['m1']
+    assert bot.load_retry_message_ids() == {}
+    assert stored_checkpoint() == str(run.gmail.history_id)
+
+def test_retry_list_is_kept_when_labels_cannot_be_read(run):
+    run.gmail.add_message('m1', 'Urgent: call me')
+    run.failing_drafts.add('m1')
+    run()
+
+    run.gmail.failing_gets.add('m1')
+    run()
+    assert bot.load_retry_message_ids() == {'m1': 2}
+
+def test_update_retry_attempts():
+    assert bot.update_retry_attempts({'a': 1, 'b': 2, 'c': 1}, {'a', 'new'}, deferred_ids=['c'], max_attempts=3) == {
+        'a': 2, 'new': 1, 'c': 1
+    }
+    assert bot.update_retry_attempts({'a': 2}, {'a'}, max_attempts=3) == {}
@@ -0,0 +1,49 @@
+import csv
+import os
+
+from gmail_ai_bot.training_data import TrainingDataWriter, convert_csv, iter_training_data, list_shards
+
+def test_entries_are_buffered_until_the_buffer_is_full(tmp_path):
+    writer = TrainingDataWriter(str(tmp_path), buffer_size=3)
+    writer.append('One', 'Body', 'important')
+    writer.append('Two', 'Body', 'not important')
+    assert len(writer) == 2 and list_shards(str(tmp_path)) == []
+
+    writer.append('Three', 'Grüße ✓', 'important')
+    assert len(writer) == 0
+    assert [entry['subject'] for entry in iter_training_data(str(tmp_path))] == ['One', 'Two', 'Three']
+    assert list(iter_training_data(str(tmp_path), categories={'important'}))[1]['body'] == 'Grüße ✓'
+
+def test_shards_are_rotated_and_read_in_write_order(tmp_path):
+    writer = TrainingDataWriter(str(tmp_path), buffer_size=100, max_shard_bytes=1)
+    for index in range(12):
+        writer.append(f"Subject {index}", 'Body', 'important')
+        if index % 4 == 3:
+            writer.flush()
+
+    shards = list_shards(str(tmp_path))
+    assert [os.path.basename(path) for path in shards] == ['part-00000.jsonl.gz', 'part-00001.jsonl.gz',
+                                                            'part-00002.jsonl.gz']
+    assert [entry['subject'] for entry in iter_training_data(str(tmp_path))] == [f"Subject {i}" for i in range(12)]
+
+def test_flushes_append_to_the_current_shard(tmp_path):
+    writer = TrainingDataWriter(str(tmp_path), buffer_size=100)
+    for subject in ('First', 'Second'):
+        writer.append(subject, 'Body', 'important')
+        writer.flush()
+
+    assert len(list_shards(str(tmp_path))) == 1
+    assert [entry['subject'] for entry in iter_training_data(str(tmp_path))] == ['First', 'Second']
+
+def test_legacy_csv_is_converted(tmp_path):
+    csv_path = tmp_path / 'email_training_data.csv'
+    with open(csv_path, 'w', newline='', encoding='utf-8') as file:
+        rows = csv.writer(file)
+        rows.writerow(['subject', 'body', 'category'])
+        rows.writerow(['Hello', 'Line one\nline two, with a comma', 'important'])
+
+    writer = TrainingDataWriter(str(tmp_path / 'shards'))
+    assert convert_csv(str(csv_path), writer) == 1
+    assert list(iter_training_data(str(tmp_path / 'shards'))) == [
+        {'subject': 'Hello', 'body': 'Line one\nline two, with a comma', 'category': 'important'}
+    ]